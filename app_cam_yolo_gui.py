@@ -1,20 +1,1907 @@
-import threading
+# STARTUP_T0 se toma antes que el resto de imports para que la traza de arranque incluya lo que tardan
+# cv2, numpy, tkinter y PIL; por eso los imports que siguen no están al principio del archivo (E402).
+# ruff: noqa: E402
 import time
+STARTUP_T0 = time.perf_counter()  # origen de la traza de arranque
+import threading
+import sys
 import cv2
-import torch
-from ultralytics import YOLO
-from tkinter import Tk, Label, Button, Entry, StringVar, DoubleVar, Scale, HORIZONTAL, filedialog, ttk
+import numpy as np
+from tkinter import Tk, Toplevel, Label, Button, Entry, StringVar, DoubleVar, IntVar, BooleanVar, Scale, HORIZONTAL, filedialog, ttk
 from PIL import Image, ImageTk
 import os
 import json
 import tempfile
-from yt_dlp import YoutubeDL
+import math
+import re
+import argparse
+import csv
+import glob
+import queue
+import hashlib
+import shutil
+import sqlite3
+import signal
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, Future, TimeoutError as FutureTimeout
+from urllib.parse import urlparse, parse_qs
+from email.parser import BytesParser
+from email import policy as email_policy
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from bisect import bisect_right
+
+try:
+    import av  # PyAV (opcional): lista de keyframes sin decodificar todo el video
+except ImportError:
+    av = None
+
+# torch y Ultralytics tardan varios segundos en importarse: se cargan con load_ml(), en la interfaz
+# en segundo plano con la ventana ya visible. yt_dlp se importa solo al usar fuentes remotas.
+torch = YOLO = Results = colors = None
+_ml_lock = threading.Lock()
+
+
+def load_ml():
+    """Importa torch y Ultralytics una sola vez (bloquea si otro hilo ya lo está haciendo)."""
+    global torch, YOLO, Results, colors
+    with _ml_lock:
+        if YOLO is None:
+            import torch
+            from ultralytics.engine.results import Results
+            from ultralytics.utils.plotting import colors
+            from ultralytics import YOLO
 
 SETTINGS_FILE = "settings.json"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+QUANT_BACKENDS = ("onnx-int8", "openvino-int8")  # requieren calibrar antes con el subcomando quantize
+BACKENDS = ("torch", "onnx", "openvino") + QUANT_BACKENDS
+MODEL_CACHE_DIR = "model_cache"
+VIDEO_INDEX_DIR = "video_index"
+PRED_CACHE_DIR = "pred_cache"
+REMOTE_CACHE_DIR = "remote_cache"
+# Un solo archivo progresivo (sin fusionar audio/video) para poder reproducirlo mientras se descarga
+REMOTE_FORMAT = "best[ext=mp4][protocol^=http]/best[protocol^=http]/best"
+GRID_TILE = (640, 360)
+
+# --- Métricas de rendimiento por etapa ---
+class StageMetrics:
+    """Tiempos por fuente y etapa en ventanas deslizantes; percentiles p50/p95/p99 bajo demanda."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.counts = {}
+
+    def add(self, source, stage, ms):
+        key = (str(source), stage)
+        with self.lock:
+            ring = self.samples.get(key)
+            if ring is None:
+                ring = self.samples[key] = deque(maxlen=self.window)
+            ring.append(ms)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def summary(self):
+        with self.lock:
+            items = [(key, np.array(ring, dtype=np.float64), self.counts[key]) for key, ring in self.samples.items()]
+        rows = []
+        for (source, stage), values, count in sorted(items, key=lambda x: x[0]):
+            if not len(values):
+                continue
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            rows.append({"source": source, "stage": stage, "count": count, "mean_ms": float(values.mean()),
+                         "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)})
+        return rows
+
+    def prometheus(self):
+        lines = ["# HELP inspeccion_stage_ms Tiempo por etapa (ventana deslizante) en milisegundos",
+                 "# TYPE inspeccion_stage_ms summary"]
+        for row in self.summary():
+            source = row["source"].replace("\\", "\\\\").replace('"', '\\"')
+            labels = f'source="{source}",stage="{row["stage"]}"'
+            for q, field in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                lines.append(f'inspeccion_stage_ms{{{labels},quantile="{q}"}} {row[field]:.3f}')
+            lines.append(f"inspeccion_stage_ms_count{{{labels}}} {row['count']}")
+        return "\n".join(lines) + "\n"
+
+    def dump_csv(self, path):
+        rows = self.summary()
+        if not rows:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        new_file = not os.path.exists(path)
+        stamp = datetime.now().isoformat(timespec="seconds")
+        with open(path, "a", encoding="utf-8", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=["timestamp"] + list(rows[0].keys()))
+            if new_file:
+                w.writeheader()
+            for row in rows:
+                w.writerow({"timestamp": stamp, **{k: round(v, 3) if isinstance(v, float) else v
+                                                   for k, v in row.items()}})
+
+
+def start_metrics_server(metrics, port, host="127.0.0.1"):
+    """Servidor HTTP local: /metrics (formato Prometheus) y /metrics.json."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body = json.dumps(metrics.summary(), ensure_ascii=False).encode("utf-8")
+                ctype = "application/json"
+            elif self.path.startswith("/metrics"):
+                body = metrics.prometheus().encode("utf-8")
+                ctype = "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # sin una línea de log por cada consulta
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StartupTrace:
+    """Tiempos del arranque desde el inicio del proceso; cada arranque se añade a un JSONL para comparar versiones."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.marks = {}
+        self.written = False
+
+    def mark(self, name):
+        with self.lock:
+            self.marks.setdefault(name, time.perf_counter() - STARTUP_T0)
+
+    def write(self):
+        with self.lock:
+            if self.written:
+                return
+            self.written = True
+            marks = {k: round(v, 3) for k, v in self.marks.items()}
+        print("[INFO] Arranque: " + " | ".join(f"{k} {v:.2f} s" for k, v in marks.items()))
+        if not self.path:
+            return
+        versions = {"python": sys.version.split()[0], "opencv": cv2.__version__}
+        if torch is not None:
+            import ultralytics
+            versions.update(torch=torch.__version__, ultralytics=ultralytics.__version__)
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"timestamp": datetime.now().isoformat(timespec="seconds"),
+                                    "marks": marks, **versions}) + "\n")
+        except OSError as e:
+            print(f"[WARN] No se pudo guardar la traza de arranque: {e}")
+
+
+# Frame capturado con su instante de captura, número de secuencia y posición (solo video local).
+# `full`: función que da el frame a resolución completa cuando la captura sale ya escalada (AVCapture)
+CapturedFrame = namedtuple("CapturedFrame", "frame ts seq pos full", defaults=(None,))
+
+
+NETWORK_SCHEMES = ("rtsp://", "rtsps://", "rtmp://", "http://", "https://", "udp://", "tcp://")
+_capture_env_lock = threading.Lock()
+
+
+def open_capture(source, transport="tcp", buffer_size=1, open_timeout_ms=5000, read_timeout_ms=5000,
+                 backend="opencv", max_side=0, threads=0):
+    """Abre una fuente con captura de baja latencia.
+
+    En streams de red: transporte RTSP (tcp/udp), sin buffer de FFmpeg y con timeouts de apertura y
+    lectura para que un corte no bloquee `read()` indefinidamente. Con backend="pyav" los archivos y
+    streams se leen con AVCapture (varios hilos, salida escalada a `max_side`); las webcams siguen en OpenCV.
+    """
+    network = isinstance(source, str) and source.lower().startswith(NETWORK_SCHEMES)
+    if backend == "pyav" and av is not None and not isinstance(source, int):
+        options, timeout = {}, None
+        if network:
+            options = {"fflags": "nobuffer", "flags": "low_delay"}
+            if source.lower().startswith(("rtsp://", "rtsps://")):
+                options["rtsp_transport"] = transport
+            timeout = (open_timeout_ms / 1000.0, read_timeout_ms / 1000.0)
+        return AVCapture(source, max_side, threads, options, timeout)
+    if backend == "pyav" and av is None:
+        print("[WARN] CAPTURE_BACKEND=pyav requiere PyAV (pip install av); se usa OpenCV")
+    if network:
+        opts = [f"timeout;{int(read_timeout_ms) * 1000}", "fflags;nobuffer", "flags;low_delay"]
+        if source.lower().startswith(("rtsp://", "rtsps://")):
+            opts.insert(0, f"rtsp_transport;{transport}")
+        params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(open_timeout_ms), cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(read_timeout_ms)]
+        # OpenCV lee las opciones de FFmpeg de una variable de entorno al abrir: se protege con un lock
+        with _capture_env_lock:
+            previous = os.environ.get("OPENCV_FFMPEG_CAPTURE_OPTIONS")
+            os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "|".join(opts)
+            try:
+                cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG, params)
+            finally:
+                if previous is None:
+                    os.environ.pop("OPENCV_FFMPEG_CAPTURE_OPTIONS", None)
+                else:
+                    os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = previous
+    else:
+        cap = cv2.VideoCapture(source)
+    if cap.isOpened() and (network or isinstance(source, int)):
+        # Cola interna mínima: siempre el frame más reciente
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+    return cap
+
+
+class AVCapture:
+    """Lectura con FFmpeg vía PyAV: decodificación en varios hilos y frames ya escalados a `max_side`.
+
+    Imita lo que el resto del programa usa de cv2.VideoCapture. El frame decodificado a resolución
+    completa se conserva sin convertir; solo se pasa a BGR si alguien lo pide (capturas).
+    """
+
+    def __init__(self, source, max_side=0, threads=0, options=None, timeout=None):
+        self.max_side = int(max_side)
+        self.threads = int(threads)
+        self.options = options or {}
+        self.timeout = timeout
+        self.container = None
+        self.open(source)
+
+    def open(self, source):
+        self.release()
+        try:
+            container = av.open(str(source), options=self.options, timeout=self.timeout)
+            stream = container.streams.video[0]
+        except Exception as e:
+            print(f"[WARN] PyAV no pudo abrir {source}: {e}")
+            return False
+        # Hilos por frame y por slice; independiente de la GPU o del hardware de decodificación
+        stream.thread_type = "AUTO"
+        stream.thread_count = self.threads
+        self.container, self.stream = container, stream
+        w, h = stream.codec_context.width, stream.codec_context.height
+        self.source_size = (w, h)
+        if self.max_side > 0 and max(w, h) > self.max_side:
+            self.scale = self.max_side / max(w, h)
+            # Dimensiones pares: lo que esperan los conversores de FFmpeg para YUV 4:2:0
+            self.size = (max(2, int(w * self.scale) // 2 * 2), max(2, int(h * self.scale) // 2 * 2))
+        else:
+            self.scale, self.size = 1.0, (w, h)
+        rate = stream.average_rate or stream.guessed_rate
+        self.fps = float(rate) if rate else 0.0
+        self.frame_count = stream.frames or (
+            int(float(stream.duration * stream.time_base) * self.fps) if stream.duration and self.fps else 0)
+        self.start_pts = stream.start_time or 0
+        self.pos = 0
+        self._frames = container.decode(stream)
+        self._pending = None
+        self._last = None
+        return True
+
+    def isOpened(self):
+        return self.container is not None
+
+    def release(self):
+        if self.container is not None:
+            try:
+                self.container.close()
+            except Exception:
+                pass
+        self.container = None
+        self._last = self._pending = None
+
+    def _index(self, frame):
+        if frame.pts is None or not self.fps:
+            return None
+        return int(round(float((frame.pts - self.start_pts) * self.stream.time_base) * self.fps))
+
+    def grab(self):
+        if self.container is None:
+            return False
+        frame, self._pending = self._pending, None
+        if frame is None:
+            try:
+                frame = next(self._frames)
+            except Exception:
+                # Fin del archivo o error de red: lo gestiona FrameGrabber igual que con OpenCV
+                self._last = None
+                return False
+        self._last = frame
+        index = self._index(frame)
+        self.pos = self.pos + 1 if index is None else index + 1
+        return True
+
+    def retrieve(self, image=None):
+        if self._last is None:
+            return False, None
+        # Escalado y conversión a BGR en una sola pasada de swscale
+        w, h = self.size
+        frame = self._last.to_ndarray(width=w, height=h, format="bgr24", interpolation="AREA")
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            frame = image
+        return True, frame
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def full_frame_getter(self):
+        """Función que devuelve el último frame a resolución completa en BGR, o None si ya sale sin escalar."""
+        if self._last is None or self.scale == 1.0:
+            return None
+        frame = self._last
+        return lambda: frame.to_ndarray(format="bgr24")
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.frame_count)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.pos)
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.size[0])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.size[1])
+        return 0.0
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES or self.container is None or not self.fps:
+            return False
+        # Salto al keyframe anterior y decodificación hasta el frame pedido
+        target = max(0, int(value))
+        pts = self.start_pts + int(target / self.fps / self.stream.time_base)
+        try:
+            self.container.seek(pts, stream=self.stream, backward=True, any_frame=False)
+        except Exception:
+            return False
+        self._frames = self.container.decode(self.stream)
+        self._pending = None
+        for frame in self._frames:
+            index = self._index(frame)
+            if index is None or index >= target:
+                self._pending = frame
+                break
+        self.pos = target
+        return True
+
+
+class VideoIndex:
+    """Índice de keyframes y miniaturas de un video local, construido una vez y cacheado en disco."""
+
+    VERSION = 1
+
+    def __init__(self, path, fps, frame_count, keyframes, thumb_frames, thumb_offsets, thumb_blob):
+        self.path = path
+        self.fps = fps
+        self.frame_count = frame_count
+        self.keyframes = [int(k) for k in keyframes]  # números de frame, ordenados
+        self.thumb_frames = [int(f) for f in thumb_frames]
+        self.thumb_offsets = thumb_offsets  # JPEG concatenados en thumb_blob
+        self.thumb_blob = thumb_blob
+        self._decoded = {}
+
+    @classmethod
+    def cache_path(cls, path, cache_dir=VIDEO_INDEX_DIR):
+        st = os.stat(path)
+        key = hashlib.sha256(f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{cls.VERSION}".encode()).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(cache_dir, f"{stem}_{key}.npz")
+
+    @classmethod
+    def load_or_build(cls, path, cache_dir=VIDEO_INDEX_DIR, thumb_width=160):
+        """Devuelve (índice, reutilizado de la caché)."""
+        cache = cls.cache_path(path, cache_dir)
+        if os.path.exists(cache):
+            try:
+                with np.load(cache) as data:
+                    fps, count = data["meta"]
+                    return cls(path, float(fps), int(count), data["keyframes"], data["thumb_frames"],
+                               data["thumb_offsets"], data["thumb_blob"]), True
+            except Exception as e:
+                print(f"[WARN] Índice de video dañado, se reconstruye: {e}")
+        index = cls.build(path, thumb_width)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = cache + ".tmp.npz"
+        np.savez(tmp, meta=np.array([index.fps, index.frame_count]), keyframes=np.array(index.keyframes, dtype=np.int64),
+                 thumb_frames=np.array(index.thumb_frames, dtype=np.int64), thumb_offsets=index.thumb_offsets,
+                 thumb_blob=index.thumb_blob)
+        os.replace(tmp, cache)
+        return index, False
+
+    @classmethod
+    def build(cls, path, thumb_width=160):
+        if av is not None:
+            try:
+                return cls._build_av(path, thumb_width)
+            except Exception as e:
+                print(f"[WARN] PyAV no pudo indexar {path}: {e}. Se usa OpenCV")
+        return cls._build_cv(path, thumb_width)
+
+    @staticmethod
+    def _encode_thumbs(thumbs):
+        blobs = [cv2.imencode(".jpg", t, [cv2.IMWRITE_JPEG_QUALITY, 70])[1] for t in thumbs]
+        offsets = np.cumsum([0] + [len(b) for b in blobs]).astype(np.int64)
+        blob = np.concatenate(blobs) if blobs else np.zeros(0, dtype=np.uint8)
+        return offsets, blob
+
+    @staticmethod
+    def _thumb(frame, width):
+        h, w = frame.shape[:2]
+        return cv2.resize(frame, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+
+    @classmethod
+    def _build_av(cls, path, thumb_width):
+        # Solo se decodifican los keyframes: una miniatura por keyframe y sus posiciones exactas
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            stream.codec_context.skip_frame = "NONKEY"
+            fps = float(stream.average_rate or stream.guessed_rate or 25.0)
+            start = stream.start_time or 0
+            keyframes, thumbs = [], []
+            for frame in container.decode(stream):
+                if frame.pts is None:
+                    continue
+                keyframes.append(int(round(float((frame.pts - start) * stream.time_base) * fps)))
+                thumbs.append(cls._thumb(frame.to_ndarray(format="bgr24"), thumb_width))
+            count = stream.frames
+        if not count:
+            cap = cv2.VideoCapture(path)
+            count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+        offsets, blob = cls._encode_thumbs(thumbs)
+        return cls(path, fps, count, keyframes, keyframes, offsets, blob)
+
+    @classmethod
+    def _build_cv(cls, path, thumb_width):
+        # Sin PyAV no se conocen los keyframes: un recorrido con grab() y una miniatura por segundo
+        cap = cv2.VideoCapture(path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        step = max(1, int(round(fps)))
+        thumb_frames, thumbs = [], []
+        i = 0
+        while cap.grab():
+            if i % step == 0:
+                ok, frame = cap.retrieve()
+                if ok:
+                    thumb_frames.append(i)
+                    thumbs.append(cls._thumb(frame, thumb_width))
+            i += 1
+        cap.release()
+        offsets, blob = cls._encode_thumbs(thumbs)
+        return cls(path, fps, i, [], thumb_frames, offsets, blob)
+
+    def keyframe_before(self, pos):
+        """Último keyframe en o antes de `pos`, o None si no se conocen los keyframes."""
+        i = bisect_right(self.keyframes, pos) - 1
+        return self.keyframes[i] if i >= 0 else None
+
+    def thumbnail(self, pos):
+        """Miniatura BGR más cercana anterior a `pos` (decodificadas bajo demanda, con caché)."""
+        i = bisect_right(self.thumb_frames, pos) - 1
+        if i < 0:
+            i = 0 if self.thumb_frames else -1
+        if i < 0:
+            return None
+        thumb = self._decoded.get(i)
+        if thumb is None:
+            data = self.thumb_blob[self.thumb_offsets[i]:self.thumb_offsets[i + 1]]
+            thumb = cv2.imdecode(data, cv2.IMREAD_COLOR)
+            if len(self._decoded) >= 256:
+                self._decoded.pop(next(iter(self._decoded)))
+            self._decoded[i] = thumb
+        return thumb
+
+
+class FrameGrabber:
+    """Hilo de captura por fuente que conserva solo el frame más reciente (buffer de 1 hueco)."""
+
+    SHORT_SKIP = 30  # sin índice de keyframes, saltos hacia delante menores que esto se avanzan con grab()
+
+    def __init__(self, cap, drop_frames=True, notify=None, metrics=None, name="",
+                 reopen=None, stale_s=5.0, frozen_s=10.0, backoff_max=30.0):
+        self.cap = cap
+        self.metrics = metrics
+        self.name = name
+        # Cámaras y streams: vigilancia y reconexión con espera exponencial (reopen=None la desactiva)
+        self.reopen = reopen
+        self.stale_s = stale_s  # segundos sin frames antes de reconectar
+        self.frozen_s = frozen_s  # segundos con la imagen idéntica antes de reconectar
+        self.backoff_max = backoff_max
+        self.state = "conectado"
+        self.reconnects = 0
+        self.read_failures = 0
+        self.last_ok = time.time()
+        self._signature = None
+        self._signature_since = 0.0
+        self._signature_checked = 0.0
+        # En cámaras en vivo se descartan frames viejos; en video local se espera al consumidor
+        self.drop_frames = drop_frames
+        # Evento compartido entre fuentes para despertar al hilo de inferencia
+        self.notify = notify or threading.Event()
+        self.cond = threading.Condition()
+        self.latest = None
+        self.seq = 0
+        self.dropped = 0
+        self.eof = False
+        self.running = False
+        self.thread = None
+        self._seek_to = None
+        self.index = None  # VideoIndex del archivo, si ya está construido
+        # Archivo que aún se está descargando: al llegar al final se reabre en lugar de terminar
+        self.growing = None
+        self.reopen_path = None
+        self.last_pos = 0
+        self._final_reopen = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+
+    def seek(self, pos):
+        # El salto lo ejecuta el hilo de captura, que es el único que toca self.cap
+        with self.cond:
+            self._seek_to = int(pos)
+            self.latest = None
+            self.eof = False
+            self.cond.notify_all()
+
+    def get(self, timeout=0.5):
+        """Devuelve (y consume) el frame más reciente, o None si no llega a tiempo."""
+        with self.cond:
+            if self.latest is None and self.running and not self.eof and timeout > 0:
+                self.cond.wait(timeout)
+            packet, self.latest = self.latest, None
+            self.cond.notify_all()
+            return packet
+
+    def _run(self):
+        while self.running:
+            with self.cond:
+                if not self.drop_frames:
+                    # Video local: no leer el siguiente frame hasta que se consuma el actual
+                    while self.running and self.latest is not None and self._seek_to is None:
+                        self.cond.wait(0.1)
+                seek_to, self._seek_to = self._seek_to, None
+            if not self.running:
+                break
+            if seek_to is not None:
+                self._seek(seek_to)
+
+            t_read = time.perf_counter()
+            ok, frame = self.cap.read()
+            full = self.cap.full_frame_getter() if ok and isinstance(self.cap, AVCapture) else None
+            ts = time.time()
+            if ok and self.metrics is not None:
+                self.metrics.add(self.name, "capture", (time.perf_counter() - t_read) * 1000.0)
+            if not ok:
+                if self.drop_frames:
+                    self.read_failures += 1
+                    if self.reopen is not None and ts - self.last_ok > self.stale_s:
+                        self._reconnect(f"sin frames durante {ts - self.last_ok:.0f} s")
+                    else:
+                        time.sleep(0.01)
+                    continue
+                if self.growing is not None and not self._final_reopen:
+                    # Final de lo descargado hasta ahora: esperar y reabrir en la misma posición.
+                    # Terminada la descarga se reabre una última vez para leer el resto.
+                    self._final_reopen = not self.growing.is_set()
+                    if not self._final_reopen:
+                        time.sleep(0.5)
+                    self.cap.open(self.reopen_path)
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.last_pos)
+                    continue
+                with self.cond:
+                    if self._seek_to is None:
+                        self.eof = True
+                        self.cond.notify_all()
+                        self.notify.set()
+                        # Esperar por si llega un salto (p.ej. "Inicio") antes de terminar
+                        while self.running and self._seek_to is None:
+                            self.cond.wait(0.1)
+                continue
+            pos = -1 if self.drop_frames else int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+            if pos >= 0:
+                self.last_pos = pos
+            self.last_ok = ts
+            if self.reopen is not None and self._is_frozen(frame, ts):
+                self._reconnect(f"imagen congelada durante {self.frozen_s:.0f} s")
+                continue
+
+            with self.cond:
+                if self._seek_to is not None:
+                    continue  # frame anterior al salto, obsoleto
+                if self.latest is not None:
+                    self.dropped += 1
+                self.seq += 1
+                self.latest = CapturedFrame(frame, ts, self.seq, pos, full)
+                self.cond.notify_all()
+            self.notify.set()
+
+    def _is_frozen(self, frame, now):
+        # Un decodificador atascado repite exactamente el mismo frame; una escena quieta real siempre tiene ruido
+        if now - self._signature_checked < 1.0:
+            return False
+        self._signature_checked = now
+        signature = cv2.resize(frame, (16, 9), interpolation=cv2.INTER_AREA)
+        if self._signature is None or cv2.absdiff(signature, self._signature).max() > 0:
+            self._signature = signature
+            self._signature_since = now
+            return False
+        return now - self._signature_since >= self.frozen_s
+
+    def _reconnect(self, reason):
+        self.state = "reconectando"
+        print(f"[WARN] {self.name}: {reason}, reconectando...")
+        delay = 1.0
+        while self.running:
+            try:
+                self.cap.release()
+            except Exception:
+                pass
+            cap = self.reopen()
+            if cap is not None and cap.isOpened():
+                self.cap = cap
+                self.reconnects += 1
+                self.state = "conectado"
+                self.last_ok = time.time()
+                self._signature = None
+                print(f"[OK] {self.name}: reconectado (reconexión n.º {self.reconnects})")
+                return
+            if cap is not None:
+                cap.release()
+            self.state = f"sin señal, reintento en {delay:.0f} s"
+            # Espera interrumpible por stop() (get() también notifica: se espera hasta el plazo)
+            deadline = time.time() + delay
+            with self.cond:
+                while self.running and time.time() < deadline:
+                    self.cond.wait(deadline - time.time())
+            delay = min(self.backoff_max, delay * 2)
+
+    def _seek(self, target):
+        # Avanzar con grab() cuesta decodificar los frames intermedios; un salto real cuesta decodificar
+        # desde el keyframe anterior al destino. Se elige lo más barato.
+        current = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        ahead = target - current
+        keyframe = self.index.keyframe_before(target) if self.index is not None else None
+        seek_cost = target - keyframe if keyframe is not None else self.SHORT_SKIP
+        if 0 <= ahead <= seek_cost:
+            for _ in range(ahead):
+                if not self.cap.grab():
+                    break
+        else:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+
+
+class ChangeDetector:
+    """Decide si hace falta inferir comparando una miniatura en gris con la de la última inferencia."""
+
+    def __init__(self, threshold=0.005, max_interval=2.0, size=(160, 90), pixel_delta=15):
+        self.threshold = threshold  # fracción de píxeles que deben cambiar
+        self.max_interval = max_interval  # segundos máximos sin inferencia completa
+        self.size = size
+        self.pixel_delta = pixel_delta
+        self.reference = None
+        self.last_infer = 0.0
+        self.total = 0
+        self.skipped = 0
+
+    def needs_inference(self, frame_bgr, now):
+        small = cv2.cvtColor(cv2.resize(frame_bgr, self.size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        self.total += 1
+        if self.reference is not None and now - self.last_infer < self.max_interval:
+            changed = np.count_nonzero(cv2.absdiff(small, self.reference) > self.pixel_delta) / small.size
+            if changed < self.threshold:
+                self.skipped += 1
+                return False
+        # Se compara siempre contra el frame de la última inferencia, no contra el anterior,
+        # para que un cambio lento no pase desapercibido
+        self.reference = small
+        self.last_infer = now
+        return True
+
+
+class QualityController:
+    """Ajusta imgsz y el salto de frames de inferencia para sostener unos FPS objetivo.
+
+    Los niveles van de más calidad (imgsz máximo, inferir todos los frames) a más rapidez
+    (imgsz mínimo, inferir 1 de cada `max_stride`). Solo se cambia de nivel cuando los FPS
+    suavizados llevan `hold_s` segundos fuera de la banda [low, high] x objetivo.
+    """
+
+    def __init__(self, target_fps, max_imgsz=640, min_imgsz=320, max_stride=4,
+                 low=0.9, high=1.3, hold_s=2.0, log=print):
+        self.target_fps = target_fps
+        self.levels = [(s, 1) for s in range(max_imgsz, min_imgsz - 1, -64)]
+        self.levels += [(self.levels[-1][0], n) for n in range(2, max_stride + 1)]
+        self.level = 0
+        self.low, self.high, self.hold_s = low, high, hold_s
+        self.fps = 0.0
+        self.log = log
+        self._out_since = None
+        self._last_change = time.time()
+        self._last_step = 0
+        # Espera para subir calidad; se duplica cada vez que una subida hay que deshacerla
+        self._up_hold = 2 * hold_s
+
+    @property
+    def imgsz(self):
+        return self.levels[self.level][0]
+
+    @property
+    def stride(self):
+        return self.levels[self.level][1]
+
+    def describe(self):
+        return f"imgsz {self.imgsz} · 1/{self.stride} frames"
+
+    def update(self, busy_s, frames, now):
+        """Registra el tiempo de trabajo de una iteración (sin contar la espera de frames)."""
+        # FPS alcanzables: lo que se podría procesar si no hubiera que esperar a la cámara
+        fps = frames / max(1e-6, busy_s)
+        self.fps = fps if self.fps <= 0 else 0.9 * self.fps + 0.1 * fps
+        if now - self._last_change < self.hold_s:
+            return False  # dejar que la medida se estabilice tras un cambio
+        if self.fps < self.target_fps * self.low and self.level < len(self.levels) - 1:
+            step = 1
+        elif self.fps > self.target_fps * self.high and self.level > 0:
+            step = -1
+        else:
+            self._out_since = None
+            return False
+        if self._out_since is None:
+            self._out_since = now
+        # Subir calidad exige más tiempo estable que bajarla
+        if now - self._out_since < (self.hold_s if step > 0 else self._up_hold):
+            return False
+        if step > 0 and self._last_step < 0 and now - self._last_change < 3 * self._up_hold:
+            self._up_hold = min(2 * self._up_hold, 120.0)  # la última subida no se sostuvo
+        elif step > 0:
+            self._up_hold = 2 * self.hold_s
+        before = self.describe()
+        self.level += step
+        self._last_step = step
+        self._out_since = None
+        self._last_change = now
+        self.log(f"[INFO] Calidad adaptativa: {before} -> {self.describe()} "
+                 f"(FPS {self.fps:.1f}, objetivo {self.target_fps:.1f})")
+        return True
+
+
+class StreamState:
+    """Estado de una fuente en modo multi-cámara: captura, último resultado y métricas."""
+
+    def __init__(self, index, source, cap, grabber, gate=None):
+        self.index = index
+        self.source = source
+        self.cap = cap
+        self.grabber = grabber
+        self.gate = gate or ChangeDetector()
+        self.name = f"{index + 1}: {self.short_name(source)}"
+        self.metric_name = self.short_name(source)
+        self.frame = None  # último frame anotado (RGB)
+        self.last = None  # último (frame BGR original, resultado) para capturas a resolución completa
+        self.last_full = None  # con captura escalada: función que da el último frame a resolución completa
+        self.fps = 0.0
+        self.latency_ms = 0.0
+        self.prev_time = None
+        self.frame_count = 0
+        self.clips = None  # EventClipRecorder si los clips de eventos están activos
+        self.file_hash = None  # videos locales: clave de la caché de predicciones
+        self.last_raw = None  # cajas en bruto del último resultado, para volver a filtrar en pausa
+
+    @staticmethod
+    def short_name(source):
+        # No mostrar credenciales de URLs RTSP en pantalla
+        source = re.sub(r"//[^/@]+@", "//", str(source))
+        return os.path.basename(source) if os.path.isfile(source) else source
+
+    def scale(self):
+        """Factor entre el frame decodificado y la fuente (1.0 salvo con AVCapture escalando)."""
+        return getattr(self.grabber.cap, "scale", 1.0)
+
+    def source_size(self, frame):
+        return getattr(self.grabber.cap, "source_size", None) or (frame.shape[1], frame.shape[0])
+
+    def tick(self, now):
+        if self.prev_time is not None:
+            fps = 1.0 / max(1e-6, now - self.prev_time)
+            self.fps = fps if self.fps <= 0 else 0.9 * self.fps + 0.1 * fps
+        self.prev_time = now
+
+    def add_latency(self, latency_ms):
+        self.latency_ms = latency_ms if self.latency_ms <= 0 else 0.8 * self.latency_ms + 0.2 * latency_ms
+
+    def release(self):
+        if self.clips is not None:
+            self.clips.close()
+        self.grabber.stop()
+        # Tras una reconexión el grabber tiene su propia captura nueva
+        for cap in {id(self.cap): self.cap, id(self.grabber.cap): self.grabber.cap}.values():
+            if cap and cap.isOpened():
+                cap.release()
+
+
+class MediaWriter:
+    """Escritura a disco (capturas, grabación y clips) en un hilo propio con cola acotada.
+
+    Si el disco no da abasto los trabajos se descartan y se cuentan en lugar de frenar la UI o la inferencia.
+    Los frames de video llevan su instante de captura: se repiten o se omiten para llenar los huecos de
+    1/fps del archivo, así el video dura lo mismo que la escena aunque la inferencia vaya a ritmo variable.
+    """
+
+    MAX_GAP_S = 1.0  # hueco mayor (pausa, reconexión) no se rellena con copias
+
+    def __init__(self, maxsize=128, fourcc="mp4v", log=print):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.fourcc = fourcc
+        self.log = log
+        self.videos = {}  # clave -> [ruta, fps, VideoWriter o None hasta el primer frame, tamaño, instante del siguiente hueco]
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, job, required=False):
+        # Abrir/cerrar videos no se puede perder: se espera un poco antes de rendirse
+        try:
+            if required:
+                self.queue.put(job, timeout=2.0)
+            else:
+                self.queue.put_nowait(job)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def save_image(self, path, frame_bgr, result=None, renderer=None):
+        """Guarda una imagen BGR; con `renderer` se anota en el hilo de escritura a resolución completa."""
+        return self.submit(("image", path, frame_bgr, result, renderer))
+
+    def open_video(self, key, path, fps, preroll=()):
+        """`preroll`: pares (instante, frame RGB) que se escriben al principio."""
+        return self.submit(("open", key, path, fps, list(preroll)), required=True)
+
+    def add_frame(self, key, frame_rgb, ts=None):
+        return self.submit(("frame", key, frame_rgb, ts))
+
+    def close_video(self, key):
+        return self.submit(("close", key), required=True)
+
+    def close(self, timeout=5.0):
+        self.submit(("stop",), required=True)
+        self.thread.join(timeout)
+
+    def _write_frame(self, key, frame_rgb, ts=None):
+        entry = self.videos.get(key)
+        if entry is None:
+            return
+        path, fps, writer, size, next_t = entry
+        if ts is None:
+            copies = 1
+        elif next_t is None or ts - next_t > self.MAX_GAP_S:
+            copies, entry[4] = 1, ts + 1.0 / fps
+        else:
+            # Cada frame ocupa los huecos de 1/fps hasta su instante: se repite si la inferencia va
+            # más lenta que `fps` y se omite si va más rápida
+            copies = 0
+            while next_t <= ts:
+                copies += 1
+                next_t += 1.0 / fps
+            entry[4] = next_t
+            if not copies:
+                return
+        if writer is None:
+            size = entry[3] = (frame_rgb.shape[1], frame_rgb.shape[0])
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            writer = entry[2] = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.fourcc), fps, size)
+        frame = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR)
+        if (frame.shape[1], frame.shape[0]) != size:
+            # La ventana cambió de tamaño: el video mantiene el tamaño del primer frame
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+        for _ in range(copies):
+            writer.write(frame)
+
+    def _close_video(self, key):
+        entry = self.videos.pop(key, None)
+        if entry is not None and entry[2] is not None:
+            entry[2].release()
+            self.log(f"[OK] Video guardado: {entry[0]}")
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            kind = job[0]
+            try:
+                if kind == "stop":
+                    for key in list(self.videos):
+                        self._close_video(key)
+                    return
+                if kind == "image":
+                    _, path, frame, result, renderer = job
+                    if renderer is not None:
+                        frame = renderer.render(frame, result, rgb=False)
+                    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                    ok, buf = cv2.imencode(os.path.splitext(path)[1] or ".jpg", frame)
+                    if not ok:
+                        raise IOError("no se pudo codificar la imagen")
+                    buf.tofile(path)
+                elif kind == "open":
+                    _, key, path, fps, preroll = job
+                    self.videos[key] = [path, fps, None, None, None]
+                    for ts, frame in preroll:
+                        self._write_frame(key, frame, ts)
+                elif kind == "frame":
+                    self._write_frame(job[1], job[2], job[3])
+                elif kind == "close":
+                    self._close_video(job[1])
+                self.written += 1
+            except Exception as e:
+                self.errors += 1
+                self.log(f"[WARN] Error de escritura ({kind}): {e}")
+
+
+class EventClipRecorder:
+    """Clip por fuente alrededor de cada detección: `pre_s` segundos previos y `post_s` tras la última."""
+
+    def __init__(self, writer, name, folder, fps, pre_s=3.0, post_s=3.0):
+        self.writer = writer
+        self.name = re.sub(r"[^\w.-]+", "_", name)[:40]
+        self.folder = folder
+        self.fps = fps
+        self.pre_s = pre_s
+        self.post_s = post_s
+        # Frames anotados de los últimos `pre_s` segundos con su instante (se guardan sin copiar)
+        self.preroll = deque()
+        self.clip = None
+        self.clips = 0
+        self.active_until = 0.0
+
+    def push(self, frame_rgb, defects, now):
+        if defects:
+            if self.clip is None:
+                self.clips += 1
+                self.clip = f"clip:{self.name}:{self.clips}"
+                path = os.path.join(self.folder, f"evento_{self.name}_{datetime.now():%Y%m%d_%H%M%S}.mp4")
+                self.writer.open_video(self.clip, path, self.fps, self.preroll)
+                self.preroll.clear()
+            self.active_until = now + self.post_s
+        if self.clip is None:
+            # Por tiempo y no por número de frames: el ritmo de la inferencia varía (calidad adaptativa,
+            # compuerta de cambios). Más de `fps` frames por segundo no aportan nada al clip
+            if not self.preroll or now - self.preroll[-1][0] >= 1.0 / self.fps:
+                self.preroll.append((now, frame_rgb))
+            while self.preroll and self.preroll[0][0] < now - self.pre_s:
+                self.preroll.popleft()
+            return
+        self.writer.add_frame(self.clip, frame_rgb, now)
+        if now >= self.active_until:
+            self.close()
+
+    def close(self):
+        if self.clip is not None:
+            self.writer.close_video(self.clip)
+            self.clip = None
+
+
+class DefectLog:
+    """Registro persistente de detecciones en SQLite.
+
+    La inferencia solo encola; un hilo escribe por lotes en una transacción cada `batch_size`
+    elementos o cada `flush_s` segundos. Si la cola se llena se descarta y se cuenta.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS frames (
+        id INTEGER PRIMARY KEY,
+        ts REAL NOT NULL,
+        source TEXT NOT NULL,
+        frame INTEGER,
+        defects INTEGER NOT NULL,
+        model_hash TEXT
+    );
+    CREATE TABLE IF NOT EXISTS detections (
+        id INTEGER PRIMARY KEY,
+        ts REAL NOT NULL,
+        source TEXT NOT NULL,
+        frame INTEGER,
+        class_id INTEGER,
+        class_name TEXT,
+        confidence REAL,
+        x1 REAL, y1 REAL, x2 REAL, y2 REAL,
+        model_hash TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_frames_ts ON frames(ts);
+    CREATE INDEX IF NOT EXISTS idx_frames_source_ts ON frames(source, ts);
+    CREATE INDEX IF NOT EXISTS idx_detections_ts ON detections(ts);
+    CREATE INDEX IF NOT EXISTS idx_detections_source_ts ON detections(source, ts);
+    CREATE INDEX IF NOT EXISTS idx_detections_class_ts ON detections(class_name, ts);
+    """
+
+    def __init__(self, path, batch_size=500, flush_s=1.0, maxsize=10000, log=print):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self.log = log
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.logged = 0
+        self.dropped = 0
+        self.errors = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connect(path) as conn:
+            conn.executescript(self.SCHEMA)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def connect(path):
+        conn = sqlite3.connect(path, timeout=10.0)
+        # WAL: las consultas no bloquean al escritor
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def record(self, ts, source, frame, result, names, model_hash=None, scale=1.0):
+        """Encola el resultado de un frame; la conversión de cajas se hace en el hilo de escritura.
+
+        `scale`: factor del frame inferido respecto a la fuente; las cajas se guardan en píxeles de la fuente.
+        """
+        try:
+            self.queue.put_nowait((ts, str(source), frame, result, names, model_hash, scale))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout=5.0):
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+    def _rows(self, item):
+        ts, source, frame, result, names, model_hash, scale = item
+        boxes = result_to_boxes(result, names) if result is not None else []
+        frame_row = (ts, source, frame, len(boxes), model_hash)
+        det_rows = [(ts, source, frame, b["class_id"], b["class_name"], b["confidence"],
+                     *(round(v / scale, 1) for v in b["box"]), model_hash)
+                    for b in boxes]
+        return frame_row, det_rows
+
+    def _run(self):
+        conn = self.connect(self.path)
+        stop = False
+        while not stop:
+            items = []
+            deadline = time.time() + self.flush_s
+            while len(items) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                items.append(item)
+            if not items:
+                continue
+            try:
+                frames, detections = [], []
+                for item in items:
+                    frame_row, det_rows = self._rows(item)
+                    frames.append(frame_row)
+                    detections.extend(det_rows)
+                with conn:
+                    conn.executemany("INSERT INTO frames (ts, source, frame, defects, model_hash) VALUES (?, ?, ?, ?, ?)", frames)
+                    conn.executemany("INSERT INTO detections (ts, source, frame, class_id, class_name, confidence, "
+                                     "x1, y1, x2, y2, model_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", detections)
+                self.logged += len(detections)
+            except Exception as e:
+                self.errors += 1
+                self.log(f"[WARN] No se pudieron guardar {len(items)} frames en {self.path}: {e}")
+        conn.close()
+
+
+def read_settings():
+    try:
+        if os.path.exists(SETTINGS_FILE):
+            with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"[WARN] No se pudieron cargar settings: {e}")
+    return {}
+
+
+# --- Backends de inferencia (torch / ONNX Runtime / OpenVINO) ---
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def export_cached(path, backend, imgsz, cache_dir=MODEL_CACHE_DIR):
+    """Exporta el .pt al backend una sola vez; la caché se indexa por hash del modelo, imgsz y backend."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    target_dir = os.path.join(cache_dir, f"{stem}-{file_sha256(path)[:16]}-{imgsz}-{backend}")
+    marker = os.path.join(target_dir, "export.json")
+    if os.path.exists(marker):
+        with open(marker, "r", encoding="utf-8") as f:
+            exported = os.path.join(target_dir, json.load(f)["model"])
+        if os.path.exists(exported):
+            return exported, True
+
+    os.makedirs(target_dir, exist_ok=True)
+    # Exportar desde una copia dentro de la caché para que los ficheros generados queden ahí
+    work_pt = os.path.join(target_dir, f"{stem}.pt")
+    shutil.copyfile(path, work_pt)
+    try:
+        exported = YOLO(work_pt).export(format=backend, imgsz=imgsz, dynamic=True)
+    finally:
+        os.remove(work_pt)
+    exported = os.path.join(target_dir, os.path.basename(os.path.normpath(str(exported))))
+    # El marcador se escribe al final: una exportación interrumpida no se reutiliza
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump({"model": os.path.basename(exported), "source": os.path.abspath(path),
+                   "imgsz": imgsz, "backend": backend}, f, indent=2)
+    return exported, False
+
+
+def quantized_model(path, backend, imgsz, cache_dir=MODEL_CACHE_DIR):
+    """Modelo cuantizado por `quantize` para este .pt e imgsz: (ruta, datos del informe) o (None, None)."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    marker = os.path.join(cache_dir, f"{stem}-{file_sha256(path)[:16]}-{imgsz}-{backend}", "export.json")
+    if not os.path.exists(marker):
+        return None, None
+    with open(marker, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    exported = os.path.join(os.path.dirname(marker), info["model"])
+    return (exported, info) if os.path.exists(exported) else (None, None)
+
+
+def box_iou(a, b):
+    """IoU entre dos conjuntos de cajas xyxy (N x 4, M x 4) -> N x M."""
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def compare_detections(ref, cand, conf_floor, iou_thr=0.85, conf_tol=0.05):
+    """Empareja detecciones de referencia y candidatas por clase e IoU.
+
+    Solo se exige coincidencia a las cajas con confianza claramente por encima de
+    `conf_floor`; las que están en el borde pueden aparecer en un lado y no en el otro.
+    Si ninguno de los dos tiene cajas así no se ha comparado nada: el resultado es
+    no concluyente (`inconclusive`) y no cuenta como coincidencia.
+    """
+    def arrays(result):
+        b = result.boxes
+        return b.xyxy.cpu().numpy(), b.conf.cpu().numpy(), b.cls.cpu().numpy().astype(int)
+
+    rb, rc, rk = arrays(ref)
+    cb, cc, ck = arrays(cand)
+    used = np.zeros(len(cb), dtype=bool)
+    missing = 0
+    max_conf_diff = 0.0
+    iou = box_iou(rb, cb) if len(rb) and len(cb) else np.zeros((len(rb), len(cb)))
+    for i in np.argsort(-rc):
+        cands = np.where((ck == rk[i]) & ~used & (iou[i] >= iou_thr))[0]
+        if len(cands):
+            j = cands[np.argmax(iou[i, cands])]
+            used[j] = True
+            max_conf_diff = max(max_conf_diff, abs(float(rc[i]) - float(cc[j])))
+        elif rc[i] >= conf_floor + conf_tol:
+            missing += 1
+    extra = int(np.sum(~used & (cc >= conf_floor + conf_tol)))
+    compared = int(np.sum(rc >= conf_floor + conf_tol))
+    inconclusive = compared == 0 and extra == 0
+    ok = missing == 0 and extra == 0 and max_conf_diff <= conf_tol and not inconclusive
+    return ok, {"reference": len(rb), "candidate": len(cb), "matched": int(used.sum()), "compared": compared,
+                "missing": missing, "extra": extra, "max_conf_diff": round(max_conf_diff, 4),
+                "inconclusive": inconclusive}
+
+
+def backend_check_images(spec=None, limit=8):
+    """Imágenes reales para verificar una exportación: `BACKEND_CHECK_IMAGE` (archivo, carpeta o glob)
+    o, si no se define, una muestra de las de calibración (`QUANT_CALIB_DIR`)."""
+    if not spec:
+        settings = read_settings()
+        spec = settings.get("BACKEND_CHECK_IMAGE") or settings.get("QUANT_CALIB_DIR", "calibracion")
+    paths = [spec] if os.path.isfile(spec) else collect_images(spec)
+    paths = paths[::max(1, len(paths) // limit)][:limit]
+    images = [decode_image(p)[1] for p in paths]
+    return [img for img in images if img is not None]
+
+
+def verify_backend(reference, candidate, imgsz, device, images=None, conf_floor=0.05, conf_tol=0.05):
+    """Compara las detecciones del backend con torch en varias imágenes (confianzas con tolerancia `conf_tol`).
+
+    Devuelve (estado, resumen) con estado "ok", "mismatch" o "inconclusive" (ninguna caja que comparar).
+    """
+    if not images:
+        # Sin imágenes reales: ruido fijo. Un modelo entrenado rara vez devuelve cajas aquí (no concluyente)
+        images = [np.random.default_rng(0).integers(0, 255, (imgsz, imgsz, 3), dtype=np.uint8)]
+    total = {"images": len(images), "reference": 0, "candidate": 0, "matched": 0, "compared": 0,
+             "missing": 0, "extra": 0, "max_conf_diff": 0.0}
+    for image in images:
+        ref = reference.predict(image, conf=conf_floor, imgsz=imgsz, device=device, verbose=False)[0]
+        cand = candidate.predict(image, conf=conf_floor, imgsz=imgsz, device="cpu", verbose=False)[0]
+        _, summary = compare_detections(ref, cand, conf_floor, conf_tol=conf_tol)
+        for k in total:
+            if k == "max_conf_diff":
+                total[k] = max(total[k], summary[k])
+            elif k != "images":
+                total[k] += summary[k]
+    if total["missing"] or total["extra"] or total["max_conf_diff"] > conf_tol:
+        return "mismatch", total
+    return ("inconclusive" if total["compared"] == 0 else "ok"), total
+
+
+def load_inference_model(path, backend="torch", imgsz=640, device="cpu", check_image=None, log=print):
+    """Carga el modelo en el backend pedido; si la exportación o la verificación fallan se usa torch.
+
+    Devuelve (modelo, backend efectivo).
+    """
+    reference = YOLO(path)
+    if backend == "torch" or not path.lower().endswith(".pt"):
+        return reference, "torch"
+    if backend not in BACKENDS:
+        log(f"[WARN] Backend desconocido '{backend}', se usa torch")
+        return reference, "torch"
+    if backend in QUANT_BACKENDS:
+        # INT8: solo el modelo que `quantize` calibró y aprobó con su informe de precisión y latencia
+        try:
+            exported, info = quantized_model(path, backend, imgsz)
+            if exported is None:
+                log(f"[WARN] No hay modelo {backend} calibrado para {os.path.basename(path)} (imgsz={imgsz}); "
+                    f"ejecuta el subcomando quantize. Se usa torch")
+            elif not info.get("approved"):
+                log(f"[WARN] El modelo {backend} no está aprobado (ver {info.get('report')}), se usa torch")
+            else:
+                f1 = info.get("agreement_f1")
+                log(f"[INFO] Modelo {backend} calibrado con {info['images']} imágenes: concordancia F1 "
+                    f"{'-' if f1 is None else f'{f1:.3f}'} con FP32, x{info['speedup']:.2f} más rápido")
+                return YOLO(exported, task=reference.task), backend
+        except Exception as e:
+            log(f"[WARN] No se pudo usar el backend {backend}: {e}. Se usa torch")
+        return reference, "torch"
+    try:
+        t0 = time.time()
+        exported, cached = export_cached(path, backend, imgsz)
+        log(f"[INFO] Modelo {backend} {'reutilizado de la caché' if cached else 'exportado'}: {exported} ({time.time() - t0:.1f} s)")
+        candidate = YOLO(exported, task=reference.task)
+        status, summary = verify_backend(reference, candidate, imgsz, device, backend_check_images(check_image))
+        log(f"[INFO] Verificación {backend} frente a torch: {summary}")
+        if status == "ok":
+            return candidate, backend
+        if status == "inconclusive":
+            # Sin detecciones que comparar no hay pruebas de que el backend sea correcto
+            log(f"[WARN] Verificación de {backend} no concluyente: torch no detecta nada en las imágenes de prueba. "
+                f"Se usa torch; define BACKEND_CHECK_IMAGE con fotos que tengan defectos")
+        else:
+            log(f"[WARN] Las detecciones de {backend} no coinciden con torch dentro de la tolerancia, se usa torch")
+    except Exception as e:
+        log(f"[WARN] No se pudo usar el backend {backend}: {e}. Se usa torch")
+    return reference, "torch"
+
+
+class DetectionRenderer:
+    """Dibuja cajas, etiquetas y el contador de defectos en una sola pasada sobre el buffer de salida.
+
+    Sustituye a `results[0].plot()` + `cvtColor`: escala el frame al tamaño pedido, lo convierte a RGB
+    y pinta encima a esa resolución. Colores y etiquetas se cachean por clase y confianza.
+    """
+
+    FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+    def __init__(self, names):
+        self.names = names
+        self._colors = {}
+        self._labels = {}
+
+    def color(self, cls, rgb=True):
+        key = (cls, rgb)
+        color = self._colors.get(key)
+        if color is None:
+            color = self._colors[key] = colors(cls, bgr=not rgb)
+        return color
+
+    def label(self, cls, conf, font_scale, thickness):
+        # Confianza a 2 decimales: como mucho 100 textos distintos por clase y tamaño
+        key = (cls, int(conf * 100), font_scale, thickness)
+        item = self._labels.get(key)
+        if item is None:
+            text = f"{self.names.get(cls, cls)} {int(conf * 100) / 100:.2f}"
+            (tw, th), base = cv2.getTextSize(text, self.FONT, font_scale, thickness)
+            item = self._labels[key] = (text, tw, th, base)
+        return item
+
+    def render(self, frame_bgr, result, size=None, rgb=True, counter=True, timings=None):
+        """Si se pasa `timings` (dict) se rellenan los ms de escalado, color y dibujo."""
+        t0 = time.perf_counter()
+        h, w = frame_bgr.shape[:2]
+        if size and tuple(size) != (w, h):
+            out = cv2.resize(frame_bgr, tuple(size), interpolation=cv2.INTER_LINEAR)
+            t1 = time.perf_counter()
+            if rgb:
+                cv2.cvtColor(out, cv2.COLOR_BGR2RGB, dst=out)
+        else:
+            t1 = t0
+            out = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB) if rgb else frame_bgr.copy()
+        t2 = time.perf_counter()
+        if timings is not None:
+            timings["resize"] = (t1 - t0) * 1000.0
+            timings["color"] = (t2 - t1) * 1000.0
+        if result is None:
+            return out
+
+        boxes = result.boxes
+        n = len(boxes)
+        if n:
+            oh, ow = out.shape[:2]
+            scale = np.array([ow / w, oh / h, ow / w, oh / h], dtype=np.float32)
+            xyxy = (boxes.xyxy.cpu().numpy() * scale).round().astype(np.int32)
+            confs = boxes.conf.cpu().numpy()
+            classes = boxes.cls.cpu().numpy().astype(int)
+            lw = max(round((oh + ow) / 2 * 0.003), 2)
+            font_scale = lw / 3
+            tf = max(lw - 1, 1)
+            for (x1, y1, x2, y2), conf, cls in zip(xyxy, confs, classes):
+                color = self.color(cls, rgb)
+                cv2.rectangle(out, (x1, y1), (x2, y2), color, lw, cv2.LINE_AA)
+                text, tw, th, base = self.label(cls, conf, font_scale, tf)
+                # Etiqueta encima de la caja, o dentro si no cabe
+                top = y1 - th - base - 3 if y1 - th - base - 3 >= 0 else y1
+                cv2.rectangle(out, (x1, top), (x1 + tw, top + th + base + 3), color, -1, cv2.LINE_AA)
+                cv2.putText(out, text, (x1, top + th + 1), self.FONT, font_scale, (255, 255, 255), tf, cv2.LINE_AA)
+        if counter:
+            cv2.putText(out, f"Defectos: {n}", (10, 60), self.FONT, 0.7, (0, 255, 0), 2)
+        if timings is not None:
+            timings["annotate"] = (time.perf_counter() - t2) * 1000.0
+        return out
+
+    @staticmethod
+    def draw_rois(out, rois, source_size):
+        # Contorno de las regiones de interés, escalado del frame original a `out`
+        sw, sh = source_size
+        fx, fy = out.shape[1] / sw, out.shape[0] / sh
+        for x1, y1, x2, y2 in rois:
+            cv2.rectangle(out, (int(x1 * fx), int(y1 * fy)), (int(x2 * fx), int(y2 * fy)), (255, 255, 0), 1)
+
+
+# --- Inferencia por mosaicos para imágenes de alta resolución ---
+def tile_origins(length, tile, step):
+    """Posiciones de inicio a lo largo de un eje; el último mosaico queda pegado al borde."""
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)
+    return starts
+
+
+def merge_detections(boxes, scores, classes, iou_thr=0.5, ios_thr=0.8):
+    """NMS por clase entre mosaicos, vectorizado sobre la matriz de solapes.
+
+    Además del IoU se usa la intersección sobre la caja menor (IoS): una caja cortada
+    por el borde de un mosaico queda contenida en la completa del mosaico vecino.
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(-scores)
+    boxes, classes = boxes[order], classes[order]
+    tl = np.maximum(boxes[:, None, :2], boxes[None, :, :2])
+    br = np.minimum(boxes[:, None, 2:], boxes[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)
+    iou = inter / np.maximum(area[:, None] + area[None, :] - inter, 1e-9)
+    ios = inter / np.maximum(np.minimum(area[:, None], area[None, :]), 1e-9)
+    overlap = ((iou > iou_thr) | (ios > ios_thr)) & (classes[:, None] == classes[None, :])
+    keep = np.ones(len(boxes), dtype=bool)
+    for i in range(len(boxes)):
+        if keep[i]:
+            # Suprimir de golpe todas las de menor puntuación que solapan con la i
+            keep[i + 1:] &= ~overlap[i, i + 1:]
+    return order[keep]
+
+
+def combine_offset_results(image, names, parts, iou=0.5):
+    """Lleva a coordenadas de `image` las cajas de varios recortes [(Results, x, y)] y las fusiona."""
+    all_boxes, all_scores, all_classes = [], [], []
+    for result, x, y in parts:
+        b = result.boxes
+        if len(b):
+            all_boxes.append(b.xyxy.cpu().numpy() + np.array([x, y, x, y], dtype=np.float32))
+            all_scores.append(b.conf.cpu().numpy())
+            all_classes.append(b.cls.cpu().numpy())
+    if all_boxes:
+        boxes = np.concatenate(all_boxes)
+        scores = np.concatenate(all_scores)
+        classes = np.concatenate(all_classes)
+        keep = merge_detections(boxes, scores, classes, iou_thr=iou)
+        data = np.concatenate([boxes[keep], scores[keep, None], classes[keep, None]], axis=1)
+    else:
+        data = np.zeros((0, 6), dtype=np.float32)
+    return Results(image, path="", names=names, boxes=torch.from_numpy(data.astype(np.float32)))
+
+
+def boxes_result(image, boxes, names, conf=0.0):
+    """Results a partir de cajas en bruto (N x 6: x1, y1, x2, y2, confianza, clase) filtradas por confianza."""
+    data = np.asarray(boxes, dtype=np.float32).reshape(-1, 6)
+    return Results(image, path="", names=names, boxes=torch.from_numpy(data[data[:, 4] >= conf]))
+
+
+def quick_file_hash(path, sample=1 << 20):
+    """Hash rápido para archivos grandes: tamaño más el primer, el central y el último MiB."""
+    size = os.path.getsize(path)
+    h = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(0, size // 2 - sample // 2), max(0, size - sample)}):
+            f.seek(offset)
+            h.update(f.read(sample))
+    return h.hexdigest()[:32]
+
+
+def backend_signature(model, backend, device):
+    """Backend, precisión y dispositivo con los que infiere el modelo. Los modelos exportados añaden el hash
+    del archivo: una recalibración INT8 cambia las predicciones sin cambiar el .pt."""
+    precision = backend if backend in QUANT_BACKENDS else f"{backend}-fp32"  # los INT8 ya la llevan en el nombre
+    signature = f"{precision}-{str(device).split(':')[0]}"
+    weights = str(getattr(model, "model_name", "") or "")
+    if backend != "torch" and weights:
+        files = [weights] if os.path.isfile(weights) else sorted(glob.glob(os.path.join(weights, "*")))
+        digest = hashlib.sha256("".join(quick_file_hash(p) for p in files if os.path.isfile(p)).encode())
+        signature += f"-{digest.hexdigest()[:12]}"
+    return signature
+
+
+def _pool_worker(worker_id, model_path, task, threads, shm_name, slot_bytes, tasks, results):
+    """Proceso de inferencia: una réplica del modelo que lee los frames directamente del anillo compartido."""
+    load_ml()
+    # Hilos intra-op repartidos entre réplicas: N procesos x `threads` hilos = núcleos disponibles
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    cv2.setNumThreads(1)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        torch.manual_seed(0)
+        model = YOLO(model_path, task=task)
+        model.predict(np.zeros((64, 64, 3), dtype=np.uint8), device="cpu", verbose=False)
+        results.put(("ready", worker_id, None, None))
+        while True:
+            item = tasks.get()
+            if item is None:
+                break
+            seq, slot, shape, conf, imgsz = item
+            frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+            try:
+                result = model.predict(frame, conf=conf, imgsz=imgsz, device="cpu", verbose=False)[0]
+                boxes = result.boxes.data.cpu().numpy().astype(np.float32) if result.boxes is not None \
+                    else np.zeros((0, 6), dtype=np.float32)
+                results.put(("result", seq, boxes, dict(result.speed)))
+            except Exception as e:
+                results.put(("error", seq, str(e), None))
+            del frame
+    except Exception as e:
+        results.put(("failed", worker_id, str(e), None))
+    finally:
+        shm.close()
+
+
+class InferencePool:
+    """Réplicas del modelo en procesos separados para usar todos los núcleos de CPU.
+
+    Los frames viajan por un anillo de huecos en memoria compartida: a los procesos solo se les envía
+    el índice del hueco, nunca la imagen. Los resultados (cajas N x 6) se devuelven en orden de envío.
+    """
+
+    def __init__(self, model_path, workers, task=None, threads=None, slots=None, max_frame=(1920, 1080),
+                 start_timeout=300.0, log=print):
+        self.workers = max(1, int(workers))
+        self.threads = max(1, int(threads or (os.cpu_count() or 1) // self.workers))
+        self.slots = max(self.workers, int(slots or self.workers * 2))
+        self.slot_bytes = int(max_frame[0]) * int(max_frame[1]) * 3
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        self.free = queue.Queue()
+        for slot in range(self.slots):
+            self.free.put(slot)
+        self.next_seq = 0
+        self.next_out = 0
+        self.inflight = {}  # seq -> hueco
+        self.done = {}  # seq -> (cajas, tiempos) llegados fuera de orden
+        self.abandoned = set()  # seqs de un map() que falló: su resultado se descarta al llegar
+        self.lock = threading.Lock()  # map() desde varios hilos (bucle e imagen de soldadura)
+        # spawn también en Linux: los procesos no heredan hilos ni el estado de torch del proceso principal
+        ctx = mp.get_context("spawn")
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.procs = [ctx.Process(target=_pool_worker, daemon=True,
+                                  args=(i, model_path, task, self.threads, self.shm.name, self.slot_bytes,
+                                        self.tasks, self.results))
+                      for i in range(self.workers)]
+        for p in self.procs:
+            p.start()
+        t0 = time.time()
+        ready = 0
+        try:
+            while ready < self.workers:
+                try:
+                    kind, _, error, _ = self.results.get(timeout=1.0)
+                except queue.Empty:
+                    if time.time() - t0 > start_timeout or not all(p.is_alive() for p in self.procs):
+                        raise RuntimeError("los procesos de inferencia no arrancaron")
+                    continue
+                if kind == "failed":
+                    raise RuntimeError(f"proceso de inferencia: {error}")
+                ready += 1
+        except BaseException:
+            self.close()
+            raise
+        log(f"[INFO] {self.workers} procesos de inferencia x {self.threads} hilos listos "
+            f"({self.slots} huecos de {self.slot_bytes / 1e6:.1f} MB, {time.time() - t0:.1f} s)")
+
+    def fits(self, shape):
+        return int(np.prod(shape)) <= self.slot_bytes
+
+    def view(self, slot, shape):
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def acquire(self, shape, timeout=None):
+        """Hueco libre y su vista (h, w, 3) para escribir el frame, p. ej. cap.read(vista). Bloquea si el anillo está lleno."""
+        if not self.fits(shape):
+            raise ValueError(f"frame {shape} mayor que el hueco de memoria compartida")
+        slot = self.free.get(timeout=timeout)
+        return slot, self.view(slot, shape)
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def submit(self, slot, shape, conf, imgsz=640):
+        """Encola el frame ya escrito en `slot`; devuelve su número de secuencia."""
+        seq = self.next_seq
+        self.next_seq += 1
+        self.inflight[seq] = slot
+        self.tasks.put((seq, slot, tuple(shape), float(conf), int(imgsz)))
+        return seq
+
+    def get(self, timeout=None):
+        """Siguiente resultado en orden de envío: (seq, hueco, cajas N x 6, tiempos de Ultralytics).
+
+        El hueco sigue reservado para que el llamador pueda usar el frame; se devuelve con release().
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            seq = self.next_out
+            if seq in self.done:
+                self.next_out += 1
+                kind, data, speed = self.done.pop(seq)
+                slot = self.inflight.pop(seq)
+                if seq in self.abandoned:
+                    # El proceso ya no usa el hueco: se libera sin devolver el resultado
+                    self.abandoned.discard(seq)
+                    self.release(slot)
+                    continue
+                if kind != "result":
+                    self.release(slot)
+                    raise RuntimeError(f"proceso de inferencia: {data}")
+                return seq, slot, data, speed
+            try:
+                kind, done_seq, data, speed = self.results.get(timeout=0.5)
+            except queue.Empty:
+                if not all(p.is_alive() for p in self.procs):
+                    raise RuntimeError("un proceso de inferencia ha terminado inesperadamente")
+                if deadline is not None and time.time() > deadline:
+                    raise TimeoutError("sin resultado de los procesos de inferencia")
+                continue
+            if kind == "failed":
+                raise RuntimeError(f"proceso de inferencia: {data}")
+            self.done[done_seq] = (kind, data, speed)
+
+    def pending(self):
+        return len(self.inflight)
+
+    def map(self, frames, conf, imgsz=640):
+        """Inferencia de una lista de frames repartida entre los procesos; [(cajas, tiempos)] en el mismo orden."""
+        out = []
+        submitted = []
+        with self.lock:
+            try:
+                for frame in frames:
+                    while self.free.empty():
+                        # Anillo lleno: recoger en orden para liberar huecos
+                        _, slot, boxes, speed = self.get()
+                        self.release(slot)
+                        out.append((boxes, speed))
+                    slot, view = self.acquire(frame.shape)
+                    np.copyto(view, frame)
+                    del view
+                    submitted.append(self.submit(slot, frame.shape, conf, imgsz))
+                while len(out) < len(frames):
+                    _, slot, boxes, speed = self.get()
+                    self.release(slot)
+                    out.append((boxes, speed))
+            except BaseException:
+                # Los resultados pendientes de este lote no deben salir en el siguiente map()
+                self.abandoned.update(seq for seq in submitted if seq >= self.next_out)
+                raise
+        return out
+
+    def close(self):
+        for _ in self.procs:
+            self.tasks.put(None)
+        for p in self.procs:
+            p.join(timeout=5.0)
+            if p.is_alive():
+                p.terminate()
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # quedan vistas vivas; la memoria se libera al desenlazar y terminar el proceso
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class PredictionCache:
+    """Predicciones en bruto por archivo y frame, calculadas una vez a la confianza mínima `floor`.
+
+    Un SQLite por (archivo, modelo, imgsz, variante) en `folder`; si el total supera `max_mb`
+    se borran los menos usados (por fecha de modificación).
+    """
+
+    def __init__(self, folder=PRED_CACHE_DIR, max_mb=500, floor=0.05, commit_every=50):
+        self.folder = folder
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.floor = floor
+        self.commit_every = commit_every
+        self.lock = threading.Lock()
+        self.stores = {}
+        self.uncommitted = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, file_hash, model_hash, imgsz, variant="", backend="torch-fp32-cpu"):
+        """`backend`: firma de backend_signature(); cada backend y precisión tiene sus propias predicciones."""
+        return hashlib.sha256(f"{file_hash}|{model_hash}|{backend}|{imgsz}|{self.floor}|{variant}".encode()).hexdigest()[:24]
+
+    def _store(self, key):
+        conn = self.stores.get(key)
+        if conn is None:
+            path = os.path.join(self.folder, f"{key}.db")
+            if os.path.exists(path):
+                os.utime(path)  # marca de uso para la expulsión LRU
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("CREATE TABLE IF NOT EXISTS preds (frame INTEGER PRIMARY KEY, boxes BLOB NOT NULL)")
+            self.stores[key] = conn
+            self.evict()
+        return conn
+
+    def get(self, key, frame):
+        with self.lock:
+            row = self._store(key).execute("SELECT boxes FROM preds WHERE frame = ?", (frame,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return np.frombuffer(row[0], dtype=np.float32).reshape(-1, 6)
+
+    def put(self, key, frame, boxes):
+        data = np.ascontiguousarray(boxes, dtype=np.float32).tobytes()
+        with self.lock:
+            self._store(key).execute("INSERT OR REPLACE INTO preds (frame, boxes) VALUES (?, ?)", (frame, data))
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_every:
+                self._commit()
+
+    def _commit(self):
+        for conn in self.stores.values():
+            conn.commit()
+        self.uncommitted = 0
+
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            for conn in self.stores.values():
+                conn.close()
+            self.stores = {}
+
+    def evict(self):
+        files = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if name.endswith(".db") and os.path.isfile(path):
+                files.append((os.path.getmtime(path), os.path.getsize(path), name[:-3], path))
+        total = sum(size for _, size, _, _ in files)
+        for _, size, key, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if key in self.stores:
+                continue  # en uso
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def video_playable(path):
+    """True si OpenCV abre el archivo (posiblemente a medio descargar) y decodifica un frame."""
+    if not os.path.exists(path):
+        return False
+    cap = cv2.VideoCapture(path)
+    try:
+        return cap.isOpened() and cap.read()[0]
+    finally:
+        cap.release()
+
+
+def video_frame_count(path):
+    cap = cv2.VideoCapture(path)
+    count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return count
+
+
+class RemoteVideoCache:
+    """Descargas remotas direccionadas por contenido (extractor, id y formato), con tope de tamaño y LRU.
+
+    Un archivo está completo cuando existe su marca `<clave>.done`; se escribe al terminar la descarga.
+    """
+
+    def __init__(self, folder=REMOTE_CACHE_DIR, max_mb=4096, stale_s=86400):
+        self.folder = folder
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.stale_s = stale_s  # descargas a medias más antiguas que esto se consideran abandonadas
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(info):
+        raw = f"{info.get('extractor_key') or 'web'}_{info.get('id')}_{info.get('format_id') or 'best'}"
+        return re.sub(r"[^\w-]+", "_", raw)
+
+    def path(self, key, ext):
+        return os.path.join(self.folder, f"{key}.{ext}")
+
+    def marker(self, key):
+        return os.path.join(self.folder, f"{key}.done")
+
+    def lookup(self, key):
+        marker = self.marker(key)
+        if not os.path.exists(marker):
+            return None
+        try:
+            with open(marker, "r", encoding="utf-8") as f:
+                path = json.load(f)["path"]
+        except Exception:
+            return None
+        if not os.path.exists(path):
+            return None
+        os.utime(marker)  # marca de uso para la expulsión LRU
+        return path
+
+    def complete(self, key, path):
+        with open(self.marker(key), "w", encoding="utf-8") as f:
+            json.dump({"path": path, "size": os.path.getsize(path), "time": time.time()}, f)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        groups = {}
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if os.path.isfile(path):
+                groups.setdefault(name.split(".", 1)[0], []).append(path)
+        entries, total, now = [], 0, time.time()
+        for key, paths in groups.items():
+            size = sum(os.path.getsize(p) for p in paths)
+            marker = self.marker(key)
+            done = os.path.exists(marker)
+            used = os.path.getmtime(marker) if done else max(os.path.getmtime(p) for p in paths)
+            if not done and key != keep and now - used > self.stale_s:
+                used = 0.0  # descarga abandonada: lo primero en borrarse
+            elif not done:
+                continue  # descarga en curso
+            total += size
+            entries.append((used, size, key, paths))
+        for used, size, key, paths in sorted(entries):
+            if total <= self.max_bytes and used > 0:
+                break
+            if key == keep:
+                continue
+            for p in paths:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
+
+
+def clip_rois(rois, width, height):
+    """ROIs [x1, y1, x2, y2] en píxeles del frame, recortadas a la imagen; se descartan las vacías."""
+    clipped = []
+    for x1, y1, x2, y2 in rois:
+        x1, x2 = sorted((int(max(0, min(width, x1))), int(max(0, min(width, x2)))))
+        y1, y2 = sorted((int(max(0, min(height, y1))), int(max(0, min(height, y2)))))
+        if x2 - x1 >= 8 and y2 - y1 >= 8:
+            clipped.append((x1, y1, x2, y2))
+    return clipped
+
+
+def scale_rois(rois, factor):
+    """ROIs de píxeles de la fuente a píxeles de un frame escalado por `factor`."""
+    if not rois or factor == 1.0:
+        return rois
+    return [[int(round(v * factor)) for v in roi] for roi in rois]
+
+
+def tiled_predict(model, image, conf, device, tile=640, overlap=0.2, batch_size=8, iou=0.5):
+    """Corta la imagen en mosaicos solapados, los infiere por lotes y fusiona las cajas.
+
+    Devuelve (Results a tamaño completo, estadísticas de tiempo).
+    """
+    h, w = image.shape[:2]
+    step = max(1, int(tile * (1.0 - overlap)))
+    origins = [(x, y) for y in tile_origins(h, tile, step) for x in tile_origins(w, tile, step)]
+    t0 = time.perf_counter()
+    parts = []
+    for i in range(0, len(origins), batch_size):
+        chunk = origins[i:i + batch_size]
+        crops = [image[y:y + tile, x:x + tile] for x, y in chunk]
+        results = model.predict(crops, conf=conf, imgsz=tile, device=device, verbose=False)
+        parts.extend((result, x, y) for (x, y), result in zip(chunk, results))
+    result = combine_offset_results(image, model.names, parts, iou=iou)
+    total = time.perf_counter() - t0
+    stats = {"tiles": len(origins), "total_ms": total * 1000.0, "per_tile_ms": total * 1000.0 / len(origins)}
+    return result, stats
+
+
+def warmup_model(model, imgsz, device, runs=2, batch=1, progress=None):
+    """Pasadas de calentamiento con frames vacíos para que la inicialización perezosa no caiga en el primer frame real."""
+    dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    t0 = time.time()
+    for i in range(runs):
+        model.predict([dummy] * batch if batch > 1 else dummy, imgsz=imgsz, device=device, verbose=False)
+        if progress:
+            progress(i + 1, runs)
+    return time.time() - t0
+
 
 class YoloCamApp:
-    def __init__(self, root):
+    def __init__(self, root, startup=None, exit_after_startup=False):
         self.root = root
+        self.startup = startup or StartupTrace(None)
+        self.exit_after_startup = exit_after_startup
         self.root.title("Sistema de Inspección Visual por IA - Control de Calidad")
         self.root.geometry("1280x800")
         # Configurar tema y estilos
@@ -29,7 +1916,23 @@ class YoloCamApp:
         self.running = False
         self.frame_lock = threading.Lock()
         self.current_frame = None
-        self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        self.grabber = None
+        self.streams = []
+        # Frames (fuente, CapturedFrame) que componen la imagen mostrada y su versión
+        self.current_meta = []
+        self.frame_version = 0
+        # Frame ya escalado al área de visualización (lo prepara el hilo de inferencia)
+        self.display_frame = None
+        self.display_size = (960, 540)
+        self.shown_version = 0
+        self.device = "detectando..."  # lo fija init_ml_worker en segundo plano
+        self.backend_used = "torch"
+        self.model_loading = False
+        self.pending_start = None
+        self.renderer = None
+        # Réplicas del modelo en procesos (INFERENCE_WORKERS > 0, solo CPU)
+        self.pool = None
+        self.pool_oversize_warned = False
         self.yt_video_path = None
         self.youtube_url = StringVar()
         self.cookie_path = StringVar(value="")
@@ -37,10 +1940,77 @@ class YoloCamApp:
         # Cargar settings si existen
         self.settings = self.load_settings()
 
+        # Ingesta remota en segundo plano con caché de descargas
+        self.remote_cache = RemoteVideoCache(self.settings.get("REMOTE_CACHE_DIR", REMOTE_CACHE_DIR),
+                                             max_mb=float(self.settings.get("REMOTE_CACHE_MB", 4096)))
+        self.ingest_thread = None
+        self.remote_keys = {}  # ruta local -> clave de contenido
+        self.remote_growing = {}  # ruta local -> Event activo mientras se descarga
+
         # --- Variables UI ---
         self.model_path = StringVar(value=self.settings.get("MODEL_PATH", "best.pt"))
         self.source_str = StringVar(value=str(self.settings.get("SOURCE", "0")))
+        self.sources_str = StringVar(value="; ".join(str(x) for x in self.settings.get("SOURCES", [])))
         self.confidence = DoubleVar(value=float(self.settings.get("CONFIDENCE", 0.30)))
+        self.imgsz = int(self.settings.get("IMGSZ", 640))
+        # Refresco de pantalla limitado por separado del ritmo de inferencia
+        self.display_interval_ms = max(1, int(1000 / float(self.settings.get("DISPLAY_FPS", 30))))
+        self.backend = StringVar(value=self.settings.get("BACKEND", "torch"))
+        # Inferencia por mosaicos (imágenes de alta resolución)
+        self.tiled = BooleanVar(value=bool(self.settings.get("TILED", False)))
+        # Omitir la inferencia cuando la escena no cambia
+        self.motion_gating = BooleanVar(value=bool(self.settings.get("MOTION_GATING", False)))
+        # Calidad adaptativa: FPS objetivo o presupuesto de latencia
+        self.adaptive = BooleanVar(value=bool(self.settings.get("ADAPTIVE_QUALITY", False)))
+        budget = float(self.settings.get("LATENCY_BUDGET_MS", 0) or 0)
+        self.target_fps = DoubleVar(value=1000.0 / budget if budget > 0 else float(self.settings.get("TARGET_FPS", 15)))
+        self.quality = None
+        # Escritura a disco fuera de los hilos de UI e inferencia
+        self.snapshot_dir = self.settings.get("SNAPSHOT_DIR", "snapshots")
+        self.recordings_dir = self.settings.get("RECORDINGS_DIR", "recordings")
+        self.record_fps = float(self.settings.get("RECORD_FPS", 15))
+        self.writer = MediaWriter(maxsize=int(self.settings.get("WRITE_QUEUE", 128)))
+        self.recording = None  # clave del video de la grabación continua en curso
+        self.event_clips = BooleanVar(value=bool(self.settings.get("EVENT_CLIPS", False)))
+        self.weld_result = None
+        # Registro persistente de detecciones (vacío = desactivado)
+        self.defect_log = None
+        self.model_hash = None
+        self.backend_signature = None
+        db_path = self.settings.get("DEFECT_DB", "defectos.db")
+        if db_path:
+            try:
+                self.defect_log = DefectLog(db_path)
+            except Exception as e:
+                print(f"[WARN] No se pudo abrir el registro de defectos {db_path}: {e}")
+        # Caché de predicciones de videos e imágenes locales (PRED_CACHE_MB = 0 la desactiva)
+        self.pred_cache = None
+        if float(self.settings.get("PRED_CACHE_MB", 500)) > 0:
+            try:
+                self.pred_cache = PredictionCache(self.settings.get("PRED_CACHE_DIR", PRED_CACHE_DIR),
+                                                  max_mb=float(self.settings.get("PRED_CACHE_MB", 500)),
+                                                  floor=float(self.settings.get("PRED_CACHE_FLOOR", 0.05)))
+            except Exception as e:
+                print(f"[WARN] No se pudo abrir la caché de predicciones: {e}")
+        self.weld_hash = None
+        self.weld_raw = None
+        # Métricas por etapa: panel, endpoint HTTP local y volcado CSV periódico
+        self.metrics = StageMetrics(window=int(self.settings.get("METRICS_WINDOW", 1000)))
+        self.metrics_window = None
+        self.metrics_server = None
+        self.start_metrics_export()
+        # Regiones de interés por fuente ("weld" para la imagen de soldadura), en píxeles del frame
+        self.rois = {k: [list(r) for r in v] for k, v in self.settings.get("ROIS", {}).items()}
+        self.use_roi = BooleanVar(value=bool(self.settings.get("USE_ROI", False)))
+        self.roi_drawing = False
+        self.weld_image = None  # ruta de la imagen cargada en la pestaña de soldadura
+        self.roi_start = None
+        self.roi_pixels = [0, 0]  # píxeles de los frames completos / píxeles enviados al modelo
+        self.roi_warned = set()  # ROIs fuera del frame ya avisadas
+        self.last_tile_stats = None
+        self.tile_size = IntVar(value=int(self.settings.get("TILE_SIZE", 640)))
+        self.tile_overlap = DoubleVar(value=float(self.settings.get("TILE_OVERLAP", 0.2)))
+        self.tile_batch = IntVar(value=int(self.settings.get("TILE_BATCH", 8)))
 
         # --- Panel principal ---
         main_container = ttk.Frame(root, style="Corporate.TFrame")
@@ -99,11 +2069,33 @@ class YoloCamApp:
         ttk.Label(conf_frame, text="Umbral de Confianza:", 
                  style="Corporate.TLabel").pack(side="left")
         Scale(conf_frame, from_=0.05, to=0.90, resolution=0.05,
-              orient=HORIZONTAL, variable=self.confidence, 
+              orient=HORIZONTAL, variable=self.confidence, command=self.on_confidence_change,
               length=240, bg=self.COLORS["secondary"],
               troughcolor=self.COLORS["primary"],
               activebackground=self.COLORS["primary"]).pack(side="left", padx=10)
 
+        # Calidad adaptativa
+        quality_frame = ttk.Frame(params_frame, style="Corporate.TFrame")
+        quality_frame.pack(fill="x", padx=10, pady=5)
+        ttk.Checkbutton(quality_frame, text="Calidad adaptativa",
+                       variable=self.adaptive).pack(side="left")
+        ttk.Label(quality_frame, text="FPS objetivo:",
+                 style="Corporate.TLabel").pack(side="left", padx=(15, 2))
+        ttk.Spinbox(quality_frame, from_=1, to=60, increment=1, width=5,
+                   textvariable=self.target_fps).pack(side="left")
+
+        # Backend de inferencia (ONNX Runtime / OpenVINO aceleran en PCs sin GPU)
+        ttk.Label(conf_frame, text="Backend:",
+                 style="Corporate.TLabel").pack(side="left", padx=(20, 0))
+        ttk.Combobox(conf_frame, textvariable=self.backend, values=BACKENDS,
+                    state="readonly", width=10).pack(side="left", padx=5)
+        ttk.Checkbutton(conf_frame, text="Omitir frames sin cambios",
+                       variable=self.motion_gating).pack(side="left", padx=(20, 0))
+        ttk.Checkbutton(conf_frame, text="Usar ROI",
+                       variable=self.use_roi).pack(side="left", padx=(20, 0))
+        ttk.Checkbutton(conf_frame, text="Clips de eventos",
+                       variable=self.event_clips).pack(side="left", padx=(20, 0))
+
         # Panel de fuentes de video
         sources_frame = ttk.LabelFrame(main_container, text="Fuentes de Video", 
                                      style="Corporate.TFrame")
@@ -116,6 +2108,16 @@ class YoloCamApp:
         self.tab_camera = ttk.Frame(self.tab_control, style="Corporate.TFrame")
         self.tab_control.add(self.tab_camera, text='Cámara IP/RTSP')
         
+        # Configurar pestaña de cámara: lista de fuentes para el modo multi-cámara
+        multi_frame = ttk.Frame(self.tab_camera, style="Corporate.TFrame")
+        multi_frame.pack(fill="x", padx=10, pady=10)
+        ttk.Label(multi_frame, text="Fuentes multi-cámara (separadas por ;):",
+                 style="Corporate.TLabel").pack(side="left")
+        ttk.Entry(multi_frame, textvariable=self.sources_str,
+                 style="Corporate.TEntry").pack(side="left", fill="x", expand=True, padx=5)
+        ttk.Button(multi_frame, text="▶️ Iniciar Multi-cámara",
+                  command=self.start_multi_camera, style="Corporate.TButton").pack(side="left")
+
         # Pestaña de video local
         self.tab_video = ttk.Frame(self.tab_control, style="Corporate.TFrame")
         self.tab_control.add(self.tab_video, text='Video Local')
@@ -129,6 +2131,10 @@ class YoloCamApp:
         # Variables para control de video
         self.video_path = StringVar()
         self.video_position = DoubleVar(value=0.0)
+        # Índice de keyframes/miniaturas del video cargado y salto pendiente (con antirrebote)
+        self.video_index = None
+        self.seek_after_id = None
+        self.seek_debounce_ms = int(self.settings.get("SEEK_DEBOUNCE_MS", 150))
         self.is_playing = False
         self.total_frames = 0
         self.current_frame_pos = 0
@@ -151,6 +2157,20 @@ class YoloCamApp:
                   command=self.browse_video, 
                   style="Corporate.TButton").pack(side="left")
 
+        # Video remoto (YouTube u otras URL soportadas por yt-dlp)
+        remote_section = ttk.LabelFrame(video_content, text="Video Remoto (URL)",
+                                      style="Corporate.TFrame")
+        remote_section.pack(fill="x", pady=(0, 10))
+        remote_frame = ttk.Frame(remote_section, style="Corporate.TFrame")
+        remote_frame.pack(fill="x", padx=10, pady=5)
+        ttk.Entry(remote_frame, textvariable=self.youtube_url,
+                 style="Corporate.TEntry").pack(side="left", fill="x", expand=True, padx=(0, 5))
+        ttk.Button(remote_frame, text="🍪 Cookies",
+                  command=self.browse_cookies, style="Corporate.TButton").pack(side="left", padx=2)
+        ttk.Button(remote_frame, text="⬇️ Cargar URL",
+                  command=self.load_youtube_video, style="Corporate.TButton").pack(side="left", padx=2)
+        self.ingest_progress = ttk.Progressbar(remote_section, mode="determinate")
+
         # Controles de reproducción
         playback_section = ttk.LabelFrame(video_content, text="Control de Reproducción", 
                                         style="Corporate.TFrame")
@@ -208,7 +2228,19 @@ class YoloCamApp:
                                       style="Corporate.TFrame")
         params_section.pack(fill="x")
         
-        # Aquí puedes agregar más parámetros específicos para el análisis de soldadura
+        # Inferencia por mosaicos: no se reduce la foto completa a imgsz, se analiza por trozos
+        tiles_frame = ttk.Frame(params_section, style="Corporate.TFrame")
+        tiles_frame.pack(fill="x", padx=10, pady=5)
+        ttk.Checkbutton(tiles_frame, text="Inferencia por mosaicos", variable=self.tiled).pack(side="left")
+        ttk.Label(tiles_frame, text="Tamaño:", style="Corporate.TLabel").pack(side="left", padx=(15, 2))
+        ttk.Spinbox(tiles_frame, from_=256, to=2048, increment=64, width=6,
+                   textvariable=self.tile_size).pack(side="left")
+        ttk.Label(tiles_frame, text="Solape:", style="Corporate.TLabel").pack(side="left", padx=(15, 2))
+        ttk.Spinbox(tiles_frame, from_=0.0, to=0.5, increment=0.05, width=5,
+                   textvariable=self.tile_overlap).pack(side="left")
+        ttk.Label(tiles_frame, text="Lote:", style="Corporate.TLabel").pack(side="left", padx=(15, 2))
+        ttk.Spinbox(tiles_frame, from_=1, to=64, increment=1, width=4,
+                   textvariable=self.tile_batch).pack(side="left")
         
         # Panel de visualización
         display_frame = ttk.LabelFrame(main_container, text="Visualización en Tiempo Real", 
@@ -226,12 +2258,21 @@ class YoloCamApp:
                   command=self.start_camera, style="Corporate.TButton").pack(side="left", padx=2)
         ttk.Button(main_btns, text="⏹ Detener", 
                   command=self.stop_camera, style="Corporate.TButton").pack(side="left", padx=2)
-        ttk.Button(main_btns, text="� Capturar", 
+        ttk.Button(main_btns, text="📷 Capturar", 
                   command=self.save_snapshot, style="Corporate.TButton").pack(side="left", padx=2)
+        self.record_btn = ttk.Button(main_btns, text="⏺ Grabar",
+                                     command=self.toggle_recording, style="Corporate.TButton")
+        self.record_btn.pack(side="left", padx=2)
+        ttk.Button(main_btns, text="✏️ Dibujar ROI",
+                  command=self.toggle_roi_drawing, style="Corporate.TButton").pack(side="left", padx=2)
+        ttk.Button(main_btns, text="🗑 Borrar ROI",
+                  command=self.clear_rois, style="Corporate.TButton").pack(side="left", padx=2)
         
         # Grupo de botones secundarios
         secondary_btns = ttk.Frame(controls_frame, style="Corporate.TFrame")
         secondary_btns.pack(side="right")
+        ttk.Button(secondary_btns, text="📊 Métricas",
+                  command=self.show_metrics_panel, style="Corporate.TButton").pack(side="left", padx=2)
         ttk.Button(secondary_btns, text="💾 Guardar Config", 
                   command=self.save_settings, style="Corporate.TButton").pack(side="left", padx=2)
         ttk.Button(secondary_btns, text="Salir", 
@@ -250,31 +2291,72 @@ class YoloCamApp:
                                  style="Status.TLabel")
         self.fps_label.pack(side="right", padx=5)
 
+        # Progreso de carga y calentamiento del modelo
+        self.load_progress = ttk.Progressbar(status_frame, mode="indeterminate", length=140)
+
         # Área de visualización
         self.img_label = Label(display_frame, bg="#000000")
         self.img_label.pack(fill="both", expand=True, padx=5, pady=5)
+        self.img_label.bind("<ButtonPress-1>", self.on_roi_press)
+        self.img_label.bind("<ButtonRelease-1>", self.on_roi_release)
 
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
-    # --- Settings ---
-    def load_settings(self):
+        # Ventana primero: torch y Ultralytics se importan en segundo plano
+        self.startup.mark("ui")
+        self.root.after_idle(lambda: self.startup.mark("window"))
+        threading.Thread(target=self.init_ml_worker, daemon=True).start()
+
+    def init_ml_worker(self):
         try:
-            if os.path.exists(SETTINGS_FILE):
-                with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
-                    return json.load(f)
+            load_ml()
+            self.startup.mark("ml_imports")
+            device = "cuda:0" if torch.cuda.is_available() else "cpu"
+            self.startup.mark("device")
         except Exception as e:
-            print(f"[WARN] No se pudieron cargar settings: {e}")
-        return {}
+            print(f"[ERROR] No se pudo iniciar torch/Ultralytics: {e}")
+            self.root.after(0, lambda err=e: self.info_label.config(text=f"❌ Error al iniciar torch/Ultralytics: {err}"))
+            return
+        self.root.after(0, lambda: self.ml_ready(device))
+
+    def ml_ready(self, device):
+        if self.model is None:
+            self.device = device
+            if not self.model_loading:
+                self.info_label.config(text=f"Estado: Sistema Listo | Dispositivo: {device} | Modelo: (no cargado)")
+        self.startup.write()
+        if self.exit_after_startup:
+            self.on_close()
+
+    # --- Settings ---
+    def load_settings(self):
+        return read_settings()
 
     def save_settings(self):
-        data = {
+        # Conservar claves que no se editan desde la interfaz
+        data = dict(self.settings)
+        data.update({
             "MODEL_PATH": self.model_path.get().strip(),
             "SOURCE": self.source_str.get().strip(),
-            "CONFIDENCE": float(self.confidence.get())
-        }
+            "SOURCES": self.parse_sources(),
+            "CONFIDENCE": float(self.confidence.get()),
+            "IMGSZ": self.imgsz,
+            "BACKEND": self.backend.get(),
+            "TILED": bool(self.tiled.get()),
+            "MOTION_GATING": bool(self.motion_gating.get()),
+            "ADAPTIVE_QUALITY": bool(self.adaptive.get()),
+            "EVENT_CLIPS": bool(self.event_clips.get()),
+            "TARGET_FPS": float(self.target_fps.get()),
+            "USE_ROI": bool(self.use_roi.get()),
+            "ROIS": self.rois,
+            "TILE_SIZE": int(self.tile_size.get()),
+            "TILE_OVERLAP": float(self.tile_overlap.get()),
+            "TILE_BATCH": int(self.tile_batch.get())
+        })
         try:
             with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
+            self.settings = data
             self.info_label.config(text="✅ Configuración guardada en settings.json")
         except Exception as e:
             self.info_label.config(text=f"❌ Error al guardar settings: {e}")
@@ -293,47 +2375,270 @@ class YoloCamApp:
         if not os.path.exists(path):
             self.info_label.config(text=f"❌ Modelo no encontrado: {path}")
             return
+        if self.model_loading:
+            return
+        # La carga y el calentamiento van en segundo plano; el modelo solo se publica cuando está listo.
+        # Mientras tanto se sigue usando el anterior (la inspección en marcha no se queda sin modelo)
+        self.model_loading = True
+        self.info_label.config(text=f"⏳ Cargando modelo {os.path.basename(path)}...")
+        self.load_progress.configure(mode="indeterminate", value=0)
+        self.load_progress.pack(side="right", padx=5)
+        self.load_progress.start(15)
+        threading.Thread(target=self.load_model_worker,
+                         args=(path, self.backend.get(), self.imgsz), daemon=True).start()
+
+    def load_model_worker(self, path, backend, imgsz):
+        def status(text):
+            self.root.after(0, lambda: self.info_label.config(text=text))
+
+        def warmup_progress(done, total):
+            self.root.after(0, lambda: self.load_progress.configure(value=100.0 * done / total))
+
         try:
-            self.model = YOLO(path)
-            self.info_label.config(text=f"Dispositivo: {self.device} | Modelo cargado: {os.path.basename(path)}")
+            if YOLO is None:
+                status("⏳ Iniciando torch y Ultralytics...")
+                load_ml()
+            device = "cuda:0" if torch.cuda.is_available() else "cpu"
+            t0 = time.time()
+            model, backend_used = load_inference_model(
+                path, backend, imgsz, device,
+                check_image=self.settings.get("BACKEND_CHECK_IMAGE"),
+                log=lambda msg: (print(msg), status(f"⏳ {msg}")))
+            # Los modelos exportados corren en CPU
+            device = device if backend_used == "torch" else "cpu"
+            load_s = time.time() - t0
+            model_hash = file_sha256(path)[:16] if os.path.isfile(path) else os.path.basename(path)
+            signature = backend_signature(model, backend_used, device)
+
+            status(f"⏳ Calentando modelo ({device}, imgsz={imgsz})...")
+            self.root.after(0, lambda: (self.load_progress.stop(),
+                                        self.load_progress.configure(mode="determinate", value=0)))
+            runs = int(self.settings.get("WARMUP_RUNS", 2))
+            warm_s = warmup_model(model, imgsz, device, runs=runs, progress=warmup_progress)
+            sources = len(self.parse_sources())
+            if sources > 1:
+                # Formato de lote del modo multi-cámara
+                warm_s += warmup_model(model, imgsz, device, runs=1, batch=sources)
+            pool = None
+            workers = int(self.settings.get("INFERENCE_WORKERS", 0))
+            if workers > 0 and device == "cpu":
+                status(f"⏳ Arrancando {workers} procesos de inferencia...")
+                try:
+                    w, h = (int(v) for v in str(self.settings.get("WORKER_MAX_FRAME", "1920x1080")).lower().split("x"))
+                    pool = InferencePool(model.model_name, workers, task=model.task,
+                                         threads=int(self.settings.get("WORKER_THREADS", 0)) or None, max_frame=(w, h))
+                except Exception as e:
+                    print(f"[WARN] No se pudieron arrancar los procesos de inferencia ({e}), se infiere en el hilo principal")
         except Exception as e:
-            self.info_label.config(text=f"❌ Error al cargar modelo: {e}")
+            self.root.after(0, lambda err=e: self.model_load_failed(err))
+            return
+        self.root.after(0, lambda: self.model_ready(model, backend_used, device, path, load_s, warm_s, model_hash, pool,
+                                                    signature))
+
+    def model_ready(self, model, backend_used, device, path, load_s, warm_s, model_hash=None, pool=None,
+                    signature=None):
+        old_pool = self.pool
+        self.model, self.backend_used, self.device = model, backend_used, device
+        self.model_hash = model_hash
+        self.backend_signature = signature or backend_signature(model, backend_used, device)
+        self.pool = pool
+        self.renderer = DetectionRenderer(model.names)
+        if old_pool is not None:
+            def retire():
+                with old_pool.lock:  # espera a que termine un map() en curso con el modelo anterior
+                    old_pool.close()
+            threading.Thread(target=retire, daemon=True).start()
+        self.model_loading = False
+        self.load_progress.stop()
+        self.load_progress.pack_forget()
+        self.info_label.config(text=f"✅ Modelo listo: {os.path.basename(path)} | Dispositivo: {self.device} | "
+                                    f"Backend: {self.backend_used} | Carga {load_s:.1f} s | Calentamiento {warm_s:.1f} s"
+                                    + (f" | {pool.workers} procesos x {pool.threads} hilos" if pool else ""))
+        # Inspección pedida mientras el modelo cargaba
+        if self.pending_start:
+            sources, self.pending_start = self.pending_start, None
+            self.start_streams(sources)
+
+    def model_load_failed(self, error):
+        self.model_loading = False
+        self.pending_start = None
+        self.load_progress.stop()
+        self.load_progress.pack_forget()
+        self.info_label.config(text=f"❌ Error al cargar modelo: {error}")
+
+    def check_model_ready(self, sources=None):
+        # Durante una recarga el modelo anterior sigue en uso hasta que el nuevo esté listo
+        if self.model is not None:
+            return True
+        if self.model_loading:
+            if sources:
+                self.pending_start = sources
+                self.info_label.config(text="⏳ El modelo se está cargando; la inspección empezará cuando esté listo.")
+            else:
+                self.info_label.config(text="⏳ El modelo se está cargando, espera a que esté listo.")
+            return False
+        self.info_label.config(text="❗ Carga primero un modelo (.pt).")
+        return False
+
+    def parse_sources(self):
+        return [x.strip() for x in self.sources_str.get().split(";") if x.strip()]
 
     def start_camera(self):
+        self.start_streams([self.source_str.get().strip()])
+
+    def start_multi_camera(self):
+        sources = self.parse_sources()
+        if not sources:
+            self.info_label.config(text="❗ Define al menos una fuente en la lista multi-cámara.")
+            return
+        self.start_streams(sources)
+
+    def start_streams(self, sources):
         if self.running:
             return
-        if self.model is None:
-            self.info_label.config(text="❗ Carga primero un modelo (.pt).")
+        if not self.check_model_ready(sources):
             return
 
-        source = self.source_str.get().strip()
-        # Soporta índice numérico (webcam) o URL (RTSP/HTTP)
-        src = int(source) if source.isdigit() else source
+        self.release_streams()
+        if self.cap and self.cap.isOpened():
+            self.cap.release()
 
-        self.cap = cv2.VideoCapture(src)
-        if not self.cap.isOpened():
-            self.info_label.config(text=f"❌ No se pudo abrir la fuente: {source}")
-            return
+        # Un hilo de captura por fuente; todos despiertan al mismo hilo de inferencia
+        new_frame = threading.Event()
+        capture_opts = {
+            "transport": self.settings.get("RTSP_TRANSPORT", "tcp"),
+            "buffer_size": int(self.settings.get("CAPTURE_BUFFER", 1)),
+            "open_timeout_ms": int(self.settings.get("OPEN_TIMEOUT_MS", 5000)),
+            "read_timeout_ms": int(self.settings.get("READ_TIMEOUT_MS", 5000)),
+            # PyAV: decodificación en varios hilos y frames ya escalados (por defecto al tamaño de inferencia)
+            "backend": self.settings.get("CAPTURE_BACKEND", "opencv"),
+            "max_side": int(self.settings.get("DECODE_MAX_SIDE", 0) or self.imgsz),
+            "threads": int(self.settings.get("DECODE_THREADS", 0)),
+        }
+        streams = []
+        for i, source in enumerate(sources):
+            # Soporta índice numérico (webcam) o URL (RTSP/HTTP)
+            src = int(source) if source.isdigit() else source
+            cap = open_capture(src, **capture_opts)
+            if not cap.isOpened():
+                cap.release()
+                for st in streams:
+                    st.release()
+                self.info_label.config(text=f"❌ No se pudo abrir la fuente: {source}")
+                return
+            is_file = isinstance(src, str) and os.path.isfile(src)
+            grabber = FrameGrabber(cap, drop_frames=not is_file, notify=new_frame,
+                                   metrics=self.metrics, name=StreamState.short_name(source),
+                                   reopen=None if is_file else (lambda src=src: open_capture(src, **capture_opts)),
+                                   stale_s=float(self.settings.get("STALE_S", 5.0)),
+                                   frozen_s=float(self.settings.get("FROZEN_S", 10.0)),
+                                   backoff_max=float(self.settings.get("RECONNECT_MAX_S", 30.0)))
+            if is_file and len(sources) == 1 and source == self.video_path.get():
+                # Reanudar donde se quedó la reproducción (el salto lo hace el hilo de captura)
+                if self.video_index is not None and self.video_index.path == source:
+                    grabber.index = self.video_index
+                if self.current_frame_pos > 0:
+                    grabber.seek(self.current_frame_pos)
+            growing = self.remote_growing.get(source)
+            if is_file and growing is not None and growing.is_set():
+                grabber.growing, grabber.reopen_path = growing, src
+            gate = ChangeDetector(threshold=float(self.settings.get("MOTION_THRESHOLD", 0.005)),
+                                  max_interval=float(self.settings.get("MOTION_MAX_INTERVAL", 2.0)))
+            st = StreamState(i, source, cap, grabber, gate)
+            if is_file and self.pred_cache is not None:
+                # Descargas remotas: la clave de contenido no cambia mientras el archivo crece
+                st.file_hash = self.remote_keys.get(source) or quick_file_hash(src)
+            streams.append(st)
 
+        self.streams = streams
+        self.weld_image = None
+        self.quality = None
+        if self.adaptive.get():
+            self.quality = QualityController(
+                float(self.target_fps.get()), max_imgsz=self.imgsz,
+                min_imgsz=int(self.settings.get("MIN_IMGSZ", 320)),
+                max_stride=int(self.settings.get("MAX_STRIDE", 4)))
+        self.roi_pixels = [0, 0]
+        self.cap = streams[0].cap
+        self.grabber = streams[0].grabber
+        self.current_meta = []
+        for st in streams:
+            st.grabber.start()
         self.running = True
-        self.info_label.config(text=f"▶️ Cámara iniciada ({source}) con {os.path.basename(self.model_path.get())} en {self.device}")
-        threading.Thread(target=self.loop, daemon=True).start()
+        names = ", ".join(sources) if len(sources) > 1 else sources[0]
+        self.info_label.config(text=f"▶️ Cámara iniciada ({names}) con {os.path.basename(self.model_path.get())} en {self.device}")
+        threading.Thread(target=self.loop, args=(streams, new_frame), daemon=True).start()
         self.update_ui_frame()
 
+    def release_streams(self):
+        for st in self.streams:
+            st.release()
+        if self.pred_cache is not None:
+            self.pred_cache.flush()
+        self.streams = []
+        self.grabber = None
+
     def stop_camera(self):
         self.running = False
+        self.stop_recording()
+        self.release_streams()
         if self.cap and self.cap.isOpened():
             self.cap.release()
-        self.img_label.config(image="")
+        self.clear_display()
         self.fps_label.config(text="FPS: -")
         self.info_label.config(text="⏹ Cámara detenida.")
 
     def save_snapshot(self):
-        if self.current_frame is not None:
-            filename = f"snapshot_{int(time.time())}.jpg"
-            with self.frame_lock:
-                cv2.imwrite(filename, self.current_frame)
-            self.info_label.config(text=f"✅ Snapshot guardado: {filename}")
+        # La pantalla se dibuja a resolución reducida; la captura se dibuja a resolución completa.
+        # El dibujo y la escritura se hacen en el hilo de MediaWriter: aquí solo se encola.
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        if self.streams:
+            saved = []
+            for st in self.streams:
+                if st.last is None:
+                    continue
+                frame_bgr, result = st.last
+                if st.last_full is not None:
+                    # Captura escalada al decodificar: el frame completo solo se convierte aquí
+                    small = frame_bgr
+                    frame_bgr = st.last_full()
+                    if result is not None:
+                        boxes = result.boxes.data.cpu().numpy().copy()
+                        boxes[:, [0, 2]] *= frame_bgr.shape[1] / small.shape[1]
+                        boxes[:, [1, 3]] *= frame_bgr.shape[0] / small.shape[0]
+                        result = boxes_result(frame_bgr, boxes, self.model.names)
+                name = f"snapshot_{stamp}.jpg" if len(self.streams) == 1 else f"snapshot_{stamp}_{st.index + 1}.jpg"
+                path = os.path.join(self.snapshot_dir, name)
+                if self.writer.save_image(path, frame_bgr, result, self.renderer if result is not None else None):
+                    saved.append(path)
+            if saved:
+                self.info_label.config(text=f"✅ Snapshot guardado: {', '.join(saved)}")
+            elif self.writer.dropped:
+                self.info_label.config(text=f"⚠️ Snapshot descartado: el disco no da abasto ({self.writer.dropped} descartes)")
+        elif self.weld_image and self.current_frame is not None:
+            path = os.path.join(self.snapshot_dir, f"snapshot_{stamp}.jpg")
+            renderer = self.renderer if self.weld_result is not None else None
+            if self.writer.save_image(path, self.current_frame, self.weld_result, renderer):
+                self.info_label.config(text=f"✅ Snapshot guardado: {path}")
+
+    def toggle_recording(self):
+        if self.recording:
+            self.stop_recording()
+            return
+        if not self.running:
+            self.info_label.config(text="❌ Inicia la inspección antes de grabar")
+            return
+        self.recording = f"rec:{time.time()}"
+        path = os.path.join(self.recordings_dir, f"inspeccion_{datetime.now():%Y%m%d_%H%M%S}.mp4")
+        self.writer.open_video(self.recording, path, self.record_fps)
+        self.record_btn.config(text="⏹ Parar grabación")
+        self.info_label.config(text=f"⏺ Grabando en {path}")
+
+    def stop_recording(self):
+        if self.recording:
+            self.writer.close_video(self.recording)
+            self.recording = None
+            self.record_btn.config(text="⏺ Grabar")
             
     def browse_video(self):
         path = filedialog.askopenfilename(
@@ -354,6 +2659,11 @@ class YoloCamApp:
             self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
             self.fps = self.cap.get(cv2.CAP_PROP_FPS)
             self.current_frame_pos = 0
+            self.video_index = None
+            growing = self.remote_growing.get(path)
+            if growing is None or not growing.is_set():
+                # Un archivo a medio descargar se indexa al terminar (remote_complete)
+                threading.Thread(target=self.build_video_index, args=(path,), daemon=True).start()
             
             # Configurar barra de progreso
             self.progress_scale.configure(to=self.total_frames)
@@ -367,12 +2677,54 @@ class YoloCamApp:
         except Exception as e:
             self.info_label.config(text=f"❌ Error al cargar video: {str(e)}")
             
+    def build_video_index(self, path):
+        try:
+            t0 = time.time()
+            index, cached = VideoIndex.load_or_build(path, self.settings.get("VIDEO_INDEX_DIR", VIDEO_INDEX_DIR))
+        except Exception as e:
+            print(f"[WARN] No se pudo indexar el video {path}: {e}")
+            return
+        print(f"[INFO] Índice de {os.path.basename(path)}: {len(index.keyframes)} keyframes, "
+              f"{len(index.thumb_frames)} miniaturas ({'caché' if cached else f'{time.time() - t0:.1f} s'})")
+        self.root.after(0, lambda: self.video_index_ready(index))
+
+    def video_index_ready(self, index):
+        if self.video_path.get() != index.path:
+            return  # se cargó otro video mientras tanto
+        self.video_index = index
+        if self.grabber is not None and self.streams and self.streams[0].source == index.path:
+            self.grabber.index = index
+
     def seek_video(self, *args):
-        if self.cap and self.cap.isOpened():
-            pos = int(self.video_position.get())
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, pos)
-            self.current_frame_pos = pos
-            self.update_frame_counter()
+        # Llamado en cada movimiento de la barra: vista previa instantánea y salto real con antirrebote
+        pos = int(self.video_position.get())
+        self.current_frame_pos = pos
+        self.update_frame_counter()
+        if self.video_index is not None and not self.running:
+            thumb = self.video_index.thumbnail(pos)
+            if thumb is not None:
+                self.update_image_display(cv2.cvtColor(thumb, cv2.COLOR_BGR2RGB))
+        if self.seek_after_id is not None:
+            self.root.after_cancel(self.seek_after_id)
+        self.seek_after_id = self.root.after(self.seek_debounce_ms, self.apply_seek)
+
+    def apply_seek(self):
+        self.seek_after_id = None
+        # El salto lo ejecuta el hilo de captura; sin captura en marcha la posición se aplica al iniciar
+        if self.grabber and self.grabber.running:
+            self.grabber.seek(self.current_frame_pos)
+            if not self.running:
+                self.root.after(30, self.show_seek_frame, 20)
+
+    def show_seek_frame(self, tries):
+        # En pausa: mostrar el frame exacto del salto (sin inferencia) en cuanto el hilo de captura lo lee
+        if self.running or self.grabber is None:
+            return
+        packet = self.grabber.get(timeout=0)
+        if packet is not None:
+            self.update_image_display(cv2.cvtColor(packet.frame, cv2.COLOR_BGR2RGB))
+        elif tries > 0:
+            self.root.after(30, self.show_seek_frame, tries - 1)
             
     def toggle_play(self):
         if not self.running:
@@ -388,11 +2740,12 @@ class YoloCamApp:
         self.play_button.configure(text="▶ Reproducir")
         
     def video_to_start(self):
-        if self.cap and self.cap.isOpened():
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            self.current_frame_pos = 0
-            self.video_position.set(0)
-            self.update_frame_counter()
+        if self.seek_after_id is not None:
+            self.root.after_cancel(self.seek_after_id)
+        self.current_frame_pos = 0
+        self.video_position.set(0)
+        self.update_frame_counter()
+        self.apply_seek()
             
     def update_frame_counter(self):
         self.frame_label.configure(text=f"Frame: {self.current_frame_pos}/{self.total_frames}")
@@ -410,6 +2763,10 @@ class YoloCamApp:
                     raise Exception("No se pudo cargar la imagen")
                 
                 # Mostrar en interfaz
+                self.weld_image = path
+                self.weld_result = None
+                self.weld_raw = None
+                self.weld_hash = quick_file_hash(path) if self.pred_cache is not None else None
                 self.source_str.set(path)
                 self.info_label.config(text=f"✅ Imagen cargada: {os.path.basename(path)}")
                 
@@ -426,42 +2783,246 @@ class YoloCamApp:
             return
             
         try:
-            if self.model is None:
-                self.info_label.config(text="❗ Carga primero un modelo (.pt)")
+            if not self.check_model_ready():
                 return
                 
-            # Realizar inferencia
-            results = self.model.predict(
-                self.current_frame,
-                conf=float(self.confidence.get()),
-                imgsz=640,
-                device=self.device,
-                verbose=False
-            )
-            
-            # Procesar resultados
-            annotated = results[0].plot()
-            
-            # Mostrar resultados
-            frame_rgb = cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB)
-            self.update_image_display(frame_rgb)
+            # Realizar inferencia (solo sobre las ROI si hay definidas)
+            rois = self.active_rois("weld")
+            self.roi_pixels = [0, 0]
+            # Imagen ya analizada con este modelo y parámetros: solo se vuelve a filtrar
+            key = boxes = None
+            if self.pred_cache is not None and self.weld_hash and self.model_hash:
+                key = self.prediction_key(self.weld_hash, "weld", self.imgsz)
+                boxes = self.pred_cache.get(key, 0)
+            tile_stats = None
+            cached = boxes is not None
+            if not cached:
+                result = self.infer_frames([self.current_frame], [rois],
+                                           conf=self.pred_cache.floor if key else None)[0]
+                tile_stats = self.last_tile_stats
+                boxes = result.boxes.data.cpu().numpy()
+                if key:
+                    self.pred_cache.put(key, 0, boxes)
+                    self.pred_cache.flush()
+            self.weld_raw = boxes
+            result = self.weld_result = boxes_result(self.current_frame, boxes, self.model.names,
+                                                     float(self.confidence.get()))
+            if self.defect_log is not None and not cached:
+                self.defect_log.record(time.time(), self.weld_image, 0, result, self.model.names, self.model_hash)
+            self.draw_weld(result, rois)
             
             # Actualizar info
-            num_defects = len(results[0].boxes)
-            self.info_label.config(text=f"✅ Análisis completado: {num_defects} defectos detectados")
+            num_defects = len(result.boxes)
+            text = f"✅ Análisis completado: {num_defects} defectos detectados"
+            if cached:
+                text += " | desde caché"
+            if rois:
+                text += f" | ROI: {self.roi_ratio_text()}"
+            if tile_stats:
+                text += (f" | {tile_stats['tiles']} mosaicos en {tile_stats['total_ms'] / 1000.0:.2f} s "
+                         f"({tile_stats['per_tile_ms']:.0f} ms/mosaico)")
+            self.info_label.config(text=text)
             
         except Exception as e:
             self.info_label.config(text=f"❌ Error en análisis: {str(e)}")
             
+    def draw_weld(self, result, rois):
+        # Dibujar directamente a tamaño de pantalla
+        self.display_size = self.label_size()
+        h, w = self.current_frame.shape[:2]
+        size = self.fit_within((w, h), self.display_size)
+        frame_rgb = self.renderer.render(self.current_frame, result, size, counter=False)
+        if rois:
+            self.renderer.draw_rois(frame_rgb, rois, (w, h))
+        self.show_rgb(frame_rgb)
+
+    def prediction_key(self, file_hash, source, imgsz, decode=None):
+        # Backend/precisión, mosaicos, ROI y el ancho decodificado (captura escalada) cambian las predicciones:
+        # forman parte de la clave
+        tiles = [int(self.tile_size.get()), float(self.tile_overlap.get())] if self.tiled.get() else None
+        variant = [tiles, self.active_rois(source)]
+        if decode:
+            variant.append(int(decode))
+        variant = json.dumps(variant)
+        return self.pred_cache.key(file_hash, self.model_hash, imgsz, variant, self.backend_signature)
+
+    def on_confidence_change(self, *args):
+        # En pausa o con la imagen de soldadura ya analizada: volver a filtrar y redibujar sin inferir
+        if self.running or self.renderer is None:
+            return
+        conf = float(self.confidence.get())
+        if self.weld_image and self.weld_raw is not None and self.current_frame is not None:
+            self.weld_result = boxes_result(self.current_frame, self.weld_raw, self.model.names, conf)
+            self.draw_weld(self.weld_result, self.active_rois("weld"))
+            self.info_label.config(text=f"✅ {len(self.weld_result.boxes)} defectos con confianza ≥ {conf:.2f}")
+        elif len(self.streams) == 1 and self.streams[0].last is not None and self.streams[0].last_raw is not None:
+            st = self.streams[0]
+            frame = st.last[0]
+            result = boxes_result(frame, st.last_raw, self.model.names, conf)
+            st.last = (frame, result)
+            self.display_size = self.label_size()
+            h, w = frame.shape[:2]
+            frame_rgb = self.renderer.render(frame, result, self.fit_within((w, h), self.display_size))
+            rois = self.active_rois(st.source)
+            if rois:
+                self.renderer.draw_rois(frame_rgb, rois, st.source_size(frame))
+            self.show_rgb(frame_rgb)
+
+    # --- Regiones de interés ---
+    def roi_key(self):
+        # Las ROI se dibujan en la vista de una sola fuente o sobre la imagen de soldadura
+        if self.running and len(self.streams) == 1:
+            return self.streams[0].source
+        if not self.running and self.weld_image:
+            return "weld"
+        return None
+
+    def roi_frame_size(self, key):
+        if key == "weld":
+            frame = self.current_frame
+        else:
+            last = self.streams[0].last if self.streams else None
+            if last:
+                # Las ROI se guardan en píxeles de la fuente aunque la captura salga escalada
+                return self.streams[0].source_size(last[0])
+            frame = None
+        return None if frame is None else (frame.shape[1], frame.shape[0])
+
+    def active_rois(self, key):
+        if not self.use_roi.get():
+            return None
+        return self.rois.get(key) or None
+
+    def warn_rois_outside(self, rois, regions, width, height):
+        """Aviso (una vez por juego de ROIs y tamaño de frame) si alguna ROI se sale del frame y se ha recortado."""
+        outside = [r for r in rois if min(r[0], r[2]) < 0 or min(r[1], r[3]) < 0
+                   or max(r[0], r[2]) > width or max(r[1], r[3]) > height]
+        key = (tuple(tuple(r) for r in rois), width, height)
+        if not outside or key in self.roi_warned:
+            return
+        self.roi_warned.add(key)
+        if regions:
+            msg = f"{len(outside)} ROI se salen del frame {width}x{height} y se han recortado"
+        else:
+            msg = f"ninguna ROI cae dentro del frame {width}x{height}: se analiza el frame completo"
+        print(f"[WARN] {msg}: {outside}")
+        self.root.after(0, lambda: self.info_label.config(text=f"⚠️ {msg}. Revisa las ROI de esta fuente."))
+
+    def toggle_roi_drawing(self):
+        key = self.roi_key()
+        if key is None:
+            self.info_label.config(text="❗ Las ROI se dibujan sobre una sola fuente en marcha o sobre la imagen de soldadura.")
+            return
+        self.roi_drawing = not self.roi_drawing
+        self.img_label.config(cursor="crosshair" if self.roi_drawing else "")
+        if self.roi_drawing:
+            self.info_label.config(text="✏️ Arrastra sobre la imagen para añadir una ROI; pulsa de nuevo para terminar.")
+        else:
+            self.info_label.config(text=f"✅ {len(self.rois.get(key, []))} ROI definidas (💾 Guardar Config para conservarlas)")
+
+    def clear_rois(self):
+        key = self.roi_key()
+        if key is not None:
+            self.rois.pop(key, None)
+            self.refresh_weld_preview(key)
+            self.info_label.config(text="🗑 ROI eliminadas")
+
+    def label_to_frame(self, x, y, frame_size):
+        """Convierte un punto del Label a píxeles del frame (la imagen está centrada en el Label)."""
+        imgtk = getattr(self.img_label, "imgtk", None)
+        if imgtk is None:
+            return None
+        iw, ih = imgtk.width(), imgtk.height()
+        ox = (self.img_label.winfo_width() - iw) / 2
+        oy = (self.img_label.winfo_height() - ih) / 2
+        fw, fh = frame_size
+        fx = min(max((x - ox) * fw / iw, 0), fw)
+        fy = min(max((y - oy) * fh / ih, 0), fh)
+        return int(fx), int(fy)
+
+    def on_roi_press(self, event):
+        if self.roi_drawing:
+            self.roi_start = (event.x, event.y)
+
+    def on_roi_release(self, event):
+        if not self.roi_drawing or self.roi_start is None:
+            return
+        key = self.roi_key()
+        size = self.roi_frame_size(key) if key else None
+        start, self.roi_start = self.roi_start, None
+        if size is None:
+            return
+        p1 = self.label_to_frame(*start, size)
+        p2 = self.label_to_frame(event.x, event.y, size)
+        if p1 is None or p2 is None:
+            return
+        roi = clip_rois([(p1[0], p1[1], p2[0], p2[1])], *size)
+        if roi:
+            self.rois.setdefault(key, []).append(list(roi[0]))
+            self.use_roi.set(True)  # dibujar una ROI es pedir usarla
+            self.refresh_weld_preview(key)
+            self.info_label.config(text=f"✏️ ROI añadida {roi[0]} ({len(self.rois[key])} en total)")
+
+    def refresh_weld_preview(self, key):
+        # En vivo las ROI se pintan con cada frame; con la imagen fija hay que repintar
+        if key != "weld" or self.current_frame is None:
+            return
+        self.display_size = self.label_size()
+        h, w = self.current_frame.shape[:2]
+        frame_rgb = cv2.cvtColor(cv2.resize(self.current_frame, self.fit_within((w, h), self.display_size),
+                                            interpolation=cv2.INTER_LINEAR), cv2.COLOR_BGR2RGB)
+        DetectionRenderer.draw_rois(frame_rgb, self.rois.get(key, []), (w, h))
+        self.show_rgb(frame_rgb)
+
+    def roi_ratio_text(self):
+        full, sent = self.roi_pixels
+        if not full or not sent:
+            return "-"
+        return f"{100.0 * sent / full:.0f} % de los píxeles ({full / sent:.1f}x menos)"
+
+    def predict_tiled(self, frame, conf=None):
+        return tiled_predict(
+            self.model, frame,
+            conf=float(self.confidence.get()) if conf is None else conf,
+            device=self.device,
+            tile=int(self.tile_size.get()),
+            overlap=float(self.tile_overlap.get()),
+            batch_size=int(self.tile_batch.get())
+        )
+
     def update_image_display(self, frame):
         if frame is not None:
-            img_pil = Image.fromarray(frame)
-            w = self.img_label.winfo_width() or 960
-            h = self.img_label.winfo_height() or 540
-            img_pil = img_pil.resize(self.fit_within(img_pil.size, (w, h)), Image.LANCZOS)
+            self.display_size = self.label_size()
+            self.show_rgb(self.prepare_display(frame))
+
+    def label_size(self):
+        w = self.img_label.winfo_width()
+        h = self.img_label.winfo_height()
+        # Antes de dibujarse la ventana winfo devuelve 1
+        return (w if w > 1 else 960, h if h > 1 else 540)
+
+    def prepare_display(self, frame):
+        """Escala el frame al área de visualización; se llama desde el hilo de inferencia."""
+        h, w = frame.shape[:2]
+        size = self.fit_within((w, h), self.display_size)
+        if size == (w, h):
+            return frame
+        return cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+
+    def show_rgb(self, frame):
+        img_pil = Image.fromarray(frame)
+        imgtk = getattr(self.img_label, "imgtk", None)
+        if imgtk is not None and (imgtk.width(), imgtk.height()) == img_pil.size:
+            # Mismo tamaño: se reescribe el PhotoImage existente en lugar de crear otro
+            imgtk.paste(img_pil)
+        else:
             imgtk = ImageTk.PhotoImage(image=img_pil)
-            self.img_label.imgtk = imgtk
+            self.img_label.imgtk = imgtk  # evitar GC
             self.img_label.configure(image=imgtk)
+
+    def clear_display(self):
+        self.img_label.imgtk = None
+        self.img_label.config(image="")
             
     def load_company_logo(self):
         """Cargar y mostrar el logo de la empresa"""
@@ -496,123 +3057,211 @@ class YoloCamApp:
             print(f"Error al cargar el logo: {e}")
             
     def load_youtube_video(self):
-        try:
-            url = self.youtube_url.get()
-            if not url:
-                self.info_label.config(text="❌ Por favor, introduce una URL de YouTube")
-                return
-                
-            self.info_label.config(text="⏳ Descargando video de YouTube...")
-            self.root.update()
-            # Convertir URL de shorts a formato normal (si aplica)
-            if '/shorts/' in url:
-                video_id = url.split('/shorts/')[1].split('?')[0]
-                url = f'https://www.youtube.com/watch?v={video_id}'
-
-            # Crear directorio temporal si no existe
-            temp_dir = os.path.join(tempfile.gettempdir(), "yolo_cam_gui")
-            os.makedirs(temp_dir, exist_ok=True)
-
-            # Primero intentamos obtener una URL directa de streaming (sin descargar completo)
-            ytdl_opts_stream = {
-                'format': 'best',
-                'noplaylist': True,
-                'quiet': True,
-                'no_warnings': True,
-                'geo_bypass': True,
-            }
-            # Añadir cookiefile si fue proporcionado
-            if self.cookie_path.get():
-                ytdl_opts_stream['cookiefile'] = self.cookie_path.get()
-
-            direct_url = None
-            info = None
-            try:
-                with YoutubeDL(ytdl_opts_stream) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    # Buscar en formatos una URL http/https/m3u8 que OpenCV pueda abrir
-                    formats = info.get('formats') if isinstance(info, dict) else None
-                    if formats:
-                        # Prefer mp4/http progressive formats
-                        for f in reversed(formats):
-                            fproto = f.get('protocol')
-                            fext = f.get('ext')
-                            furl = f.get('url')
-                            if not furl:
-                                continue
-                            if fproto in ('https', 'http', 'm3u8_native', 'm3u8_dash'):
-                                # prefer mp4/webm if present
-                                if fext in ('mp4', 'webm') or 'dash' in fproto or 'm3u8' in fproto:
-                                    direct_url = furl
-                                    break
-                        # If still not found, take best format url
-                        if not direct_url and formats:
-                            direct_url = formats[-1].get('url')
-            except Exception as e_stream:
-                # no pasa nada, intentamos fallback a descarga completa
-                print('yt-dlp extract_info stream failed:', e_stream)
-
-            # Si tenemos una URL directa, intentamos usarla sin descargar
-            if direct_url:
-                # Probar abrir con OpenCV
-                test_cap = cv2.VideoCapture(direct_url)
-                time.sleep(0.5)
-                if test_cap.isOpened():
-                    test_cap.release()
-                    self.source_str.set(direct_url)
-                    title = info.get('title') if isinstance(info, dict) else 'YouTube stream'
-                    self.info_label.config(text=f"✅ Stream directo disponible: {title}")
-                    return
-                else:
-                    print('OpenCV no pudo abrir el stream directo, fallback a descarga')
-                    try:
-                        test_cap.release()
-                    except:
-                        pass
-
-            # Si no hay URL directa o OpenCV no la abrió, descargamos el archivo localmente
-            ytdl_opts_download = {
-                'format': 'mp4[ext=mp4]+bestaudio/best',
-                'outtmpl': os.path.join(temp_dir, 'yt_video_%(id)s.%(ext)s'),
-                'noplaylist': True,
-                'quiet': True,
-                'no_warnings': True,
-                'retries': 3,
-                'geo_bypass': True,
-            }
-            if self.cookie_path.get():
-                ytdl_opts_download['cookiefile'] = self.cookie_path.get()
-
-            with YoutubeDL(ytdl_opts_download) as ydl:
-                info = ydl.extract_info(url, download=True)
-                vid_id = info.get('id') if isinstance(info, dict) else None
-                ext = info.get('ext') if isinstance(info, dict) else 'mp4'
-                if vid_id:
-                    self.yt_video_path = os.path.join(temp_dir, f"yt_video_{vid_id}.{ext}")
-                else:
-                    files = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir)]
-                    files = [f for f in files if os.path.isfile(f)]
-                    files.sort(key=lambda x: os.path.getmtime(x), reverse=True)
-                    self.yt_video_path = files[0] if files else None
+        url = self.youtube_url.get().strip()
+        if not url:
+            self.info_label.config(text="❌ Por favor, introduce una URL de YouTube")
+            return
+        if self.ingest_thread is not None and self.ingest_thread.is_alive():
+            self.info_label.config(text="⏳ Ya hay una descarga en curso")
+            return
+        # Convertir URL de shorts a formato normal (si aplica)
+        if '/shorts/' in url:
+            video_id = url.split('/shorts/')[1].split('?')[0]
+            url = f'https://www.youtube.com/watch?v={video_id}'
+        self.info_label.config(text="⏳ Consultando video remoto...")
+        self.ingest_progress.configure(value=0)
+        self.ingest_progress.pack(fill="x", padx=10, pady=(0, 5))
+        self.ingest_thread = threading.Thread(target=self.ingest_remote_worker,
+                                              args=(url, self.cookie_path.get()), daemon=True)
+        self.ingest_thread.start()
 
-            # Verificar que el archivo se descargó correctamente
-            if not self.yt_video_path or not os.path.exists(self.yt_video_path) or os.path.getsize(self.yt_video_path) == 0:
-                raise Exception('Error en la descarga del archivo con yt-dlp')
+    def ingest_remote_worker(self, url, cookies):
+        """Descarga en segundo plano a la caché; avisa en cuanto el archivo parcial ya se puede reproducir."""
+        def status(text, percent=None):
+            self.root.after(0, lambda: self.ingest_status(text, percent))
 
-            # Actualizar fuente local
-            self.source_str.set(self.yt_video_path)
-            title = info.get('title') if isinstance(info, dict) else os.path.basename(self.yt_video_path)
-            self.info_label.config(text=f"✅ Video descargado: {title}")
-            
+        opts = {
+            'format': self.settings.get("REMOTE_FORMAT", REMOTE_FORMAT),
+            'noplaylist': True,
+            'quiet': True,
+            'no_warnings': True,
+            'retries': 3,
+            'geo_bypass': True,
+        }
+        if cookies:
+            opts['cookiefile'] = cookies
+        try:
+            from yt_dlp import YoutubeDL
+            with YoutubeDL(opts) as ydl:
+                info = ydl.extract_info(url, download=False)
         except Exception as e:
             error_msg = str(e)
             if "HTTP Error 400" in error_msg:
                 error_msg = "Error al acceder al video. Asegúrate de que el video es público y la URL es correcta."
-            self.info_label.config(text=f"❌ Error al cargar video: {error_msg}")
-            print(f"Error detallado: {error_msg}")
+            print(f"[ERROR] yt-dlp: {e}")
+            self.root.after(0, lambda: self.ingest_failed(error_msg))
+            return
+        title = info.get('title') or url
+        if info.get('is_live'):
+            # Directo: no se puede descargar, se abre la URL del stream
+            self.root.after(0, lambda: self.remote_ready(info.get('url'), title, None, None, live=True))
+            return
+
+        key = RemoteVideoCache.key(info)
+        cached = self.remote_cache.lookup(key)
+        if cached:
+            self.root.after(0, lambda: self.remote_ready(cached, title, None, key))
+            return
+
+        path = self.remote_cache.path(key, info.get('ext') or 'mp4')
+        growing = threading.Event()
+        growing.set()
+        start_bytes = int(float(self.settings.get("REMOTE_START_MB", 8)) * 1024 * 1024)
+        state = {"started": False, "next_try": start_bytes, "last": 0.0}
+
+        def hook(d):
+            if d.get('status') != 'downloading':
+                return
+            done = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            now = time.time()
+            if now - state["last"] >= 0.25:
+                state["last"] = now
+                speed = (d.get('speed') or 0) / 1e6
+                size = f"{done / 1e6:.1f}/{total / 1e6:.1f} MB" if total else f"{done / 1e6:.1f} MB"
+                status(f"⬇️ {title}: {size} ({speed:.1f} MB/s)", 100.0 * done / total if total else None)
+            # Arranque anticipado: probar cada `start_bytes` si el archivo parcial ya abre y decodifica
+            if not state["started"] and done >= state["next_try"]:
+                state["next_try"] = done + start_bytes
+                if video_playable(d.get('filename') or path):
+                    state["started"] = True
+                    playable = d.get('filename') or path
+                    self.root.after(0, lambda: self.remote_ready(playable, title, growing, key))
+
+        # Sin archivo .part: el reproductor puede abrir el archivo mientras crece; la marca de
+        # completado la escribe la caché al terminar
+        opts.update(outtmpl=os.path.join(self.remote_cache.folder, f"{key}.%(ext)s"),
+                    nopart=True, progress_hooks=[hook])
+        try:
+            with YoutubeDL(opts) as ydl:
+                result = ydl.process_ie_result(info, download=True)
+            downloads = result.get('requested_downloads') or [{}]
+            path = downloads[0].get('filepath') or path
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                raise Exception('Error en la descarga del archivo con yt-dlp')
+            self.remote_cache.complete(key, path)
+        except Exception as e:
+            print(f"[ERROR] Descarga fallida: {e}")
+            self.root.after(0, lambda err=str(e): self.ingest_failed(err))
+            return
+        finally:
+            growing.clear()
+        if state["started"]:
+            self.root.after(0, lambda: self.remote_complete(path, title))
+        else:
+            self.root.after(0, lambda: self.remote_ready(path, title, None, key))
+
+    def ingest_status(self, text, percent):
+        self.info_label.config(text=text)
+        if percent is not None:
+            self.ingest_progress.configure(value=percent)
+
+    def ingest_failed(self, error_msg):
+        self.ingest_progress.pack_forget()
+        self.info_label.config(text=f"❌ Error al cargar video: {error_msg}")
+
+    def remote_ready(self, path, title, growing, key, live=False):
+        if live:
+            self.ingest_progress.pack_forget()
+            self.source_str.set(path)
+            self.info_label.config(text=f"✅ Stream directo disponible: {title}")
+            return
+        if key:
+            self.remote_keys[path] = key
+        if growing is not None:
+            self.remote_growing[path] = growing
+        else:
+            self.ingest_progress.pack_forget()
+        self.video_path.set(path)
+        self.load_video_file(path)
+        if growing is not None and growing.is_set():
+            self.info_label.config(text=f"▶️ Listo para reproducir mientras se descarga: {title}")
+        else:
+            self.info_label.config(text=f"✅ Video descargado: {title}")
+
+    def remote_complete(self, path, title):
+        self.ingest_progress.pack_forget()
+        self.info_label.config(text=f"✅ Descarga completa: {title}")
+        if self.video_path.get() == path:
+            # Ahora sí se conoce el video entero: índice de saltos y duración definitiva
+            self.total_frames = max(self.total_frames, video_frame_count(path))
+            self.progress_scale.configure(to=self.total_frames)
+            self.update_frame_counter()
+            threading.Thread(target=self.build_video_index, args=(path,), daemon=True).start()
+
+    # --- Métricas ---
+    def start_metrics_export(self):
+        port = int(self.settings.get("METRICS_PORT", 9108))
+        if port > 0:
+            try:
+                self.metrics_server = start_metrics_server(self.metrics, port)
+                print(f"[INFO] Métricas en http://127.0.0.1:{port}/metrics")
+            except OSError as e:
+                print(f"[WARN] No se pudo abrir el puerto de métricas {port}: {e}")
+        interval = float(self.settings.get("METRICS_CSV_INTERVAL", 60))
+        if interval > 0:
+            folder = self.settings.get("METRICS_DIR", "metrics")
+
+            def dump_loop():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        path = os.path.join(folder, f"metrics_{datetime.now():%Y%m%d}.csv")
+                        self.metrics.dump_csv(path)
+                    except Exception as e:
+                        print(f"[WARN] No se pudieron volcar las métricas: {e}")
+
+            threading.Thread(target=dump_loop, daemon=True).start()
+
+    def show_metrics_panel(self):
+        if self.metrics_window is not None and self.metrics_window.winfo_exists():
+            self.metrics_window.lift()
+            return
+        win = Toplevel(self.root)
+        win.title("Métricas por etapa (ms)")
+        win.geometry("760x420")
+        columns = ("source", "stage", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms")
+        headers = ("Fuente", "Etapa", "N", "Media", "p50", "p95", "p99")
+        tree = ttk.Treeview(win, columns=columns, show="headings")
+        for col, text in zip(columns, headers):
+            tree.heading(col, text=text)
+            tree.column(col, width=150 if col in ("source", "stage") else 70,
+                        anchor="w" if col in ("source", "stage") else "e")
+        tree.pack(fill="both", expand=True, padx=5, pady=5)
+        self.metrics_window = win
+
+        def refresh():
+            if not win.winfo_exists():
+                return
+            tree.delete(*tree.get_children())
+            for row in self.metrics.summary():
+                tree.insert("", "end", values=[row[c] if c in ("source", "stage", "count") else f"{row[c]:.1f}"
+                                               for c in columns])
+            win.after(1000, refresh)
+
+        refresh()
 
     def on_close(self):
         self.stop_camera()
+        self.writer.close()
+        if self.defect_log is not None:
+            self.defect_log.close()
+        if self.pred_cache is not None:
+            self.pred_cache.close()
+        if self.pool is not None:
+            self.pool.close()
+        if self.metrics_server is not None:
+            threading.Thread(target=self.metrics_server.shutdown, daemon=True).start()
         self.root.after(200, self.root.destroy)
 
     def browse_cookies(self):
@@ -623,90 +3272,322 @@ class YoloCamApp:
         if path:
             self.cookie_path.set(path)
 
-    # --- Bucle de captura e inferencia (thread) ---
-    def loop(self):
-        prev_time = time.time()
-        while self.running and self.cap and self.cap.isOpened():
+    # --- Bucle de inferencia (thread); la captura va en FrameGrabber ---
+    def loop(self, streams, new_frame):
+        while self.running and all(st.grabber.running for st in streams):
+            model = self.model
+            if model is None:
+                # Sin modelo publicado: esperar en lugar de caer con la inspección marcada en marcha
+                time.sleep(0.1)
+                continue
             if hasattr(self, 'video_path') and self.video_path.get():
                 # Modo reproducción de video
                 if not self.is_playing:
                     time.sleep(0.1)
                     continue
-                    
-                ok, frame_bgr = self.cap.read()
-                if not ok:
+
+            # Recoger el frame más reciente de cada fuente; los anteriores ya se descartaron
+            new_frame.wait(0.5)
+            new_frame.clear()
+            batch = []
+            for st in streams:
+                packet = st.grabber.get(timeout=0)
+                if packet is not None:
+                    batch.append((st, packet))
+            if not batch:
+                if all(st.grabber.eof for st in streams):
                     # Fin del video
                     self.pause_video()
-                    continue
-                    
+                continue
+
+            packet = batch[0][1]
+            if len(streams) == 1 and packet.pos >= 0 and self.seek_after_id is None:
                 # Actualizar posición
-                self.current_frame_pos = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+                self.current_frame_pos = packet.pos
                 self.video_position.set(self.current_frame_pos)
                 self.update_frame_counter()
-            else:
-                # Modo cámara en vivo
-                ok, frame_bgr = self.cap.read()
-                if not ok:
-                    time.sleep(0.01)
-                    continue
 
-            # Inferencia
+            # Compuerta de cambios: si la escena no se ha movido se reutilizan las detecciones anteriores
+            busy_start = time.perf_counter()
+            quality = self.quality
+            stride = quality.stride if quality else 1
+            gating = self.motion_gating.get()
+            now = time.time()
+            pending = []
+            for st, p in batch:
+                st.frame_count += 1
+                # Con salto de frames solo se infiere 1 de cada `stride`
+                if st.last is None or (st.frame_count % stride == 0
+                                       and (not gating or st.gate.needs_inference(p.frame, now))):
+                    pending.append((st, p))
+
+            # Videos locales ya analizados: las predicciones salen de la caché y solo se vuelven a filtrar
+            imgsz = quality.imgsz if quality else self.imgsz
+            conf = float(self.confidence.get())
+            cache = self.pred_cache if self.model_hash else None
+            keys, raw = {}, {}
+            if cache is not None:
+                for st, p in pending:
+                    if st.file_hash and p.pos > 0:
+                        decode = st.grabber.cap.get(cv2.CAP_PROP_FRAME_WIDTH) if st.scale() != 1.0 else None
+                        key = keys[st.index] = self.prediction_key(st.file_hash, st.source, imgsz, decode)
+                        boxes = cache.get(key, p.pos - 1)
+                        if boxes is not None:
+                            raw[st.index] = boxes
+            hits = set(raw)
+            to_infer = [(st, p) for st, p in pending if st.index not in hits]
+
+            # Inferencia: un único predict con los frames (o ROIs) de todas las fuentes
+            t_infer = time.perf_counter()
             try:
-                results = self.model.predict(
-                    frame_bgr,
-                    conf=float(self.confidence.get()),
-                    imgsz=640,
-                    device=self.device,
-                    verbose=False
-                )
-                annotated = results[0].plot()  # BGR
-                
-                # Agregar información de defectos si es análisis de soldadura
-                if hasattr(self, 'tab_weld'):
-                    num_defects = len(results[0].boxes)
-                    cv2.putText(annotated, f"Defectos: {num_defects}", (10, 60),
-                              cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                    
+                # Las ROI están en píxeles de la fuente; con captura escalada se llevan al frame decodificado
+                rois = [scale_rois(self.active_rois(st.source), st.scale()) for st, _ in to_infer]
+                # Con caché se predice a la confianza mínima; el umbral del slider se aplica al filtrar
+                floor = cache.floor if keys else None
+                fresh = self.infer_frames([p.frame for _, p in to_infer], rois, imgsz, conf=floor) if to_infer else []
+                error = None
             except Exception as e:
-                annotated = frame_bgr
-                cv2.putText(annotated, f"Error inferencia: {e}", (10, 30),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-
-            # BGR->RGB para Tkinter
-            frame_rgb = cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB)
+                fresh = [None] * len(to_infer)
+                error = e
+            infer_ms = (time.perf_counter() - t_infer) * 1000.0
+            for (st, p), result in zip(to_infer, fresh):
+                if result is None:
+                    continue
+                self.metrics.add(st.metric_name, "predict", infer_ms)
+                # Desglose interno de Ultralytics (ms por imagen), si está disponible
+                speed = getattr(result, "speed", None) or {}
+                for stage in ("preprocess", "inference", "postprocess"):
+                    if speed.get(stage) is not None:
+                        self.metrics.add(st.metric_name, stage, speed[stage])
+                raw[st.index] = result.boxes.data.cpu().numpy()
+                if st.index in keys:
+                    cache.put(keys[st.index], p.pos - 1, raw[st.index])
 
-            # FPS simple
+            names = model.names
+            fresh = {}
+            for st, p in pending:
+                if st.index not in raw:
+                    fresh[st.index] = None
+                    continue
+                st.last_raw = raw[st.index]
+                fresh[st.index] = boxes_result(p.frame, raw[st.index], names, conf)
+                # Solo los resultados nuevos: los reutilizados (salto de frames, caché) ya se registraron
+                if self.defect_log is not None and st.index not in hits:
+                    self.defect_log.record(p.ts, st.metric_name, p.pos if p.pos >= 0 else p.seq,
+                                           fresh[st.index], names, self.model_hash, st.scale())
+            results = [fresh[st.index] if st.index in fresh else st.last[1] for st, _ in batch]
             now = time.time()
-            fps = 1.0 / max(1e-6, (now - prev_time))
-            prev_time = now
-            cv2.putText(frame_rgb, f"FPS: {fps:.1f}", (10, 30),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            renderer = self.renderer
+            box = self.display_size if len(streams) == 1 else GRID_TILE
+            for (st, packet), result in zip(batch, results):
+                # Dibujo en RGB y a la resolución con la que se va a mostrar
+                h, w = packet.frame.shape[:2]
+                timings = {}
+                frame_rgb = renderer.render(packet.frame, result, self.fit_within((w, h), box), timings=timings)
+                for stage, ms in timings.items():
+                    self.metrics.add(st.metric_name, stage, ms)
+                if result is None:
+                    cv2.putText(frame_rgb, f"Error inferencia: {error}", (10, 30),
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
+                st_rois = self.active_rois(st.source)
+                if st_rois:
+                    renderer.draw_rois(frame_rgb, st_rois, st.source_size(packet.frame))
+                st.last = (packet.frame, result)
+                st.last_full = packet.full
+
+                # FPS por fuente (media exponencial)
+                st.tick(now)
+                cv2.putText(frame_rgb, f"FPS: {st.fps:.1f}", (10, 30),
+                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                st.frame = frame_rgb
+
+                # Clips de eventos: buffer previo y clip alrededor de cada frame con defectos
+                if self.event_clips.get():
+                    if st.clips is None:
+                        st.clips = EventClipRecorder(
+                            self.writer, st.metric_name, self.recordings_dir, self.record_fps,
+                            pre_s=float(self.settings.get("CLIP_PRE_S", 3.0)),
+                            post_s=float(self.settings.get("CLIP_POST_S", 3.0)))
+                    st.clips.push(frame_rgb, result is not None and len(result.boxes) > 0, now)
+                elif st.clips is not None:
+                    st.clips.close()
+                    st.clips = None
+
+            display = streams[0].frame if len(streams) == 1 else self.compose_grid(streams)
+            # El escalado a pantalla se hace aquí y no en el hilo de Tk
+            t_scale = time.perf_counter()
+            scaled = self.prepare_display(display)
+            self.metrics.add("ui", "ui_resize", (time.perf_counter() - t_scale) * 1000.0)
+            recording = self.recording
+            if recording:
+                # Los frames publicados no se modifican después: se encolan sin copiar
+                self.writer.add_frame(recording, display, now)
 
             with self.frame_lock:
-                self.current_frame = frame_rgb
+                self.current_frame = display
+                self.display_frame = scaled
+                self.current_meta = batch
+                self.frame_version += 1
+
+            if quality:
+                quality.update(time.perf_counter() - busy_start, 1, time.time())
 
         # Fin del hilo
         self.running = False
 
+    def infer_frames(self, frames, rois=None, imgsz=None, conf=None):
+        """Inferencia por lotes. Con ROI solo se envían los recortes y las cajas vuelven a coordenadas del frame.
+
+        `conf` sustituye al umbral del slider (p. ej. la confianza mínima de la caché de predicciones).
+        """
+        conf = float(self.confidence.get()) if conf is None else conf
+        # Modelo y procesos leídos una vez: un cambio de modelo no mezcla los dos en el mismo lote
+        model, pool = self.model, self.pool
+        rois = rois or [None] * len(frames)
+        crops, owners = [], []
+        for i, (frame, frame_rois) in enumerate(zip(frames, rois)):
+            h, w = frame.shape[:2]
+            regions = clip_rois(frame_rois, w, h) if frame_rois else []
+            if frame_rois:
+                self.warn_rois_outside(frame_rois, regions, w, h)
+            if regions:
+                self.roi_pixels[0] += w * h
+                self.roi_pixels[1] += sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+                for x1, y1, x2, y2 in regions:
+                    crops.append(frame[y1:y2, x1:x2])
+                    owners.append((i, x1, y1))
+            else:
+                crops.append(frame)
+                owners.append((i, 0, 0))
+
+        self.last_tile_stats = None
+        crop_results = None
+        if self.tiled.get():
+            # Por mosaicos: cada imagen (o ROI) ya se reparte en lotes de mosaicos
+            crop_results, tiles, total_ms = [], 0, 0.0
+            for crop in crops:
+                result, stats = self.predict_tiled(crop, conf)
+                crop_results.append(result)
+                tiles += stats["tiles"]
+                total_ms += stats["total_ms"]
+            self.last_tile_stats = {"tiles": tiles, "total_ms": total_ms, "per_tile_ms": total_ms / max(1, tiles)}
+        elif pool is not None and all(pool.fits(c.shape) for c in crops):
+            # Réplicas en procesos: cada recorte va a un proceso libre a través del anillo compartido
+            try:
+                mapped = pool.map(crops, conf, imgsz or self.imgsz)
+            except RuntimeError:
+                if pool is self.pool:
+                    raise
+                mapped = None  # procesos retirados por un cambio de modelo: este lote se infiere aquí
+            if mapped is not None:
+                crop_results = []
+                for crop, (boxes, speed) in zip(crops, mapped):
+                    result = boxes_result(crop, boxes, model.names)
+                    result.speed = speed
+                    crop_results.append(result)
+        elif pool is not None and not self.pool_oversize_warned:
+            self.pool_oversize_warned = True
+            print("[WARN] Frames mayores que WORKER_MAX_FRAME: se infieren en el hilo principal")
+        if crop_results is None:
+            crop_results = model.predict(
+                crops,
+                conf=conf,
+                imgsz=imgsz or self.imgsz,
+                device=self.device,
+                verbose=False
+            )
+        if len(crops) == len(frames) and all(c is f for c, f in zip(crops, frames)):
+            return crop_results
+
+        # Reunir los recortes de cada frame en un único resultado
+        parts = [[] for _ in frames]
+        for (i, x, y), result in zip(owners, crop_results):
+            parts[i].append((result, x, y))
+        return [combine_offset_results(frame, model.names, frame_parts)
+                for frame, frame_parts in zip(frames, parts)]
+
+    @staticmethod
+    def compose_grid(streams, tile_size=GRID_TILE):
+        """Mosaico con el último frame de cada fuente, en orden de la lista."""
+        cols = math.ceil(math.sqrt(len(streams)))
+        rows = math.ceil(len(streams) / cols)
+        tw, th = tile_size
+        grid = np.zeros((rows * th, cols * tw, 3), dtype=np.uint8)
+        for st in streams:
+            r, c = divmod(st.index, cols)
+            x0, y0 = c * tw, r * th
+            if st.frame is not None:
+                fh, fw = st.frame.shape[:2]
+                w, h = YoloCamApp.fit_within((fw, fh), tile_size)
+                tile = st.frame if (w, h) == (fw, fh) else cv2.resize(st.frame, (w, h), interpolation=cv2.INTER_AREA)
+                ox, oy = x0 + (tw - w) // 2, y0 + (th - h) // 2
+                grid[oy:oy + h, ox:ox + w] = tile
+            cv2.putText(grid, f"{st.name} | {st.fps:.1f} FPS | {st.latency_ms:.0f} ms",
+                       (x0 + 10, y0 + th - 12), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+        return grid
+
     # --- Refresco UI (main thread) ---
     def update_ui_frame(self):
+        self.display_size = self.label_size()
         with self.frame_lock:
-            frame = self.current_frame.copy() if self.current_frame is not None else None
+            # El hilo de inferencia nunca modifica un frame ya publicado: no hace falta copiarlo
+            frame = self.display_frame
+            meta = self.current_meta
+            version = self.frame_version
 
-        if frame is not None:
-            img_pil = Image.fromarray(frame)
-            # Ajuste a la ventana manteniendo proporción
-            w = self.img_label.winfo_width() or 960
-            h = self.img_label.winfo_height() or 540
-            img_pil = img_pil.resize(self.fit_within(img_pil.size, (w, h)), Image.LANCZOS)
-            imgtk = ImageTk.PhotoImage(image=img_pil)
-            self.img_label.imgtk = imgtk  # evitar GC
-            self.img_label.configure(image=imgtk)
+        if frame is not None and version != self.shown_version:
+            self.shown_version = version
+            if meta:
+                # Latencia captura -> pantalla de cada fuente presente en este frame
+                now = time.time()
+                for st, packet in meta:
+                    st.add_latency((now - packet.ts) * 1000.0)
+                    self.metrics.add(st.metric_name, "capture_to_display", (now - packet.ts) * 1000.0)
+                self.update_fps_label()
+            t_photo = time.perf_counter()
+            self.show_rgb(frame)
+            self.metrics.add("ui", "photoimage", (time.perf_counter() - t_photo) * 1000.0)
+        elif any(st.grabber.state != "conectado" for st in self.streams):
+            # Sin frames nuevos durante una reconexión: mantener visible el estado de la conexión
+            self.update_fps_label()
 
         if self.running:
-            self.root.after(15, self.update_ui_frame)  # ~66 FPS máx UI
+            self.root.after(self.display_interval_ms, self.update_ui_frame)
+        else:
+            self.clear_display()
+
+    def update_fps_label(self):
+        streams = self.streams
+        if not streams:
+            return
+        dropped = sum(st.grabber.dropped for st in streams)
+        if len(streams) == 1:
+            st = streams[0]
+            text = f"FPS: {st.fps:.1f} | Latencia: {st.latency_ms:.0f} ms | Descartados: {dropped}"
         else:
-            self.img_label.config(image="")
+            per_stream = " | ".join(f"[{st.index + 1}] {st.fps:.1f} FPS {st.latency_ms:.0f} ms" for st in streams)
+            text = f"{per_stream} | Descartados: {dropped}"
+        if self.quality:
+            text += f" | {self.quality.describe()}"
+        if any(self.active_rois(st.source) for st in streams):
+            text += f" | ROI: {self.roi_ratio_text()}"
+        if self.motion_gating.get():
+            total = sum(st.gate.total for st in streams)
+            skipped = sum(st.gate.skipped for st in streams)
+            text += f" | Omitidos: {100.0 * skipped / max(1, total):.0f} %"
+        reconnects = sum(st.grabber.reconnects for st in streams)
+        if reconnects:
+            text += f" | Reconexiones: {reconnects}"
+        for st in streams:
+            if st.grabber.state != "conectado":
+                text += f" | ⚠️ [{st.index + 1}] {st.grabber.state}"
+        if self.recording:
+            text += " | ⏺ REC"
+        if self.writer.dropped:
+            text += f" | Escrituras descartadas: {self.writer.dropped}"
+        if self.defect_log is not None and self.defect_log.dropped:
+            text += f" | Registros descartados: {self.defect_log.dropped}"
+        self.fps_label.config(text=text)
 
     @staticmethod
     def fit_within(img_size, box_size):
@@ -769,8 +3650,1613 @@ class YoloCamApp:
             "secondary": SECONDARY_COLOR
         }
 
-if __name__ == "__main__":
+# --- Inspección por lotes sin interfaz (CLI) ---
+def collect_images(pattern):
+    """Lista ordenada de imágenes de una carpeta (recursiva) o de un patrón glob."""
+    if os.path.isdir(pattern):
+        paths = []
+        for dirpath, _, files in os.walk(pattern):
+            paths.extend(os.path.join(dirpath, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+    else:
+        paths = [p for p in glob.glob(pattern, recursive=True) if p.lower().endswith(IMAGE_EXTENSIONS)]
+    return sorted(os.path.abspath(p) for p in paths)
+
+
+def decode_image(path):
+    # Se ejecuta en los procesos del pool; imdecode admite rutas con acentos en Windows
+    try:
+        return path, cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except Exception:
+        return path, None
+
+
+def iter_decoded_batches(pool, paths, batch_size, prefetch):
+    """Decodifica en paralelo manteniendo como mucho `prefetch` imágenes en vuelo y entrega lotes en orden."""
+    pending = deque()
+    it = iter(paths)
+    batch = []
+    while True:
+        while len(pending) < prefetch:
+            path = next(it, None)
+            if path is None:
+                break
+            pending.append(pool.submit(decode_image, path))
+        if not pending:
+            break
+        batch.append(pending.popleft().result())
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def result_to_boxes(result, names):
+    boxes = result.boxes
+    xyxy = boxes.xyxy.cpu().numpy()
+    confs = boxes.conf.cpu().numpy()
+    classes = boxes.cls.cpu().numpy().astype(int)
+    return [
+        {
+            "class_id": int(c),
+            "class_name": names.get(int(c), str(int(c))),
+            "confidence": round(float(p), 4),
+            "box": [round(float(v), 1) for v in b],
+        }
+        for b, p, c in zip(xyxy, confs, classes)
+    ]
+
+
+class BatchWriter:
+    """Escribe los resultados imagen a imagen para poder reanudar una ejecución interrumpida."""
+
+    IMAGE_FIELDS = ["image", "defects", "classes", "error"]
+    BOX_FIELDS = ["image", "class_id", "class_name", "confidence", "x1", "y1", "x2", "y2"]
+
+    def __init__(self, out_dir, fmt="csv"):
+        os.makedirs(out_dir, exist_ok=True)
+        self.fmt = fmt
+        self.failed = 0
+        if fmt == "json":
+            self.images_path = os.path.join(out_dir, "results.jsonl")
+        else:
+            self.images_path = os.path.join(out_dir, "images.csv")
+            self.boxes_path = os.path.join(out_dir, "detections.csv")
+
+    def completed(self):
+        """Imágenes ya terminadas en una ejecución anterior.
+
+        Las que no se pudieron leer (archivo aún copiándose, corte de la unidad de red) no cuentan como
+        terminadas: se quitan del resumen para reintentarlas.
+        """
+        done = set()
+        self.failed = 0
+        if not os.path.exists(self.images_path):
+            return done
+        kept, dirty = [], False
+        with open(self.images_path, "r", encoding="utf-8", newline="") as f:
+            if self.fmt == "json":
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        image = rec["image"]
+                    except (ValueError, KeyError):
+                        dirty = True  # última línea cortada por la interrupción
+                        continue
+                    if rec.get("error"):
+                        self.failed += 1
+                        continue
+                    done.add(image)
+                    kept.append(line)
+            else:
+                for row in csv.DictReader(f):
+                    if not row.get("image"):
+                        continue
+                    if row.get("error"):
+                        self.failed += 1
+                        continue
+                    done.add(row["image"])
+                    kept.append(row)
+        if self.failed or dirty:
+            with open(self.images_path, "w", encoding="utf-8", newline="") as f:
+                if self.fmt == "json":
+                    f.writelines(kept)
+                else:
+                    w = csv.DictWriter(f, fieldnames=self.IMAGE_FIELDS)
+                    w.writeheader()
+                    w.writerows(kept)
+        if self.fmt != "json" and os.path.exists(self.boxes_path):
+            # Quitar cajas de imágenes que no llegaron a marcarse como terminadas
+            with open(self.boxes_path, "r", encoding="utf-8", newline="") as f:
+                rows = [row for row in csv.DictReader(f) if row.get("image") in done]
+            with open(self.boxes_path, "w", encoding="utf-8", newline="") as f:
+                w = csv.DictWriter(f, fieldnames=self.BOX_FIELDS)
+                w.writeheader()
+                w.writerows(rows)
+        return done
+
+    def write(self, records):
+        if self.fmt == "json":
+            with open(self.images_path, "a", encoding="utf-8") as f:
+                for rec in records:
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            return
+        # Primero las cajas y después el resumen: una imagen solo cuenta como hecha si está en images.csv
+        self._append_csv(self.boxes_path, self.BOX_FIELDS, [
+            {"image": rec["image"], "class_id": b["class_id"], "class_name": b["class_name"],
+             "confidence": b["confidence"], "x1": b["box"][0], "y1": b["box"][1], "x2": b["box"][2], "y2": b["box"][3]}
+            for rec in records for b in rec["boxes"]
+        ])
+        self._append_csv(self.images_path, self.IMAGE_FIELDS, [
+            {"image": rec["image"], "defects": rec["defects"],
+             "classes": ";".join(f"{k}:{v}" for k, v in rec["classes"].items()), "error": rec.get("error", "")}
+            for rec in records
+        ])
+
+    @staticmethod
+    def _append_csv(path, fields, rows):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, "a", encoding="utf-8", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=fields)
+            if new_file:
+                w.writeheader()
+            w.writerows(rows)
+
+
+def annotated_name(path, root):
+    rel = os.path.relpath(path, root) if root else os.path.basename(path)
+    return os.path.splitext(rel.replace(os.sep, "__"))[0] + ".jpg"
+
+
+def run_batch(args):
+    paths = collect_images(args.input)
+    if not paths:
+        print(f"[ERROR] No se encontraron imágenes en: {args.input}")
+        return 1
+    writer = BatchWriter(args.output, args.format)
+    done = writer.completed()
+    pending = [p for p in paths if p not in done]
+    retry = f" ({writer.failed} fallidas se reintentan)" if writer.failed else ""
+    print(f"[INFO] {len(paths)} imágenes | {len(done & set(paths))} ya procesadas | {len(pending)} pendientes{retry}")
+    if not pending:
+        return 0
+
+    device = args.device or ("cuda:0" if torch.cuda.is_available() else "cpu")
+    model, backend = load_inference_model(args.model, args.backend, args.imgsz, device)
+    if backend != "torch":
+        device = "cpu"
+    names = model.names
+    renderer = DetectionRenderer(names)
+    annotate_dir = os.path.join(args.output, "annotated") if args.annotate else None
+    if annotate_dir:
+        os.makedirs(annotate_dir, exist_ok=True)
+    root = os.path.commonpath(pending) if len(pending) > 1 else os.path.dirname(pending[0])
+    warmup_model(model, args.imgsz, device, runs=1, batch=args.batch_size)
+
+    t0 = time.time()
+    processed = 0
+    tiles, tile_ms = 0, 0.0
+    workers = args.workers or max(1, (os.cpu_count() or 2) - 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch in iter_decoded_batches(pool, pending, args.batch_size, args.batch_size * 2):
+            valid = [(p, img) for p, img in batch if img is not None]
+            if args.tile:
+                results = []
+                for _, img in valid:
+                    result, stats = tiled_predict(model, img, args.conf, device, tile=args.tile,
+                                                  overlap=args.tile_overlap, batch_size=args.batch_size)
+                    results.append(result)
+                    tiles += stats["tiles"]
+                    tile_ms += stats["total_ms"]
+            else:
+                results = model.predict(
+                    [img for _, img in valid],
+                    conf=args.conf,
+                    imgsz=args.imgsz,
+                    device=device,
+                    verbose=False
+                ) if valid else []
+            by_path = {p: (img, r) for (p, img), r in zip(valid, results)}
+
+            records = []
+            for path, _ in batch:
+                if path not in by_path:
+                    records.append({"image": path, "defects": -1, "classes": {}, "boxes": [], "error": "no se pudo leer"})
+                    continue
+                img, result = by_path[path]
+                boxes = result_to_boxes(result, names)
+                classes = {}
+                for b in boxes:
+                    classes[b["class_name"]] = classes.get(b["class_name"], 0) + 1
+                records.append({"image": path, "defects": len(boxes), "classes": classes, "boxes": boxes})
+                if annotate_dir:
+                    out = os.path.join(annotate_dir, annotated_name(path, root))
+                    ok, buf = cv2.imencode(".jpg", renderer.render(img, result, rgb=False))
+                    if ok:
+                        buf.tofile(out)
+            writer.write(records)
+
+            processed += len(batch)
+            elapsed = time.time() - t0
+            print(f"[INFO] {processed}/{len(pending)} imágenes | {processed / max(1e-6, elapsed):.1f} img/s")
+
+    elapsed = time.time() - t0
+    print(f"[OK] {processed} imágenes en {elapsed:.1f} s ({processed / max(1e-6, elapsed):.1f} img/s) -> {args.output}")
+    if tiles:
+        print(f"     {tiles} mosaicos | {tile_ms / max(1, tiles):.1f} ms/mosaico | {tile_ms / max(1, processed):.0f} ms/imagen")
+    return 0
+
+
+# --- Análisis de video sin interfaz: decodificación -> inferencia -> escritura en paralelo ---
+def queue_put(q, item, stop):
+    # put con timeout para no quedarse bloqueado si otra etapa ha fallado
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.2)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def run_video(args):
+    cap = cv2.VideoCapture(args.input)
+    if not cap.isOpened():
+        print(f"[ERROR] No se pudo abrir el video: {args.input}")
+        return 1
+    src_fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    os.makedirs(args.output, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(args.input))[0]
+    detections_path = os.path.join(args.output, f"{stem}_frames.jsonl")
+    video_path = os.path.join(args.output, f"{stem}_annotated.mp4") if args.annotate else None
+
+    device = args.device or ("cuda:0" if torch.cuda.is_available() else "cpu")
+    model, backend = load_inference_model(args.model, args.backend, args.imgsz, device)
+    if backend != "torch":
+        device = "cpu"
+    names = model.names
+    renderer = DetectionRenderer(names)
+
+    pool = None
+    if args.procs > 0 and device == "cpu":
+        # Réplicas del modelo en procesos; el decodificador escribe cada frame directamente en el anillo compartido
+        try:
+            pool = InferencePool(model.model_name, args.procs, task=model.task, threads=args.worker_threads or None,
+                                 slots=args.procs * 2 + args.queue_size, max_frame=(width, height))
+        except Exception as e:
+            print(f"[WARN] No se pudieron arrancar los procesos de inferencia ({e}), se infiere en este proceso")
+    elif args.procs > 0:
+        print("[WARN] --procs solo se aplica en CPU; se infiere en este proceso")
+    if pool is None:
+        warmup_model(model, args.imgsz, device, runs=1, batch=args.batch_size)
+
+    # Colas acotadas: la etapa más lenta marca el ritmo sin acumular frames en memoria
+    decode_q = queue.Queue(maxsize=args.queue_size)
+    result_q = queue.Queue(maxsize=args.queue_size)
+    stop = threading.Event()
+    busy = {"decode": 0.0, "infer": 0.0, "write": 0.0}
+    errors = []
+
+    def decode_stage():
+        idx = 0
+        shape = (height, width, 3)
+        try:
+            while not stop.is_set():
+                slot = None
+                if pool is not None:
+                    while slot is None and not stop.is_set():
+                        try:
+                            slot, buf = pool.acquire(shape, timeout=0.2)
+                        except queue.Empty:
+                            pass
+                    if slot is None:
+                        break
+                t = time.perf_counter()
+                if slot is None:
+                    ok, frame = cap.read()
+                else:
+                    # Decodificación directa en el hueco compartido: sin copias ni pickling hacia los procesos
+                    ok, frame = cap.read(buf)
+                    if ok and frame.ctypes.data != buf.ctypes.data:
+                        np.copyto(buf, frame)  # el decodificador no reutilizó el búfer
+                        frame = buf
+                busy["decode"] += time.perf_counter() - t
+                if not ok:
+                    if slot is not None:
+                        pool.release(slot)
+                    break
+                if slot is not None:
+                    pool.submit(slot, shape, args.conf, args.imgsz)
+                if not queue_put(decode_q, (idx, frame, slot), stop):
+                    break
+                idx += 1
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            cap.release()
+            queue_put(decode_q, None, stop)
+
+    def write_stage():
+        writer = None
+        try:
+            with open(detections_path, "w", encoding="utf-8") as f:
+                while True:
+                    item = result_q.get()
+                    if item is None:
+                        break
+                    idx, frame, result, slot = item
+                    t = time.perf_counter()
+                    boxes = result_to_boxes(result, names)
+                    f.write(json.dumps({"frame": idx, "time_s": round(idx / src_fps, 3),
+                                        "defects": len(boxes), "boxes": boxes}, ensure_ascii=False) + "\n")
+                    if video_path:
+                        annotated = renderer.render(frame, result, rgb=False)
+                        if writer is None:
+                            h, w = annotated.shape[:2]
+                            writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), src_fps, (w, h))
+                        writer.write(annotated)
+                    if slot is not None:
+                        del frame, result
+                        pool.release(slot)
+                    busy["write"] += time.perf_counter() - t
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            if writer is not None:
+                writer.release()
+
+    decoder = threading.Thread(target=decode_stage, daemon=True)
+    writer_thread = threading.Thread(target=write_stage, daemon=True)
+    decoder.start()
+    writer_thread.start()
+
+    mode = f"{pool.workers} procesos x {pool.threads} hilos" if pool else f"lote {args.batch_size} en {device}"
+    print(f"[INFO] {args.input}: {width}x{height} @ {src_fps:.1f} FPS, {total} frames | {mode}")
+    t0 = time.time()
+    frames = 0
+    last_report = t0
+    finished = False
+    try:
+        while not finished and not stop.is_set():
+            # Inferencia (hilo principal): agrupar los frames ya decodificados en un lote
+            item = decode_q.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) == args.batch_size:
+                    break
+                try:
+                    item = decode_q.get_nowait()
+                except queue.Empty:
+                    break
+            finished = item is None
+            if batch and pool is not None:
+                # Los procesos ya tienen los frames; se recogen los resultados en orden de frame
+                t = time.perf_counter()
+                for idx, frame, slot in batch:
+                    _, _, boxes, _ = pool.get()
+                    if not queue_put(result_q, (idx, frame, boxes_result(frame, boxes, names), slot), stop):
+                        break
+                busy["infer"] += time.perf_counter() - t
+                frames += len(batch)
+            elif batch:
+                t = time.perf_counter()
+                results = model.predict(
+                    [frame for _, frame, _ in batch],
+                    conf=args.conf,
+                    imgsz=args.imgsz,
+                    device=device,
+                    verbose=False
+                )
+                busy["infer"] += time.perf_counter() - t
+                for (idx, frame, _), result in zip(batch, results):
+                    if not queue_put(result_q, (idx, frame, result, None), stop):
+                        break
+                frames += len(batch)
+            if batch and time.time() - last_report >= 2.0:
+                last_report = time.time()
+                print(f"[INFO] {frames}/{total or '?'} frames | {frames / max(1e-6, time.time() - t0):.1f} FPS")
+    except KeyboardInterrupt:
+        print("[WARN] Interrumpido por el usuario")
+        stop.set()
+    finally:
+        queue_put(result_q, None, threading.Event())
+        writer_thread.join()
+        stop.set()
+        decoder.join(timeout=2.0)
+        if pool is not None:
+            pool.close()
+
+    if errors:
+        print(f"[ERROR] {errors[0]}")
+        return 1
+    elapsed = time.time() - t0
+    duration = total / src_fps if src_fps else 0.0
+    print(f"[OK] {frames} frames en {elapsed:.1f} s -> {frames / max(1e-6, elapsed):.1f} FPS "
+          f"({duration / max(1e-6, elapsed):.2f}x tiempo real)")
+    for stage, secs in busy.items():
+        print(f"     {stage:<7} {secs:7.1f} s ocupado ({100.0 * secs / max(1e-6, elapsed):5.1f} %) "
+              f"| {1000.0 * secs / max(1, frames):6.1f} ms/frame")
+    print(f"     detecciones: {detections_path}" + (f" | video: {video_path}" if video_path else ""))
+    return 0
+
+
+# --- Benchmark reproducible (sin interfaz) ---
+BENCH_RESOLUTIONS = "640x360,1280x720,1920x1080"
+BENCH_MODEL = "yolo11n.yaml"  # modelo generado con pesos aleatorios: sin descargas, reproducible en CPU
+
+
+def synthetic_frames(width, height, count, seed=0):
+    """Frames sintéticos deterministas: fondo con ruido y un cordón que se desplaza."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(40, 90, size=(height, width, 3), dtype=np.uint8)
+    frames = []
+    for i in range(count):
+        frame = base.copy()
+        y = int(height * (0.3 + 0.4 * (i % 20) / 20.0))
+        cv2.line(frame, (0, y), (width, y + height // 10), (200, 200, 210), max(2, height // 40))
+        for _ in range(5):
+            cx, cy = int(rng.integers(0, width)), int(rng.integers(0, height))
+            cv2.circle(frame, (cx, cy), max(2, height // 100), (20, 20, 20), -1)
+        frames.append(frame)
+    return frames
+
+
+def load_bench_frames(args, width, height):
+    if args.video:
+        cap = cv2.VideoCapture(args.video)
+        frames = []
+        while len(frames) < args.frames:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+        cap.release()
+        if frames:
+            return frames
+        print(f"[WARN] No se pudieron leer frames de {args.video}, se usan frames sintéticos")
+    return synthetic_frames(width, height, args.frames)
+
+
+def write_bench_video(frames, folder):
+    """Graba los frames en un video temporal para medir la captura (decodificación) real."""
+    h, w = frames[0].shape[:2]
+    path = os.path.join(folder, f"bench_{w}x{h}.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25.0, (w, h))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def bench_stream(model, renderer, frames, video_path, args, device, metrics, key):
+    """Etapas del bucle de inferencia por separado y de principio a fin, a una resolución."""
+    h, w = frames[0].shape[:2]
+    display = YoloCamApp.fit_within((w, h), (960, 540))
+
+    # Captura: decodificación del video grabado
+    cap = cv2.VideoCapture(video_path)
+    while True:
+        t = time.perf_counter()
+        ok, _ = cap.read()
+        if not ok:
+            break
+        metrics.add(key, "capture", (time.perf_counter() - t) * 1000.0)
+    cap.release()
+    if av is not None:
+        # Captura alternativa (CAPTURE_BACKEND=pyav): varios hilos y salida ya escalada al tamaño de inferencia
+        cap = AVCapture(video_path, max_side=args.imgsz)
+        while True:
+            t = time.perf_counter()
+            ok, _ = cap.read()
+            if not ok:
+                break
+            metrics.add(key, "capture_pyav", (time.perf_counter() - t) * 1000.0)
+        cap.release()
+
+    # Inferencia (con el desglose de Ultralytics), dibujo y conversión para la pantalla
+    results = []
+    for frame in frames:
+        t = time.perf_counter()
+        result = model.predict(frame, conf=args.conf, imgsz=args.imgsz, device=device, verbose=False)[0]
+        metrics.add(key, "predict", (time.perf_counter() - t) * 1000.0)
+        for stage in ("preprocess", "inference", "postprocess"):
+            if result.speed.get(stage) is not None:
+                metrics.add(key, stage, result.speed[stage])
+        results.append(result)
+    for frame, result in zip(frames, results):
+        timings = {}
+        rgb = renderer.render(frame, result, display, timings=timings)
+        for stage, ms in timings.items():
+            metrics.add(key, stage, ms)
+        # update_ui_frame/show_rgb: la parte medible sin ventana es el paso a PIL
+        t = time.perf_counter()
+        Image.fromarray(rgb)
+        metrics.add(key, "to_pil", (time.perf_counter() - t) * 1000.0)
+
+    # Mosaico de 4 fuentes y escalado al área de visualización
+    streams = [StreamState(i, f"bench{i}", None, None) for i in range(4)]
+    for st, frame in zip(streams, frames):
+        st.frame = renderer.render(frame, None, YoloCamApp.fit_within((w, h), GRID_TILE))
+    for _ in range(len(frames)):
+        t = time.perf_counter()
+        grid = YoloCamApp.compose_grid(streams)
+        metrics.add(key, "compose_grid", (time.perf_counter() - t) * 1000.0)
+        gh, gw = grid.shape[:2]
+        t = time.perf_counter()
+        cv2.resize(grid, YoloCamApp.fit_within((gw, gh), (960, 540)), interpolation=cv2.INTER_LINEAR)
+        metrics.add(key, "ui_resize", (time.perf_counter() - t) * 1000.0)
+
+    # De principio a fin: leer -> predict -> dibujar -> PIL, en serie como en el bucle de la app
+    cap = cv2.VideoCapture(video_path)
+    t_start = time.perf_counter()
+    done = 0
+    while True:
+        t = time.perf_counter()
+        ok, frame = cap.read()
+        if not ok:
+            break
+        result = model.predict(frame, conf=args.conf, imgsz=args.imgsz, device=device, verbose=False)[0]
+        Image.fromarray(renderer.render(frame, result, display))
+        metrics.add(key, "end_to_end", (time.perf_counter() - t) * 1000.0)
+        done += 1
+    cap.release()
+    return done / max(1e-9, time.perf_counter() - t_start)
+
+
+def bench_weld(model, renderer, args, device, metrics):
+    """analyze_weld sobre una foto grande: inferencia directa y por mosaicos, más el dibujo a pantalla."""
+    w, h = (int(v) for v in args.weld_size.lower().split("x"))
+    if args.weld_image:
+        image = cv2.imdecode(np.fromfile(args.weld_image, dtype=np.uint8), cv2.IMREAD_COLOR)
+        h, w = image.shape[:2]
+    else:
+        image = synthetic_frames(w, h, 1, seed=1)[0]
+    key = f"weld_{w}x{h}"
+    display = YoloCamApp.fit_within((w, h), (960, 540))
+    for _ in range(args.weld_runs):
+        t = time.perf_counter()
+        result = model.predict(image, conf=args.conf, imgsz=args.imgsz, device=device, verbose=False)[0]
+        metrics.add(key, "predict", (time.perf_counter() - t) * 1000.0)
+        t = time.perf_counter()
+        result, stats = tiled_predict(model, image, args.conf, device, tile=args.tile, batch_size=args.batch_size)
+        metrics.add(key, "predict_tiled", (time.perf_counter() - t) * 1000.0)
+        metrics.add(key, "per_tile", stats["per_tile_ms"])
+        timings = {}
+        renderer.render(image, result, display, counter=False, timings=timings)
+        for stage, ms in timings.items():
+            metrics.add(key, stage, ms)
+
+
+def bench_pool(model, frames, args, counts):
+    """Rendimiento de InferencePool con 1..N procesos sobre los mismos frames: FPS y eficiencia frente a lineal."""
+    h, w = frames[0].shape[:2]
+    stats = {}
+    for n in counts:
+        pool = InferencePool(model.model_name, n, task=model.task, max_frame=(w, h))
+        try:
+            pool.map(frames[:n], args.conf, args.imgsz)  # primer frame de cada proceso fuera de la medida
+            t = time.perf_counter()
+            pool.map(frames, args.conf, args.imgsz)
+            fps = len(frames) / max(1e-9, time.perf_counter() - t)
+        finally:
+            pool.close()
+        stats[f"procs_{n}_fps"] = round(fps, 2)
+        base = stats.get(f"procs_{counts[0]}_fps")
+        stats[f"procs_{n}_scaling"] = round(fps / base / (n / counts[0]), 3)
+        print(f"[INFO] {n} procesos: {fps:.1f} FPS ({stats[f'procs_{n}_scaling'] * 100:.0f} % de lineal)")
+    return stats
+
+
+def compare_benchmark(current, baseline, tolerance):
+    """Compara p50 etapa a etapa; más de `tolerance` por encima de la referencia cuenta como regresión."""
+    rows = []
+    for key, stages in current.items():
+        for stage, values in stages.items():
+            ref = baseline.get(key, {}).get(stage)
+            if not isinstance(values, dict) or not isinstance(ref, dict) or not ref.get("p50_ms"):
+                continue
+            ratio = values["p50_ms"] / ref["p50_ms"]
+            rows.append({"key": key, "stage": stage, "baseline_p50_ms": ref["p50_ms"],
+                         "p50_ms": values["p50_ms"], "ratio": round(ratio, 3),
+                         "regression": ratio > 1.0 + tolerance})
+    return rows
+
+
+def run_benchmark(args):
+    torch.manual_seed(0)
+    device = args.device or ("cuda:0" if torch.cuda.is_available() else "cpu")
+    t0 = time.time()
+    if args.model == BENCH_MODEL or args.model.lower().endswith(".yaml"):
+        model, backend = YOLO(args.model), "torch"
+    else:
+        model, backend = load_inference_model(args.model, args.backend, args.imgsz, device)
+    if backend != "torch":
+        device = "cpu"
+    renderer = DetectionRenderer(model.names)
+    warmup_model(model, args.imgsz, device, runs=args.warmup)
+    print(f"[INFO] Modelo {args.model} ({backend}, {device}) listo en {time.time() - t0:.1f} s")
+
+    metrics = StageMetrics(window=max(args.frames, args.weld_runs) * 4)
+    throughput = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for res in args.resolutions.split(","):
+            w, h = (int(v) for v in res.lower().split("x"))
+            frames = load_bench_frames(args, w, h)
+            key = f"{w}x{h}"
+            print(f"[INFO] Benchmark {key} ({len(frames)} frames)...")
+            throughput[key] = bench_stream(model, renderer, frames, write_bench_video(frames, tmp),
+                                           args, device, metrics, key)
+    if args.weld_runs > 0:
+        print(f"[INFO] Benchmark analyze_weld {args.weld_size}...")
+        bench_weld(model, renderer, args, device, metrics)
+    pool_stats = {}
+    if args.procs:
+        w, h = (int(v) for v in args.resolutions.split(",")[0].lower().split("x"))
+        print(f"[INFO] Benchmark de procesos de inferencia {w}x{h}: {args.procs}...")
+        pool_stats[f"pool_{w}x{h}"] = bench_pool(model, load_bench_frames(args, w, h), args,
+                                                 [int(n) for n in args.procs.split(",")])
+
+    results = {}
+    for row in metrics.summary():
+        results.setdefault(row["source"], {})[row["stage"]] = {
+            k: (round(v, 3) if isinstance(v, float) else v) for k, v in row.items() if k not in ("source", "stage")}
+    for key, fps in throughput.items():
+        results[key]["end_to_end_fps"] = round(fps, 2)
+    results.update(pool_stats)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "model": args.model, "backend": backend, "device": device, "imgsz": args.imgsz,
+            "frames": args.frames, "torch": torch.__version__, "opencv": cv2.__version__,
+            "torch_threads": torch.get_num_threads(), "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["baseline"] = args.baseline
+        report["comparison"] = compare_benchmark(results, baseline.get("results", {}), args.tolerance)
+        regressions = [r for r in report["comparison"] if r["regression"]]
+    elif args.baseline:
+        print(f"[WARN] No existe la referencia {args.baseline}; usa --save-baseline para crearla")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.save_baseline)
+        print(f"[OK] Referencia guardada en {args.save_baseline}")
+
+    for key, stages in results.items():
+        print(f"--- {key}" + (f" | {stages['end_to_end_fps']:.1f} FPS de principio a fin" if "end_to_end_fps" in stages else ""))
+        for stage, values in stages.items():
+            if isinstance(values, dict):
+                print(f"    {stage:<18} p50 {values['p50_ms']:8.2f} ms | p95 {values['p95_ms']:8.2f} ms")
+    for r in regressions:
+        print(f"[WARN] Regresión en {r['key']}/{r['stage']}: {r['baseline_p50_ms']:.2f} -> {r['p50_ms']:.2f} ms (x{r['ratio']:.2f})")
+    print(f"[OK] Resultados en {args.output}" + (f" ({len(regressions)} regresiones)" if "comparison" in report else ""))
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+# --- Cuantización INT8 en CPU con calibración sobre imágenes propias ---
+def letterbox_blob(image, imgsz):
+    """Preprocesado de Ultralytics para modelos exportados: letterbox cuadrado, RGB, 0-1, NCHW float32."""
+    h, w = image.shape[:2]
+    r = min(imgsz / h, imgsz / w)
+    nw, nh = int(round(w * r)), int(round(h * r))
+    resized = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR) if (nw, nh) != (w, h) else image
+    top, left = (imgsz - nh) // 2, (imgsz - nw) // 2
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    canvas[top:top + nh, left:left + nw] = resized
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+def quantize_onnx(fp32_path, out_path, images, imgsz, head_prefix=None):
+    """Cuantización estática (QDQ, pesos INT8 por canal) con ONNX Runtime, calibrada con `images`.
+
+    Con `head_prefix` la decodificación de la cabeza (todo lo que no son convoluciones) sigue en FP32:
+    es donde el INT8 más desplaza las cajas.
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    graph = onnx.load(fp32_path).graph
+    input_name = graph.input[0].name
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.images = iter(images)
+
+        def get_next(self):
+            image = next(self.images, None)
+            return None if image is None else {input_name: letterbox_blob(image, imgsz)}
+
+    exclude = [n.name for n in graph.node
+               if head_prefix and n.name.startswith(head_prefix) and n.op_type != "Conv"]
+    quantize_static(fp32_path, out_path, Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, nodes_to_exclude=exclude)
+    # Ultralytics lee nombres de clases, stride e imgsz de los metadatos del ONNX
+    source, quantized = onnx.load(fp32_path), onnx.load(out_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized, out_path)
+
+
+def quantize_model(path, backend, imgsz, images, calib_paths, quantize_head=False, cache_dir=MODEL_CACHE_DIR):
+    """Calibra y cuantiza el .pt; devuelve la ruta del modelo INT8 (aún sin marcador: lo escribe el informe)."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    target_dir = os.path.join(cache_dir, f"{stem}-{file_sha256(path)[:16]}-{imgsz}-{backend}")
+    if os.path.exists(os.path.join(target_dir, "export.json")):
+        os.remove(os.path.join(target_dir, "export.json"))  # recalibración: el anterior deja de valer
+    os.makedirs(target_dir, exist_ok=True)
+    if backend == "onnx-int8":
+        fp32, _ = export_cached(path, "onnx", imgsz, cache_dir)
+        head = None if quantize_head else f"/model.{len(YOLO(path).model.model) - 1}/"
+        exported = os.path.join(target_dir, f"{stem}_int8.onnx")
+        quantize_onnx(fp32, exported, images, imgsz, head)
+        return exported
+    # OpenVINO: Ultralytics cuantiza con NNCF a partir de un dataset; se genera uno con las imágenes de calibración
+    calib_dir = os.path.join(target_dir, "calibracion")
+    shutil.rmtree(calib_dir, ignore_errors=True)
+    os.makedirs(os.path.join(calib_dir, "images"))
+    for i, p in enumerate(calib_paths):
+        shutil.copyfile(p, os.path.join(calib_dir, "images", f"{i:05d}{os.path.splitext(p)[1].lower()}"))
+    data = os.path.join(calib_dir, "data.yaml")
+    names = YOLO(path).names
+    with open(data, "w", encoding="utf-8") as f:
+        f.write(f"path: {os.path.abspath(calib_dir)}\ntrain: images\nval: images\nnames:\n")
+        for k, v in names.items():
+            f.write(f"  {k}: {json.dumps(v, ensure_ascii=False)}\n")
+    work_pt = os.path.join(target_dir, f"{stem}.pt")
+    shutil.copyfile(path, work_pt)
+    try:
+        exported = YOLO(work_pt).export(format="openvino", imgsz=imgsz, int8=True, data=data, fraction=1.0)
+    finally:
+        os.remove(work_pt)
+    return os.path.join(target_dir, os.path.basename(os.path.normpath(str(exported))))
+
+
+def read_yolo_labels(image_path, width, height):
+    """Etiquetas YOLO (clase cx cy w h normalizados) de `labels/` junto a `images/` o al lado de la imagen."""
+    stem = os.path.splitext(image_path)[0]
+    parts = stem.split(os.sep)
+    candidates = [stem + ".txt"]
+    if "images" in parts:
+        i = len(parts) - 1 - parts[::-1].index("images")
+        candidates.insert(0, os.sep.join(parts[:i] + ["labels"] + parts[i + 1:]) + ".txt")
+    for label_path in candidates:
+        if os.path.exists(label_path):
+            rows = np.loadtxt(label_path, ndmin=2, usecols=range(5)) if os.path.getsize(label_path) else np.zeros((0, 5))
+            cx, cy, bw, bh = rows[:, 1] * width, rows[:, 2] * height, rows[:, 3] * width, rows[:, 4] * height
+            return np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2, rows[:, 0]], axis=1)
+    return None
+
+
+def model_size_mb(path):
+    # Los modelos OpenVINO son una carpeta (xml + bin)
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files) / 1e6
+    return os.path.getsize(path) / 1e6
+
+
+def mean_average_precision(preds, targets, iou_thr=0.5):
+    """mAP (AP de todos los puntos, media por clase). preds: N x 6 (x1, y1, x2, y2, conf, clase); targets: M x 5."""
+    classes = sorted({int(c) for t in targets for c in t[:, 4]})
+    aps = []
+    for c in classes:
+        records, n_targets = [], 0
+        for p, t in zip(preds, targets):
+            tc = t[t[:, 4] == c]
+            pc = p[p[:, 5] == c]
+            pc = pc[np.argsort(-pc[:, 4])]
+            n_targets += len(tc)
+            iou = box_iou(pc[:, :4], tc[:, :4]) if len(pc) and len(tc) else np.zeros((len(pc), len(tc)))
+            used = np.zeros(len(tc), dtype=bool)
+            for i in range(len(pc)):
+                cands = np.where(~used & (iou[i] >= iou_thr))[0]
+                if len(cands):
+                    used[cands[np.argmax(iou[i, cands])]] = True
+                records.append((pc[i, 4], 1.0 if len(cands) else 0.0))
+        if not n_targets:
+            continue
+        records.sort(key=lambda r: -r[0])
+        hits = np.array([r[1] for r in records])
+        tp, fp = np.cumsum(hits), np.cumsum(1.0 - hits)
+        recall = np.concatenate(([0.0], tp / n_targets, [1.0]))
+        precision = np.concatenate(([1.0], tp / np.maximum(tp + fp, 1e-9), [0.0]))
+        precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+        idx = np.where(recall[1:] != recall[:-1])[0]
+        aps.append(float(np.sum((recall[idx + 1] - recall[idx]) * precision[idx + 1])))
+    return float(np.mean(aps)) if aps else None
+
+
+def map_metrics(preds, targets):
+    return {"map50": mean_average_precision(preds, targets, 0.5),
+            "map50_95": float(np.mean([mean_average_precision(preds, targets, t) or 0.0
+                                       for t in np.arange(0.5, 0.96, 0.05)])) if targets else None}
+
+
+def agreement_scores(totals):
+    """Precisión, recall y F1 del INT8 frente a FP32. F1 es None si ninguno de los dos detectó nada."""
+    precision = totals["matched"] / max(1, totals["candidate"])
+    recall = totals["matched"] / max(1, totals["reference"])
+    if not totals["reference"] and not totals["candidate"]:
+        return precision, recall, None
+    return precision, recall, 2 * precision * recall / max(1e-9, precision + recall)
+
+
+def quantization_verdict(agreement, accuracy, min_agreement, max_map_drop, min_detections):
+    """Decide si se aprueba el modelo INT8: (estado, comprobaciones), estado "approved", "rejected" o "inconclusive".
+
+    Hace falta evidencia: al menos `min_detections` detecciones FP32 al umbral de producción, o imágenes
+    etiquetadas en las que el FP32 acierta algo. Sin ella no se aprueba aunque no haya diferencias.
+    """
+    checks = {}
+    if agreement["f1"] is not None:
+        checks["agreement_f1"] = agreement["f1"] >= min_agreement
+    labelled = bool(accuracy) and accuracy["fp32"]["map50"] is not None
+    if labelled:
+        checks["map50_drop"] = (accuracy["fp32"]["map50"] - (accuracy["int8"]["map50"] or 0.0)) <= max_map_drop
+    if not all(checks.values()):
+        return "rejected", checks
+    if agreement["reference"] < min_detections and not (labelled and accuracy["fp32"]["map50"] > 0):
+        return "inconclusive", checks
+    return "approved", checks
+
+
+def run_quantize(args):
+    calib_paths = collect_images(args.calib)[:args.calib_images]
+    if not calib_paths:
+        print(f"[ERROR] No se encontraron imágenes de calibración en: {args.calib}")
+        return 1
+    eval_paths = collect_images(args.eval or args.calib)[:args.eval_images]
+    if not args.eval:
+        print("[WARN] Sin --eval se evalúa con las mismas imágenes de la calibración: el resultado es optimista")
+    calib = [img for _, img in map(decode_image, calib_paths) if img is not None]
+    evaluation = [(p, img) for p, img in map(decode_image, eval_paths) if img is not None]
+
+    reference = YOLO(args.model)
+    names = reference.names
+    t0 = time.time()
+    print(f"[INFO] Calibrando {args.backend} con {len(calib)} imágenes de {args.calib}...")
+    try:
+        exported = quantize_model(args.model, args.backend, args.imgsz, calib, calib_paths, args.quantize_head)
+    except ImportError as e:
+        print(f"[ERROR] Falta una dependencia para {args.backend}: {e}")
+        return 1
+    print(f"[OK] Modelo cuantizado en {time.time() - t0:.1f} s: {exported}")
+    candidate = YOLO(exported, task=reference.task)
+
+    # Misma CPU, mismas imágenes: latencia por imagen y predicciones al umbral mínimo (para mAP)
+    models = {"fp32": (reference, args.model), "int8": (candidate, exported)}
+    preds, latency = {}, {}
+    for key, (model, _) in models.items():
+        warmup_model(model, args.imgsz, "cpu", runs=2)
+        preds[key], latency[key] = [], []
+        for _, img in evaluation:
+            t = time.perf_counter()
+            result = model.predict(img, conf=min(0.001, args.conf), imgsz=args.imgsz, device="cpu", verbose=False)[0]
+            latency[key].append((time.perf_counter() - t) * 1000.0)
+            preds[key].append(result.boxes.data.cpu().numpy())
+
+    # Concordancia con FP32 al umbral de producción
+    totals = {"reference": 0, "candidate": 0, "matched": 0, "missing": 0, "extra": 0}
+    identical, max_conf_diff = 0, 0.0
+    for (_, img), ref, cand in zip(evaluation, preds["fp32"], preds["int8"]):
+        ok, summary = compare_detections(boxes_result(img, ref, names, args.conf), boxes_result(img, cand, names, args.conf),
+                                         args.conf, iou_thr=args.iou)
+        identical += ok or summary["inconclusive"]  # sin cajas en ninguno de los dos: imagen idéntica
+        max_conf_diff = max(max_conf_diff, summary["max_conf_diff"])
+        for k in totals:
+            totals[k] += summary[k]
+    precision, recall, f1 = agreement_scores(totals)
+    # mAP del INT8 tomando como verdad las detecciones FP32 por encima del umbral
+    pseudo = [p[p[:, 4] >= args.conf][:, [0, 1, 2, 3, 5]] for p in preds["fp32"]]
+    agreement = {**totals, "precision": round(precision, 4), "recall": round(recall, 4),
+                 "f1": round(f1, 4) if f1 is not None else None,
+                 "identical_images": identical, "max_conf_diff": round(max_conf_diff, 4),
+                 "map50_vs_fp32": map_metrics(preds["int8"], pseudo)["map50"]}
+
+    # mAP frente a etiquetas, si las imágenes de evaluación las tienen
+    targets = [read_yolo_labels(p, img.shape[1], img.shape[0]) for p, img in evaluation]
+    labelled = [i for i, t in enumerate(targets) if t is not None]
+    accuracy = None
+    if labelled:
+        accuracy = {key: map_metrics([preds[key][i] for i in labelled], [targets[i] for i in labelled])
+                    for key in models}
+        accuracy["labelled_images"] = len(labelled)
+
+    speed = {key: {"p50_ms": round(float(np.percentile(v, 50)), 2), "p95_ms": round(float(np.percentile(v, 95)), 2),
+                   "size_mb": round(model_size_mb(models[key][1]), 2)}
+             for key, v in latency.items()}
+    speedup = speed["fp32"]["p50_ms"] / max(1e-9, speed["int8"]["p50_ms"])
+
+    status, checks = quantization_verdict(agreement, accuracy, args.min_agreement, args.max_map_drop,
+                                          args.min_detections)
+    approved = status == "approved"
+    report = {
+        "meta": {"timestamp": datetime.now().isoformat(timespec="seconds"), "model": args.model,
+                 "backend": args.backend, "quantized": exported, "imgsz": args.imgsz, "conf": args.conf,
+                 "calibration": os.path.abspath(args.calib), "calibration_images": len(calib),
+                 "eval_images": len(evaluation), "quantize_head": args.quantize_head,
+                 "cpu_count": os.cpu_count(), "torch_threads": torch.get_num_threads()},
+        "speed": speed, "speedup": round(speedup, 3), "agreement": agreement, "accuracy": accuracy,
+        "thresholds": {"min_agreement": args.min_agreement, "max_map_drop": args.max_map_drop,
+                       "min_detections": args.min_detections},
+        "checks": checks, "status": status, "approved": approved,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    # El marcador de la caché es lo que load_inference_model consulta: solo se usa si está aprobado
+    with open(os.path.join(os.path.dirname(exported), "export.json"), "w", encoding="utf-8") as f:
+        json.dump({"model": os.path.basename(os.path.normpath(exported)), "source": os.path.abspath(args.model),
+                   "imgsz": args.imgsz, "backend": args.backend, "images": len(calib), "approved": approved,
+                   "agreement_f1": agreement["f1"], "speedup": round(speedup, 3),
+                   "report": os.path.abspath(args.output)}, f, indent=2)
+
+    print(f"    {'':<6} {'p50 ms':>8} {'p95 ms':>8} {'MB':>7}" + (f" {'mAP50':>7} {'mAP50-95':>9}" if accuracy else ""))
+    for key in models:
+        line = f"    {key:<6} {speed[key]['p50_ms']:8.2f} {speed[key]['p95_ms']:8.2f} {speed[key]['size_mb']:7.1f}"
+        if accuracy:
+            line += f" {accuracy[key]['map50'] or 0.0:7.3f} {accuracy[key]['map50_95'] or 0.0:9.3f}"
+        print(line)
+    print(f"    Concordancia con FP32 (conf ≥ {args.conf}): F1 {'-' if f1 is None else f'{f1:.3f}'} | "
+          f"precisión {precision:.3f} | recall {recall:.3f} | {totals['reference']} detecciones FP32 | "
+          f"{identical}/{len(evaluation)} imágenes idénticas | x{speedup:.2f} más rápido")
+    if status == "inconclusive":
+        print(f"[WARN] No aprobado: no concluyente, el FP32 solo hace {totals['reference']} detecciones "
+              f"(mínimo {args.min_detections}) y no hay etiquetas en las que el FP32 acierte. Usa imágenes de "
+              f"--eval con defectos o etiquetadas -> {args.output}")
+    else:
+        print(("[OK] Aprobado" if approved else "[WARN] No aprobado")
+              + f" ({', '.join(f'{k}={v}' for k, v in checks.items())}) -> {args.output}")
+    if approved:
+        print(f"[INFO] Para usarlo: \"BACKEND\": \"{args.backend}\" en settings.json (o --backend {args.backend})")
+    return 0 if approved else 2
+
+
+def parse_shifts(spec):
+    """'06-14,14-22,22-06' -> [(nombre, inicio, fin)] con horas enteras."""
+    shifts = []
+    for part in spec.split(","):
+        start, end = (int(v) % 24 for v in part.strip().split("-"))
+        shifts.append((f"{start:02d}-{end:02d}", start, end))
+    return shifts
+
+
+def shift_sql(shifts):
+    """Expresiones SQL (turno, jornada) a partir de la hora local de `ts`.
+
+    La jornada empieza con el primer turno, así el turno de noche que cruza la medianoche cuenta en un solo día.
+    """
+    hour = "CAST(strftime('%H', ts, 'unixepoch', 'localtime') AS INTEGER)"
+    cases = []
+    for name, start, end in shifts:
+        cond = f"{hour} >= {start} AND {hour} < {end}" if start < end else f"({hour} >= {start} OR {hour} < {end})"
+        cases.append(f"WHEN {cond} THEN '{name}'")
+    shift = f"CASE {' '.join(cases)} ELSE 'otro' END"
+    day = f"date(ts, 'unixepoch', 'localtime', '-{shifts[0][1]} hours')" if shifts else "date(ts, 'unixepoch', 'localtime')"
+    return shift, day
+
+
+def run_defects(args):
+    if not os.path.exists(args.db):
+        print(f"[ERROR] No existe la base de datos: {args.db}")
+        return 1
+    where, params = ["1=1"], []
+    if args.since:
+        where.append("ts >= ?")
+        params.append(datetime.fromisoformat(args.since).timestamp())
+    if args.until:
+        where.append("ts < ?")
+        params.append(datetime.fromisoformat(args.until).timestamp())
+    if args.source:
+        where.append("source = ?")
+        params.append(args.source)
+    conn = DefectLog.connect(args.db)
+    conn.row_factory = sqlite3.Row
+
+    if args.export:
+        # Exportación de las detecciones en bruto
+        det_where, det_params = list(where), list(params)
+        if args.cls:
+            det_where.append("class_name = ?")
+            det_params.append(args.cls)
+        rows = conn.execute(f"SELECT ts, source, frame, class_id, class_name, confidence, x1, y1, x2, y2, model_hash "
+                            f"FROM detections WHERE {' AND '.join(det_where)} ORDER BY ts", det_params)
+        count = 0
+        with open(args.export, "w", encoding="utf-8", newline="") as f:
+            if args.export.lower().endswith(".jsonl"):
+                for row in rows:
+                    rec = dict(row)
+                    rec["time"] = datetime.fromtimestamp(rec["ts"]).isoformat(timespec="milliseconds")
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    count += 1
+            else:
+                w = csv.writer(f)
+                w.writerow(["time", "ts", "source", "frame", "class_id", "class_name", "confidence",
+                            "x1", "y1", "x2", "y2", "model_hash"])
+                for row in rows:
+                    w.writerow([datetime.fromtimestamp(row["ts"]).isoformat(timespec="milliseconds"), *tuple(row)])
+                    count += 1
+        print(f"[OK] {count} detecciones exportadas a {args.export}")
+        conn.close()
+        return 0
+
+    # Tasa de defectos por jornada, turno y fuente (frames con al menos un defecto / frames inspeccionados)
+    shift, day = shift_sql(parse_shifts(args.shifts))
+    cls_filter, cls_params = ("AND class_name = ?", [args.cls]) if args.cls else ("", [])
+    frames = conn.execute(
+        f"SELECT {day} AS day, {shift} AS shift, source, COUNT(*) AS frames, "
+        f"SUM(defects > 0) AS defective FROM frames WHERE {' AND '.join(where)} "
+        f"GROUP BY day, shift, source ORDER BY day, shift, source", params).fetchall()
+    detections = {
+        (r["day"], r["shift"], r["source"]): r["n"]
+        for r in conn.execute(
+            f"SELECT {day} AS day, {shift} AS shift, source, COUNT(*) AS n FROM detections "
+            f"WHERE {' AND '.join(where)} {cls_filter} GROUP BY day, shift, source", params + cls_params)
+    }
+    classes = conn.execute(
+        f"SELECT class_name, COUNT(*) AS n FROM detections WHERE {' AND '.join(where)} {cls_filter} "
+        f"GROUP BY class_name ORDER BY n DESC", params + cls_params).fetchall()
+    conn.close()
+
+    print(f"{'Jornada':<11} {'Turno':<6} {'Fuente':<30} {'Frames':>8} {'Con defecto':>12} {'Tasa':>7} {'Detecciones':>12}")
+    for r in frames:
+        rate = 100.0 * (r["defective"] or 0) / max(1, r["frames"])
+        n = detections.get((r["day"], r["shift"], r["source"]), 0)
+        print(f"{r['day']:<11} {r['shift']:<6} {r['source'][:30]:<30} {r['frames']:>8} {r['defective'] or 0:>12} {rate:>6.1f}% {n:>12}")
+    if classes:
+        print("Por clase: " + ", ".join(f"{r['class_name']}={r['n']}" for r in classes))
+    return 0
+
+
+def run_test_stream(args):
+    """Sirve un video local como stream MJPEG por HTTP: sustituto de una cámara para probar la reconexión."""
+    if not os.path.isfile(args.input):
+        print(f"[ERROR] No existe el video: {args.input}")
+        return 1
+    started = time.time()
+
+    def outage():
+        # Corte simulado: cada `outage_every` s la "cámara" deja de responder `outage_s` s
+        if args.outage_every <= 0:
+            return False
+        return (time.time() - started) % args.outage_every >= args.outage_every - args.outage_s
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not self.path.startswith("/stream"):
+                self.send_error(404)
+                return
+            if outage():
+                self.send_error(503)
+                return
+            cap = cv2.VideoCapture(args.input)
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            self.send_response(200)
+            self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+            self.end_headers()
+            frozen = None
+            try:
+                while True:
+                    t0 = time.time()
+                    if outage():
+                        return  # se corta la conexión
+                    if args.freeze_after > 0 and t0 - started >= args.freeze_after and frozen is not None:
+                        data = frozen  # imagen congelada: se repite el mismo JPEG
+                    else:
+                        ok, frame = cap.read()
+                        if not ok:
+                            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)  # en bucle
+                            continue
+                        data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+                        frozen = data
+                    self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\n"
+                                     + f"Content-Length: {len(data)}\r\n\r\n".encode() + data + b"\r\n")
+                    time.sleep(max(0.0, 1.0 / fps - (time.time() - t0)))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                cap.release()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    print(f"[INFO] Stream de prueba en http://{args.host}:{args.port}/stream.mjpg (Ctrl+C para terminar)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+# --- Servicio HTTP de inferencia con microlotes ---
+ServeRequest = namedtuple("ServeRequest", "image conf source future t0")
+
+
+class MicroBatcher:
+    """Agrupa en un solo `predict` las peticiones que llegan dentro de `max_wait_ms`, hasta `max_batch` imágenes.
+
+    La cola está acotada: si se llena, `submit` lanza `queue.Full` y la petición se rechaza (contrapresión).
+    """
+
+    def __init__(self, model, imgsz, device, max_batch=8, max_wait_ms=10, queue_size=64,
+                 metrics=None, defect_log=None, model_hash=None):
+        self.model = model
+        self.names = model.names
+        self.imgsz = imgsz
+        self.device = device
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.metrics = metrics
+        self.defect_log = defect_log
+        self.model_hash = model_hash
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.images = 0
+        self.batch_sizes = {}
+        self.seq = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, image, conf, source="http"):
+        """Encola una imagen BGR; devuelve un Future con (cajas, info del lote). Lanza queue.Full si no cabe."""
+        future = Future()
+        self.queue.put_nowait(ServeRequest(image, conf, source, future, time.perf_counter()))
+        return future
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def full(self):
+        return self.queue.full()
+
+    def close(self):
+        try:
+            self.queue.put(None, timeout=5.0)
+        except queue.Full:
+            return
+        self.thread.join(5.0)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            # La espera cuenta desde que llegó la primera petición: con carga la cola ya está llena y no se espera
+            deadline = item.t0 + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    nxt = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+            self._predict(batch)
+            if stop:
+                return
+
+    def _predict(self, batch):
+        # Las peticiones que ya vencieron en el cliente (cancel) no se infieren
+        live = [r for r in batch if r.future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        t0 = time.perf_counter()
+        try:
+            results = self.model.predict([r.image for r in live], conf=min(r.conf for r in live),
+                                         imgsz=self.imgsz, device=self.device, verbose=False)
+        except Exception as e:
+            for r in live:
+                r.future.set_exception(e)
+            return
+        predict_ms = (time.perf_counter() - t0) * 1000.0
+        with self.lock:
+            self.batches += 1
+            self.images += len(live)
+            self.batch_sizes[len(live)] = self.batch_sizes.get(len(live), 0) + 1
+        if self.metrics:
+            self.metrics.add("serve", "predict_batch", predict_ms)
+        now = time.time()
+        for r, result in zip(live, results):
+            # Un fallo con una petición (p. ej. el registro de defectos) no deja colgadas a las demás del lote
+            try:
+                queue_ms = (t0 - r.t0) * 1000.0
+                if self.metrics:
+                    self.metrics.add("serve", "queue", queue_ms)
+                # El lote se infiere con el umbral más bajo; cada petición se queda con el suyo
+                boxes = [b for b in result_to_boxes(result, self.names) if b["confidence"] >= r.conf]
+                if self.defect_log:
+                    self.seq += 1
+                    keep = result.boxes.conf >= r.conf
+                    self.defect_log.record(now, r.source, self.seq, result[keep], self.names, self.model_hash)
+                r.future.set_result((boxes, {"batch_size": len(live), "queue_ms": round(queue_ms, 2),
+                                             "predict_ms": round(predict_ms, 2)}))
+            except Exception as e:
+                print(f"[ERROR] Petición de {r.source}: {e}")
+                r.future.set_exception(e)
+
+    def stats(self):
+        with self.lock:
+            return {"batches": self.batches, "images": self.images,
+                    "mean_batch": round(self.images / max(1, self.batches), 2),
+                    "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                    "queue_depth": self.depth(), "queue_size": self.queue.maxsize}
+
+
+def read_request_image(headers, body):
+    """Bytes de la imagen de una petición: cuerpo binario (image/*, octet-stream) o multipart/form-data."""
+    ctype = headers.get("Content-Type", "")
+    if ctype.startswith("multipart/form-data"):
+        msg = BytesParser(policy=email_policy.HTTP).parsebytes(
+            f"Content-Type: {ctype}\r\n\r\n".encode("latin-1") + body)
+        for part in msg.iter_parts():
+            if part.get_filename() or part.get_content_maintype() == "image":
+                return part.get_payload(decode=True)
+        return None
+    return body
+
+
+def make_serve_server(args, state, metrics):
+    """Servidor HTTP del modo serve; state["batcher"] es None mientras el modelo se carga."""
+    counts = {}
+    counts_lock = threading.Lock()
+
+    def count(code):
+        with counts_lock:
+            counts[code] = counts.get(code, 0) + 1
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, code, payload, headers=None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if self.close_connection:
+                self.send_header("Connection", "close")  # el cliente abre otra conexión para la siguiente petición
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            batcher = state["batcher"]
+            if path == "/health":
+                # Vivo: el proceso responde aunque el modelo aún se esté cargando
+                self.send_json(200, {"status": "ok", "uptime_s": round(time.time() - state["started"], 1)})
+            elif path == "/ready":
+                # Listo: modelo cargado y calentado, y la cola con sitio
+                ready = batcher is not None and not batcher.full()
+                self.send_json(200 if ready else 503, {
+                    "ready": ready, "model": state["model"], "backend": state["backend"],
+                    "queue_depth": batcher.depth() if batcher else None})
+            elif path == "/metrics.json":
+                with counts_lock:
+                    requests = {str(k): v for k, v in sorted(counts.items())}
+                self.send_json(200, {"stages": metrics.summary(), "requests": requests,
+                                     "batching": batcher.stats() if batcher else None})
+            elif path == "/metrics":
+                lines = [metrics.prometheus().rstrip("\n"),
+                         "# HELP inspeccion_serve_requests_total Peticiones a /predict por código de respuesta",
+                         "# TYPE inspeccion_serve_requests_total counter"]
+                with counts_lock:
+                    lines += [f'inspeccion_serve_requests_total{{code="{k}"}} {v}' for k, v in sorted(counts.items())]
+                if batcher:
+                    stats = batcher.stats()
+                    lines += ["# TYPE inspeccion_serve_queue_depth gauge",
+                              f"inspeccion_serve_queue_depth {stats['queue_depth']}",
+                              "# TYPE inspeccion_serve_batches_total counter",
+                              f"inspeccion_serve_batches_total {stats['batches']}",
+                              "# TYPE inspeccion_serve_batch_images_total counter",
+                              f"inspeccion_serve_batch_images_total {stats['images']}"]
+                body = ("\n".join(lines) + "\n").encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_json(404, {"error": "no encontrado"})
+
+        def reply_error(self, code, message, headers=None):
+            count(code)
+            self.send_json(code, {"error": message}, headers)
+
+        def do_POST(self):
+            t0 = time.perf_counter()
+            url = urlparse(self.path)
+            if url.path != "/predict":
+                self.close_connection = True  # el cuerpo no se lee
+                self.send_json(404, {"error": "no encontrado"})
+                return
+            length = self.headers.get("Content-Length")
+            if length is None:
+                self.close_connection = True
+                self.reply_error(411, "falta Content-Length")
+                return
+            try:
+                length = int(length)
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                self.close_connection = True
+                self.reply_error(400, "Content-Length no válido")
+                return
+            if length > args.max_mb * 1024 * 1024:
+                self.close_connection = True  # el cuerpo no se lee
+                self.reply_error(413, f"imagen mayor de {args.max_mb} MB")
+                return
+            body = self.rfile.read(length)
+            batcher = state["batcher"]
+            if batcher is None:
+                self.reply_error(503, "modelo cargando", {"Retry-After": "5"})
+                return
+            query = parse_qs(url.query)
+            try:
+                conf = float(query.get("conf", [args.conf])[0])
+            except ValueError:
+                self.reply_error(400, "conf no válido")
+                return
+            source = query.get("source", [self.client_address[0]])[0]
+
+            t_decode = time.perf_counter()
+            data = read_request_image(self.headers, body)
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data else None
+            if image is None:
+                self.reply_error(400, "no se pudo decodificar la imagen")
+                return
+            decode_ms = (time.perf_counter() - t_decode) * 1000.0
+            metrics.add("serve", "decode", decode_ms)
+            try:
+                future = batcher.submit(image, conf, source)
+            except queue.Full:
+                # Contrapresión: mejor rechazar rápido que acumular latencia
+                self.reply_error(503, "cola llena", {"Retry-After": "1"})
+                return
+            try:
+                boxes, info = future.result(timeout=args.timeout)
+            except FutureTimeout:
+                future.cancel()
+                self.reply_error(504, f"sin respuesta en {args.timeout} s")
+                return
+            except Exception as e:
+                self.reply_error(500, f"error de inferencia: {e}")
+                return
+            classes = {}
+            for b in boxes:
+                classes[b["class_name"]] = classes.get(b["class_name"], 0) + 1
+            total_ms = (time.perf_counter() - t0) * 1000.0
+            metrics.add("serve", "request", total_ms)
+            count(200)
+            self.send_json(200, {
+                "verdict": "NOK" if boxes else "OK",
+                "defects": len(boxes),
+                "classes": classes,
+                "boxes": boxes,
+                "image_size": [image.shape[1], image.shape[0]],
+                "model": state["model"],
+                "backend": state["backend"],
+                "batch_size": info["batch_size"],
+                "timing_ms": {"decode": round(decode_ms, 2), "queue": info["queue_ms"],
+                              "predict": info["predict_ms"], "total": round(total_ms, 2)},
+            })
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = max(128, args.queue_size * 2)  # backlog de conexiones: ráfagas de varias celdas a la vez
+
+    return Server((args.host, args.port), Handler)
+
+
+def run_serve(args):
+    """Modo servidor sin interfaz: modelo cargado una vez, POST /predict con imágenes y respuesta JSON."""
+    metrics = StageMetrics(args.metrics_window)
+    state = {"batcher": None, "model": os.path.basename(args.model), "backend": None, "started": time.time()}
+    # El servidor escucha antes de importar torch: /health responde ya y /ready indica cuándo hay modelo
+    server = make_serve_server(args, state, metrics)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[INFO] Servicio de inferencia en http://{args.host}:{args.port} (POST /predict, GET /health /ready /metrics)")
+    # Parada limpia también como servicio (SIGTERM), incluso durante la carga: se vacía el registro de defectos
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    load_ml()
+    device = args.device or ("cuda:0" if torch.cuda.is_available() else "cpu")
+    model, backend = load_inference_model(args.model, args.backend, args.imgsz, device)
+    if backend != "torch":
+        device = "cpu"
+    warm_s = warmup_model(model, args.imgsz, device, runs=2, batch=args.max_batch)
+    defect_log = DefectLog(args.db) if args.db else None
+    model_hash = file_sha256(args.model)[:16] if os.path.isfile(args.model) else None
+    state["backend"] = backend
+    state["batcher"] = MicroBatcher(model, args.imgsz, device, args.max_batch, args.max_wait_ms, args.queue_size,
+                                    metrics, defect_log, model_hash)
+    print(f"[OK] Modelo listo ({backend}, {device}, calentado en {warm_s:.1f} s) | lote máx {args.max_batch} | "
+          f"espera máx {args.max_wait_ms} ms | cola {args.queue_size}")
+    try:
+        while not stop.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        state["batcher"].close()
+        if defect_log:
+            defect_log.close()
+        stats = state["batcher"].stats()
+        print(f"[INFO] {stats['images']} imágenes en {stats['batches']} lotes (media {stats['mean_batch']} por lote)")
+    return 0
+
+
+def build_arg_parser():
+    settings = read_settings()
+    parser = argparse.ArgumentParser(description="Sistema de Inspección Visual por IA. Sin subcomando abre la interfaz gráfica.")
+    parser.add_argument("--exit-after-startup", action="store_true",
+                        help="Abrir la interfaz, registrar la traza de arranque y salir (para comparar versiones)")
+    sub = parser.add_subparsers(dest="command")
+
+    batch = sub.add_parser("batch", help="Inspección por lotes de una carpeta o patrón glob de imágenes, sin interfaz")
+    batch.add_argument("input", help="Carpeta (recursiva) o patrón glob, p. ej. \"fotos/**/*.jpg\"")
+    batch.add_argument("-o", "--output", default="resultados_lote", help="Carpeta de salida (default: resultados_lote)")
+    batch.add_argument("--model", default=settings.get("MODEL_PATH", "best.pt"))
+    batch.add_argument("--conf", type=float, default=float(settings.get("CONFIDENCE", 0.30)))
+    batch.add_argument("--imgsz", type=int, default=int(settings.get("IMGSZ", 640)))
+    batch.add_argument("--backend", choices=BACKENDS, default=settings.get("BACKEND", "torch"))
+    batch.add_argument("--batch-size", type=int, default=16)
+    batch.add_argument("--workers", type=int, default=0, help="Procesos de decodificación (0 = núcleos - 1)")
+    batch.add_argument("--device", default=None, help="p. ej. cpu o cuda:0 (default: automático)")
+    batch.add_argument("--format", choices=("csv", "json"), default="csv")
+    batch.add_argument("--annotate", action="store_true", help="Guardar también las imágenes anotadas")
+    batch.add_argument("--tile", type=int, default=0, help="Inferencia por mosaicos de este tamaño, en lotes de --batch-size (0 = desactivada)")
+    batch.add_argument("--tile-overlap", type=float, default=0.2)
+
+    video = sub.add_parser("video", help="Análisis de un video grabado a la máxima velocidad del modelo, sin interfaz")
+    video.add_argument("input", help="Archivo de video")
+    video.add_argument("-o", "--output", default="resultados_video", help="Carpeta de salida (default: resultados_video)")
+    video.add_argument("--model", default=settings.get("MODEL_PATH", "best.pt"))
+    video.add_argument("--conf", type=float, default=float(settings.get("CONFIDENCE", 0.30)))
+    video.add_argument("--imgsz", type=int, default=int(settings.get("IMGSZ", 640)))
+    video.add_argument("--backend", choices=BACKENDS, default=settings.get("BACKEND", "torch"))
+    video.add_argument("--batch-size", type=int, default=8)
+    video.add_argument("--queue-size", type=int, default=32, help="Frames máximos en cola entre etapas")
+    video.add_argument("--device", default=None, help="p. ej. cpu o cuda:0 (default: automático)")
+    video.add_argument("--annotate", action="store_true", help="Escribir también el video anotado")
+    video.add_argument("--procs", type=int, default=int(settings.get("INFERENCE_WORKERS", 0)),
+                       help="Réplicas del modelo en procesos separados, solo CPU (0 = inferencia en este proceso)")
+    video.add_argument("--worker-threads", type=int, default=int(settings.get("WORKER_THREADS", 0)),
+                       help="Hilos de torch por proceso (0 = núcleos / procesos)")
+
+    defects = sub.add_parser("defects", help="Consulta el registro de defectos: tasa por turno o exportación")
+    defects.add_argument("--db", default=settings.get("DEFECT_DB") or "defectos.db")
+    defects.add_argument("--since", default=None, help="Desde (ISO, p. ej. 2024-05-01 o 2024-05-01T06:00)")
+    defects.add_argument("--until", default=None, help="Hasta (ISO, excluido)")
+    defects.add_argument("--source", default=None, help="Solo esta fuente")
+    defects.add_argument("--class", dest="cls", default=None, help="Solo esta clase de defecto")
+    defects.add_argument("--shifts", default=settings.get("SHIFTS", "06-14,14-22,22-06"), help="Turnos en horas locales")
+    defects.add_argument("--export", default=None, help="Exportar las detecciones a .csv o .jsonl en lugar del resumen")
+
+    stream = sub.add_parser("test-stream", help="Sirve un video local como stream MJPEG por HTTP para probar la reconexión")
+    stream.add_argument("input", help="Archivo de video (se reproduce en bucle)")
+    stream.add_argument("--host", default="127.0.0.1")
+    stream.add_argument("--port", type=int, default=8554)
+    stream.add_argument("--outage-every", type=float, default=0, help="Simular un corte cada N segundos (0 = nunca)")
+    stream.add_argument("--outage-s", type=float, default=5, help="Duración de cada corte simulado")
+    stream.add_argument("--freeze-after", type=float, default=0, help="Congelar la imagen pasados N segundos (0 = nunca)")
+
+    quant = sub.add_parser("quantize", help="Calibra un modelo INT8 para CPU con imágenes propias e informa de precisión y velocidad frente a FP32")
+    quant.add_argument("--model", default=settings.get("MODEL_PATH", "best.pt"))
+    quant.add_argument("--backend", choices=QUANT_BACKENDS, default="onnx-int8")
+    quant.add_argument("--calib", default=settings.get("QUANT_CALIB_DIR", "calibracion"), help="Carpeta o patrón glob de imágenes de calibración")
+    quant.add_argument("--eval", default=None, help="Imágenes de evaluación (con etiquetas YOLO para mAP); por defecto las de calibración")
+    quant.add_argument("--calib-images", type=int, default=200)
+    quant.add_argument("--eval-images", type=int, default=200)
+    quant.add_argument("--imgsz", type=int, default=int(settings.get("IMGSZ", 640)))
+    quant.add_argument("--conf", type=float, default=float(settings.get("CONFIDENCE", 0.30)), help="Umbral de producción para la concordancia")
+    quant.add_argument("--iou", type=float, default=0.5, help="IoU mínimo para emparejar cajas FP32 e INT8")
+    quant.add_argument("--min-agreement", type=float, default=0.95, help="F1 mínimo de concordancia con FP32 para aprobar")
+    quant.add_argument("--min-detections", type=int, default=30,
+                       help="Detecciones FP32 mínimas (al umbral --conf) para poder aprobar sin etiquetas")
+    quant.add_argument("--max-map-drop", type=float, default=0.01, help="Caída máxima de mAP50 frente a FP32 (si hay etiquetas)")
+    quant.add_argument("--quantize-head", action="store_true", help="Cuantizar también la decodificación de la cabeza (solo onnx-int8)")
+    quant.add_argument("-o", "--output", default="informe_cuantizacion.json")
+
+    serve = sub.add_parser("serve", help="Servicio HTTP local de inferencia: POST /predict con una imagen, respuesta JSON")
+    serve.add_argument("--model", default=settings.get("MODEL_PATH", "best.pt"))
+    serve.add_argument("--backend", choices=BACKENDS, default=settings.get("BACKEND", "torch"))
+    serve.add_argument("--conf", type=float, default=float(settings.get("CONFIDENCE", 0.30)), help="Umbral por defecto (?conf= lo cambia por petición)")
+    serve.add_argument("--imgsz", type=int, default=int(settings.get("IMGSZ", 640)))
+    serve.add_argument("--device", default=None, help="p. ej. cpu o cuda:0 (default: automático)")
+    serve.add_argument("--host", default=settings.get("SERVE_HOST", "127.0.0.1"), help="0.0.0.0 para aceptar peticiones de otros equipos")
+    serve.add_argument("--port", type=int, default=int(settings.get("SERVE_PORT", 8600)))
+    serve.add_argument("--max-batch", type=int, default=int(settings.get("SERVE_MAX_BATCH", 8)), help="Imágenes máximas por predict")
+    serve.add_argument("--max-wait-ms", type=float, default=float(settings.get("SERVE_MAX_WAIT_MS", 10)),
+                       help="Espera máxima desde la primera petición para completar el lote")
+    serve.add_argument("--queue-size", type=int, default=int(settings.get("SERVE_QUEUE", 64)), help="Peticiones en espera antes de responder 503")
+    serve.add_argument("--timeout", type=float, default=30.0, help="Segundos máximos por petición antes de responder 504")
+    serve.add_argument("--max-mb", type=float, default=25.0, help="Tamaño máximo de la imagen")
+    serve.add_argument("--db", default=settings.get("DEFECT_DB") or None, help="Registrar las detecciones en esta base de defectos")
+    serve.add_argument("--metrics-window", type=int, default=int(settings.get("METRICS_WINDOW", 1000)))
+
+    bench = sub.add_parser("bench", help="Benchmark reproducible de las etapas de la inspección, sin interfaz")
+    bench.add_argument("-o", "--output", default="benchmark.json", help="Archivo JSON de resultados (default: benchmark.json)")
+    bench.add_argument("--model", default=BENCH_MODEL, help=f"Modelo a medir (default: {BENCH_MODEL}, generado sin descargas)")
+    bench.add_argument("--backend", choices=BACKENDS, default="torch")
+    bench.add_argument("--conf", type=float, default=0.25)
+    bench.add_argument("--imgsz", type=int, default=640)
+    bench.add_argument("--device", default=None, help="p. ej. cpu o cuda:0 (default: automático)")
+    bench.add_argument("--resolutions", default=BENCH_RESOLUTIONS, help=f"Resoluciones AnchoxAlto separadas por comas (default: {BENCH_RESOLUTIONS})")
+    bench.add_argument("--frames", type=int, default=30, help="Frames por resolución")
+    bench.add_argument("--video", default=None, help="Usar frames de este video grabado en lugar de sintéticos")
+    bench.add_argument("--warmup", type=int, default=2)
+    bench.add_argument("--weld-size", default="5472x3648", help="Tamaño de la foto sintética de soldadura")
+    bench.add_argument("--weld-image", default=None, help="Usar esta foto de soldadura en lugar de una sintética")
+    bench.add_argument("--weld-runs", type=int, default=3, help="Repeticiones de analyze_weld (0 = omitir)")
+    bench.add_argument("--tile", type=int, default=640)
+    bench.add_argument("--batch-size", type=int, default=8, help="Mosaicos por lote en analyze_weld")
+    bench.add_argument("--procs", default="", help="Medir InferencePool con estos números de procesos, p. ej. 1,2,4,8 (solo CPU)")
+    bench.add_argument("--baseline", default=None, help="JSON de referencia con el que comparar")
+    bench.add_argument("--save-baseline", default=None, help="Guardar también estos resultados como referencia")
+    bench.add_argument("--tolerance", type=float, default=0.10, help="Margen sobre el p50 de referencia antes de marcar regresión")
+    bench.add_argument("--fail-on-regression", action="store_true", help="Código de salida 1 si hay regresiones")
+    return parser
+
+
+def main(argv=None):
+    startup = StartupTrace(None)
+    startup.mark("imports")
+    args = build_arg_parser().parse_args(argv)
+    if args.command in ("batch", "video", "bench", "quantize"):
+        load_ml()
+    if args.command == "batch":
+        return run_batch(args)
+    if args.command == "video":
+        return run_video(args)
+    if args.command == "bench":
+        return run_benchmark(args)
+    if args.command == "quantize":
+        return run_quantize(args)
+    if args.command == "serve":
+        return run_serve(args)
+    if args.command == "defects":
+        return run_defects(args)
+    if args.command == "test-stream":
+        return run_test_stream(args)
+
+    settings = read_settings()
+    startup.path = settings.get("STARTUP_TRACE", os.path.join(settings.get("METRICS_DIR", "metrics"), "startup.jsonl"))
     app = Tk()
     app.configure(background="#e6e6e6")  # Fondo principal
-    YoloCamApp(app)
+    startup.mark("tk")
+    YoloCamApp(app, startup, exit_after_startup=args.exit_after_startup)
     app.mainloop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
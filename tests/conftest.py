@@ -0,0 +1,29 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_cam_yolo_gui as app  # noqa: E402
+
+NAMES = {0: "poro", 1: "grieta"}
+
+
+@pytest.fixture(scope="session")
+def ml():
+    """torch y Ultralytics cargados (Results, tensores); sin ellos se omiten las pruebas que los usan."""
+    pytest.importorskip("torch")
+    pytest.importorskip("ultralytics")
+    app.load_ml()
+    return app
+
+
+@pytest.fixture
+def make_result(ml):
+    """Results a partir de cajas en bruto (x1, y1, x2, y2, confianza, clase) sobre una imagen negra."""
+    def make(boxes, shape=(480, 640)):
+        image = np.zeros((*shape, 3), dtype=np.uint8)
+        return ml.boxes_result(image, np.array(boxes, dtype=np.float32).reshape(-1, 6), NAMES)
+    return make
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+def test_compare_detections_match(ml, make_result):
+    ref = make_result([[10, 10, 100, 100, 0.8, 0]])
+    cand = make_result([[11, 10, 100, 101, 0.78, 0]])
+    ok, summary = ml.compare_detections(ref, cand, 0.05)
+    assert ok and summary["matched"] == 1 and not summary["inconclusive"]
+
+
+def test_compare_detections_missing_extra_and_confidence_drift(ml, make_result):
+    ref = make_result([[10, 10, 100, 100, 0.8, 0]])
+    ok, summary = ml.compare_detections(ref, make_result([]), 0.05)
+    assert not ok and summary["missing"] == 1
+    ok, summary = ml.compare_detections(make_result([]), ref, 0.05)
+    assert not ok and summary["extra"] == 1 and not summary["inconclusive"]
+    ok, summary = ml.compare_detections(ref, make_result([[10, 10, 100, 100, 0.6, 0]]), 0.05)
+    assert not ok and summary["max_conf_diff"] > 0.05
+    # Otra clase en el mismo sitio no empareja
+    ok, summary = ml.compare_detections(ref, make_result([[10, 10, 100, 100, 0.8, 1]]), 0.05)
+    assert not ok and summary["matched"] == 0
+
+
+def test_compare_detections_tolerates_boxes_at_the_threshold(ml, make_result):
+    # Cajas justo por encima del umbral pueden aparecer solo en un lado
+    ref = make_result([[10, 10, 100, 100, 0.8, 0], [200, 200, 250, 250, 0.07, 1]])
+    cand = make_result([[10, 10, 100, 100, 0.8, 0]])
+    ok, _ = ml.compare_detections(ref, cand, 0.05)
+    assert ok
+
+
+def test_compare_detections_without_boxes_is_inconclusive(ml, make_result):
+    empty = make_result([])
+    ok, summary = ml.compare_detections(empty, empty, 0.05)
+    assert not ok and summary["inconclusive"]
+    # Solo cajas en el borde del umbral: tampoco se ha comparado nada
+    weak = make_result([[10, 10, 100, 100, 0.06, 0]])
+    ok, summary = ml.compare_detections(weak, empty, 0.05)
+    assert not ok and summary["inconclusive"]
+
+
+def test_verify_backend_uses_one_confidence_tolerance(ml, make_result):
+    class Model:
+        def __init__(self, conf):
+            self.conf = conf
+
+        def predict(self, image, **kwargs):
+            return [make_result([[10, 10, 100, 100, self.conf, 0]])]
+
+    images = [np.zeros((64, 64, 3), dtype=np.uint8)]
+    status, summary = ml.verify_backend(Model(0.8), Model(0.72), 640, "cpu", images)
+    assert status == "mismatch"
+    status, summary = ml.verify_backend(Model(0.8), Model(0.72), 640, "cpu", images, conf_tol=0.1)
+    assert status == "ok" and summary["matched"] == 1
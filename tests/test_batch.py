@@ -0,0 +1,19 @@
+import app_cam_yolo_gui as app
+
+
+def test_batch_writer_resume_retries_failed_images(tmp_path):
+    for fmt in ("csv", "json"):
+        out = str(tmp_path / fmt)
+        writer = app.BatchWriter(out, fmt)
+        assert writer.completed() == set()
+        box = {"class_id": 0, "class_name": "poro", "confidence": 0.9, "box": [1, 2, 3, 4]}
+        writer.write([{"image": "a.jpg", "defects": 1, "classes": {"poro": 1}, "boxes": [box]},
+                      {"image": "b.jpg", "defects": -1, "classes": {}, "boxes": [], "error": "no se pudo leer"}])
+        writer = app.BatchWriter(out, fmt)
+        assert writer.completed() == {"a.jpg"} and writer.failed == 1
+        # Al reintentar no queda la fila fallida duplicada
+        writer.write([{"image": "b.jpg", "defects": 0, "classes": {}, "boxes": []}])
+        writer = app.BatchWriter(out, fmt)
+        assert writer.completed() == {"a.jpg", "b.jpg"} and writer.failed == 0
+        with open(writer.images_path, encoding="utf-8") as f:
+            assert len(f.readlines()) == (2 if fmt == "json" else 3)
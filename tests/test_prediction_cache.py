@@ -0,0 +1,25 @@
+import numpy as np
+
+import app_cam_yolo_gui as app
+
+
+def test_prediction_cache_round_trip_and_refilter(tmp_path, ml):
+    cache = app.PredictionCache(str(tmp_path), max_mb=10, floor=0.05)
+    raw = np.array([[0, 0, 10, 10, 0.9, 0], [5, 5, 20, 20, 0.1, 1]], dtype=np.float32)
+    key = cache.key("archivo", "modelo", 640, "[]", "torch-fp32-cpu")
+    assert cache.get(key, 3) is None
+    cache.put(key, 3, raw)
+    np.testing.assert_array_equal(cache.get(key, 3), raw)
+    # Mover el slider solo vuelve a filtrar las cajas en bruto
+    image = np.zeros((32, 32, 3), dtype=np.uint8)
+    assert len(ml.boxes_result(image, cache.get(key, 3), {0: "a", 1: "b"}, conf=0.5).boxes) == 1
+    assert len(ml.boxes_result(image, cache.get(key, 3), {0: "a", 1: "b"}, conf=0.05).boxes) == 2
+    cache.close()
+
+
+def test_prediction_cache_key_depends_on_backend_and_variant(tmp_path):
+    cache = app.PredictionCache(str(tmp_path))
+    base = cache.key("f", "m", 640, "[]", "torch-fp32-cpu")
+    assert base != cache.key("f", "m", 640, "[]", "onnx-int8-cpu-abc")
+    assert base != cache.key("f", "m", 640, "[640, 0.2]", "torch-fp32-cpu")
+    assert base != cache.key("f", "m", 512, "[]", "torch-fp32-cpu")
@@ -0,0 +1,27 @@
+import time
+
+import app_cam_yolo_gui as app
+
+
+def test_quality_controller_steps_down_and_back_up():
+    qc = app.QualityController(15, max_imgsz=640, min_imgsz=512, max_stride=2, hold_s=1.0, log=lambda msg: None)
+    t = time.time() + 10
+    assert (qc.imgsz, qc.stride) == (640, 1)
+    changed = [qc.update(0.2, 1, t + i * 0.1) for i in range(30)]  # 5 FPS, objetivo 15
+    assert any(changed) and qc.level > 0
+    while qc.level < len(qc.levels) - 1:
+        t += 5
+        for i in range(30):
+            qc.update(0.2, 1, t + i * 0.1)
+    assert (qc.imgsz, qc.stride) == (512, 2)
+    t += 5
+    for i in range(100):
+        qc.update(0.01, 1, t + i * 0.1)  # 100 FPS: sobra margen
+    assert qc.level < len(qc.levels) - 1
+
+
+def test_quality_controller_holds_inside_the_band():
+    qc = app.QualityController(15, hold_s=1.0, log=lambda msg: None)
+    t = time.time() + 10
+    assert not any(qc.update(1 / 16, 1, t + i * 0.1) for i in range(100))
+    assert qc.level == 0
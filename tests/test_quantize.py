@@ -0,0 +1,58 @@
+import numpy as np
+
+import app_cam_yolo_gui as app
+
+
+def totals(reference, candidate, matched):
+    return {"reference": reference, "candidate": candidate, "matched": matched}
+
+
+def agreement(reference, candidate, matched):
+    precision, recall, f1 = app.agreement_scores(totals(reference, candidate, matched))
+    return {**totals(reference, candidate, matched), "precision": precision, "recall": recall, "f1": f1}
+
+
+def accuracy(fp32, int8):
+    return {"fp32": {"map50": fp32}, "int8": {"map50": int8}}
+
+
+def test_agreement_scores():
+    precision, recall, f1 = app.agreement_scores(totals(100, 100, 95))
+    assert (precision, recall) == (0.95, 0.95) and abs(f1 - 0.95) < 1e-9
+    assert app.agreement_scores(totals(0, 0, 0))[2] is None  # nada que comparar: sin F1
+    assert app.agreement_scores(totals(0, 5, 0))[2] == 0.0
+
+
+def test_verdict_approves_with_enough_detections():
+    status, checks = app.quantization_verdict(agreement(100, 100, 98), None, 0.95, 0.01, 30)
+    assert status == "approved" and checks == {"agreement_f1": True}
+
+
+def test_verdict_rejects_low_agreement_or_map_drop():
+    assert app.quantization_verdict(agreement(100, 100, 80), None, 0.95, 0.01, 30)[0] == "rejected"
+    status, checks = app.quantization_verdict(agreement(100, 100, 99), accuracy(0.60, 0.55), 0.95, 0.01, 30)
+    assert status == "rejected" and checks["map50_drop"] is False
+    # INT8 que inventa cajas donde FP32 no ve nada: rechazado, no "sin evidencia"
+    assert app.quantization_verdict(agreement(0, 12, 0), None, 0.95, 0.01, 30)[0] == "rejected"
+
+
+def test_verdict_without_detections_is_inconclusive():
+    status, checks = app.quantization_verdict(agreement(0, 0, 0), None, 0.95, 0.01, 30)
+    assert status == "inconclusive" and checks == {}
+    assert app.quantization_verdict(agreement(10, 10, 10), None, 0.95, 0.01, 30)[0] == "inconclusive"
+    # Con etiquetas pero un FP32 que no acierta nada tampoco hay evidencia
+    assert app.quantization_verdict(agreement(0, 0, 0), accuracy(0.0, 0.0), 0.95, 0.01, 30)[0] == "inconclusive"
+
+
+def test_verdict_labelled_set_is_enough_evidence():
+    status, checks = app.quantization_verdict(agreement(10, 10, 10), accuracy(0.70, 0.695), 0.95, 0.01, 30)
+    assert status == "approved" and checks == {"agreement_f1": True, "map50_drop": True}
+
+
+def test_mean_average_precision():
+    targets = [np.array([[0, 0, 10, 10, 0], [20, 20, 30, 30, 0]], dtype=np.float32)]
+    perfect = [np.array([[0, 0, 10, 10, 0.9, 0], [20, 20, 30, 30, 0.8, 0]], dtype=np.float32)]
+    assert app.mean_average_precision(perfect, targets) == 1.0
+    half = [np.array([[0, 0, 10, 10, 0.9, 0]], dtype=np.float32)]
+    assert abs(app.mean_average_precision(half, targets) - 0.5) < 1e-9
+    assert app.mean_average_precision(perfect, [np.zeros((0, 5), dtype=np.float32)]) is None
@@ -0,0 +1,33 @@
+import json
+import os
+import time
+
+import app_cam_yolo_gui as app
+
+
+def write(path, size, mtime):
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_remote_cache_evicts_least_recently_used(tmp_path):
+    cache = app.RemoteVideoCache(str(tmp_path), max_mb=2.5 / 1024)  # 2.5 KiB
+    now = time.time()
+    for i, key in enumerate(("viejo", "medio", "nuevo")):
+        path = cache.path(key, "mp4")
+        write(path, 1024, now - 100 + i)
+        with open(cache.marker(key), "w", encoding="utf-8") as f:
+            json.dump({"path": path}, f)
+        os.utime(cache.marker(key), (now - 100 + i, now - 100 + i))
+    os.utime(cache.marker("viejo"))  # usado ahora: pasa a ser el más reciente
+    cache.evict()
+    assert cache.lookup("viejo") and cache.lookup("nuevo")
+    assert cache.lookup("medio") is None and not os.path.exists(cache.path("medio", "mp4"))
+
+
+def test_remote_cache_keeps_downloads_in_progress(tmp_path):
+    cache = app.RemoteVideoCache(str(tmp_path), max_mb=0)
+    write(cache.path("bajando", "mp4"), 4096, time.time())
+    cache.evict()
+    assert os.path.exists(cache.path("bajando", "mp4"))
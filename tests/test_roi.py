@@ -0,0 +1,12 @@
+import app_cam_yolo_gui as app
+
+
+def test_clip_rois_to_the_frame():
+    assert app.clip_rois([(0, 380, 1920, 700)], 640, 480) == [(0, 380, 640, 480)]
+    assert app.clip_rois([(700, 500, 900, 600)], 640, 480) == []  # fuera del frame
+    assert app.clip_rois([(50, 60, 10, 20)], 640, 480) == [(10, 20, 50, 60)]  # esquinas invertidas
+    assert app.clip_rois([(0, 0, 5, 100)], 640, 480) == []  # demasiado estrecha
+
+
+def test_scale_rois():
+    assert app.scale_rois([[100, 200, 300, 400]], 0.5) == [[50, 100, 150, 200]]
@@ -0,0 +1,68 @@
+import http.client
+import socket
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import app_cam_yolo_gui as app
+
+
+@pytest.fixture
+def server():
+    args = SimpleNamespace(host="127.0.0.1", port=0, queue_size=8, max_mb=1, conf=0.3, timeout=5)
+    state = {"batcher": None, "model": "m.pt", "backend": None, "started": 0.0}
+    srv = app.make_serve_server(args, state, app.StageMetrics(100))
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_unknown_post_path_does_not_break_the_connection(server):
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=5)
+    body = b"POST /predict HTTP/1.1\r\n\r\n"  # un cuerpo sin leer se tomaría como la siguiente petición
+    conn.request("POST", "/nope", body=body)
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 404
+    conn.request("POST", "/predict", body=b"x")
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 503  # modelo cargando, no un 400/501 por restos del cuerpo anterior
+    conn.close()
+
+
+def test_pipelined_requests_after_unknown_post_path(server):
+    with socket.create_connection(server.server_address, timeout=5) as sock:
+        sock.sendall(b"POST /nope HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n\r\nGET /"
+                     b"POST /predict HTTP/1.1\r\nHost: x\r\nContent-Length: 1\r\n\r\nx")
+        data = b""
+        while chunk := sock.recv(65536):
+            data += chunk
+    assert data.startswith(b"HTTP/1.1 404")
+    assert data.count(b"HTTP/1.1 ") == 1
+
+
+def test_batcher_failure_on_one_request_does_not_hang_the_others(make_result):
+    class Model:
+        names = {0: "poro", 1: "grieta"}
+
+        def predict(self, images, **kwargs):
+            return [make_result([[10, 10, 100, 100, 0.9, 0]]) for _ in images]
+
+    class Log:
+        def record(self, ts, source, seq, result, names, model_hash):
+            if source == "mala":
+                raise OSError("disco lleno")
+
+    batcher = app.MicroBatcher(Model(), 640, "cpu", max_batch=4, max_wait_ms=500, defect_log=Log())
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+    futures = [batcher.submit(image, 0.3, source) for source in ("buena", "mala", "otra")]
+    boxes, info = futures[0].result(timeout=5)
+    assert len(boxes) == 1 and info["batch_size"] == 3
+    with pytest.raises(OSError):
+        futures[1].result(timeout=5)
+    assert len(futures[2].result(timeout=5)[0]) == 1
+    batcher.close()
@@ -0,0 +1,59 @@
+import numpy as np
+
+import app_cam_yolo_gui as app
+
+NAMES = {0: "poro", 1: "grieta"}
+
+
+def test_tile_origins_cover_the_axis_and_end_at_the_border():
+    assert app.tile_origins(500, 640, 512) == [0]
+    starts = app.tile_origins(1500, 640, 512)
+    assert starts == [0, 512, 860]
+    assert starts[-1] + 640 == 1500
+
+
+def test_merge_detections_suppresses_per_class_only():
+    boxes = np.array([[0, 0, 100, 100], [5, 5, 105, 105], [0, 0, 100, 100]], dtype=np.float32)
+    scores = np.array([0.9, 0.8, 0.7], dtype=np.float32)
+    classes = np.array([0, 0, 1], dtype=np.float32)
+    keep = app.merge_detections(boxes, scores, classes)
+    assert sorted(keep.tolist()) == [0, 2]
+
+
+def test_merge_detections_drops_a_box_cut_by_the_tile_border():
+    # La caja recortada por el borde del mosaico queda dentro de la completa: IoU bajo pero IoS alto
+    boxes = np.array([[100, 100, 300, 200], [100, 100, 140, 200]], dtype=np.float32)
+    keep = app.merge_detections(boxes, np.array([0.6, 0.9], dtype=np.float32), np.zeros(2, dtype=np.float32))
+    assert keep.tolist() == [1]
+
+
+def test_merge_detections_empty():
+    assert len(app.merge_detections(np.zeros((0, 4)), np.zeros(0), np.zeros(0))) == 0
+
+
+def test_combine_offset_results_maps_crops_to_frame_coordinates(ml, make_result):
+    image = np.zeros((720, 1280, 3), dtype=np.uint8)
+    left = make_result([[10, 20, 110, 120, 0.9, 0]], shape=(640, 640))
+    right = make_result([[5, 5, 50, 50, 0.8, 1]], shape=(640, 640))
+    merged = ml.combine_offset_results(image, NAMES, [(left, 0, 0), (right, 640, 80)])
+    data = merged.boxes.data.cpu().numpy()
+    data = data[np.argsort(-data[:, 4])]
+    np.testing.assert_allclose(data[:, :4], [[10, 20, 110, 120], [645, 85, 690, 130]])
+    assert data[:, 5].tolist() == [0, 1]
+    assert merged.orig_shape == (720, 1280)
+
+
+def test_combine_offset_results_merges_duplicates_from_overlapping_tiles(ml, make_result):
+    image = np.zeros((640, 1152, 3), dtype=np.uint8)
+    # El mismo defecto visto por dos mosaicos solapados (orígenes 0 y 512)
+    a = make_result([[550, 100, 600, 150, 0.9, 0]], shape=(640, 640))
+    b = make_result([[40, 102, 90, 151, 0.7, 0]], shape=(640, 640))
+    merged = ml.combine_offset_results(image, NAMES, [(a, 0, 0), (b, 512, 0)])
+    assert len(merged.boxes) == 1
+    assert float(merged.boxes.conf[0]) == np.float32(0.9)
+
+
+def test_combine_offset_results_without_boxes(ml, make_result):
+    image = np.zeros((100, 100, 3), dtype=np.uint8)
+    merged = ml.combine_offset_results(image, NAMES, [(make_result([], shape=(100, 100)), 0, 0)])
+    assert len(merged.boxes) == 0